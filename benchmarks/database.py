@@ -0,0 +1,280 @@
+"""Repository benchmark
+
+Fills the database with generated beams, wormholes and users and measures repository
+operations: wall time, number of Redis commands and bytes sent and received per call.
+Object caches are cleared before every call, unless the operation name says otherwise.
+
+Run from the bot directory:
+
+    python3 -m benchmarks.database --backend fake --sizes 1000 10000
+    python3 -m benchmarks.database --backend redis --db 15 --output results.json
+
+The redis backend uses the connection from config.json with the database number given
+by --db, which is FLUSHED. The fake backend needs the fakeredis package (and lupa for
+Lua scripts).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from core import database
+
+BEAMS = 10
+
+
+class Stats:
+    commands = 0
+    sent = 0
+    received = 0
+
+    @classmethod
+    def reset(cls):
+        cls.commands = cls.sent = cls.received = 0
+
+
+def _resp_size(response) -> int:
+    """Get size of the response in RESP2 protocol"""
+    if response is None:
+        return 5
+    if isinstance(response, bool):
+        return 4
+    if isinstance(response, int):
+        return len(str(response)) + 3
+    if isinstance(response, str):
+        response = response.encode()
+    if isinstance(response, (bytes, bytearray)):
+        return len(str(len(response))) + len(response) + 5
+    if isinstance(response, dict):
+        items = [x for item in response.items() for x in item]
+        return len(str(len(items))) + 3 + sum(_resp_size(x) for x in items)
+    if isinstance(response, (list, tuple, set)):
+        return len(str(len(response))) + 3 + sum(_resp_size(x) for x in response)
+    return len(str(response)) + 3
+
+
+def counting(connection_class: type) -> type:
+    """Create connection class counting commands and transferred bytes"""
+
+    class CountingConnection(connection_class):
+        def pack_command(self, *args):
+            Stats.commands += 1
+            return super().pack_command(*args)
+
+        async def send_packed_command(self, command, *args, **kwargs):
+            chunks = [command] if isinstance(command, (bytes, str)) else command
+            Stats.sent += sum(len(x) for x in chunks)
+            return await super().send_packed_command(command, *args, **kwargs)
+
+        async def read_response(self, *args, **kwargs):
+            response = await super().read_response(*args, **kwargs)
+            Stats.received += _resp_size(response)
+            return response
+
+    return CountingConnection
+
+
+async def create_backend(args: argparse.Namespace):
+    if args.backend == "memory":
+        from core.backends.memory import MemoryBackend
+
+        return MemoryBackend()
+    if args.backend == "sqlite":
+        from core.backends.sqlite import SQLiteBackend
+
+        return SQLiteBackend(":memory:")
+
+    from core.backends.redis import RedisBackend, connect
+
+    if args.backend == "fake":
+        import fakeredis
+        import redis.asyncio as redis
+
+        pool = redis.ConnectionPool(
+            connection_class=counting(fakeredis.FakeAsyncRedisConnection),
+            server=fakeredis.FakeServer(),
+            decode_responses=True,
+        )
+        client = redis.Redis(connection_pool=pool)
+    else:
+        client = connect({**database.config.get("redis", {}), "db": args.db})
+        client.connection_pool.connection_class = counting(client.connection_pool.connection_class)
+        await client.flushdb()
+
+    backend = RedisBackend(client)
+    await backend.open()
+    return backend
+
+
+async def fill(size: int):
+    """Create beams and the given number of wormholes and users"""
+    backend = database.backend
+    await backend.add_many(
+        "beam",
+        [
+            (f"beam{i}", {"active": 1, "admin_id": 0, "anonymity": "none", "replace": 1})
+            for i in range(BEAMS)
+        ],
+    )
+    for start in range(0, size, 1000):
+        wormholes = []
+        users = []
+        for i in range(start, min(start + 1000, size)):
+            beam = f"beam{i % BEAMS}"
+            wormholes.append((i, {"beam": beam, "active": 1, "readonly": 0, "messages": i}))
+            users.append(
+                (
+                    i,
+                    {
+                        "nickname": f"user{i}",
+                        "mod": int(i % 100 == 0),
+                        "readonly": 0,
+                        f"home_id:{beam}": i,
+                    },
+                )
+            )
+        await backend.add_many("wormhole", wormholes)
+        await backend.add_many("user", users)
+    await backend.reindex("wormhole")
+
+
+def operations(size: int) -> Dict[str, tuple]:
+    """Get operations to measure as name: (function, list of arguments)"""
+    rnd = random.Random(size)
+    ids = [rnd.randrange(size) for _ in range(200)]
+    beams = [f"beam{i}" for i in range(BEAMS)]
+    # deleted objects are not used by any other operation
+    deleted = rnd.sample(range(size), min(100, size))
+    b, w, u = database.repo_b, database.repo_w, database.repo_u
+
+    # fmt: off
+    return {
+        "repo_b.get":                    (b.get, beams),
+        "repo_w.get":                    (w.get, ids),
+        "repo_u.get":                    (u.get, ids),
+        "repo_u.get (cached)":           (u.get, ids),
+        "repo_u.get_by_nickname":        (u.get_by_nickname, [f"user{i}" for i in ids]),
+        "repo_u.is_nickname_used":       (u.is_nickname_used, [f"user{i}" for i in ids]),
+        "repo_b.list_objects":           (b.list_objects, [()]),
+        "repo_w.list_objects":           (w.list_objects, [()]),
+        "repo_w.list_objects (beam)":    (w.list_objects, beams),
+        "repo_u.list_objects":           (u.list_objects, [()]),
+        "repo_u.list_objects_by_beam":   (u.list_objects_by_beam, beams),
+        "repo_u.list_objects_by_wormhole": (u.list_objects_by_wormhole, ids),
+        "repo_u.list_objects_by_attribute": (u.list_objects_by_attribute, ["mod"]),
+        "repo_u.delete":                 (u.delete, deleted),
+        "repo_w.delete":                 (w.delete, deleted),
+    }
+    # fmt: on
+
+
+async def measure(function: Callable, arguments: List, cached: bool) -> Dict[str, float]:
+    if cached:
+        for argument in arguments:
+            await function(*_args(argument))
+
+    elapsed = 0.0
+    Stats.reset()
+    for argument in arguments:
+        if not cached:
+            for repository in (database.repo_b, database.repo_w, database.repo_u):
+                repository.cache.invalidate()
+        start = time.perf_counter()
+        await function(*_args(argument))
+        elapsed += time.perf_counter() - start
+
+    calls = len(arguments)
+    return {
+        "calls": calls,
+        "time": elapsed / calls,
+        "commands": Stats.commands / calls,
+        "sent": Stats.sent / calls,
+        "received": Stats.received / calls,
+    }
+
+
+def _args(argument) -> tuple:
+    return argument if isinstance(argument, tuple) else (argument,)
+
+
+async def run(args: argparse.Namespace) -> List[Dict]:
+    results = []
+    for size in args.sizes:
+        database.backend = await create_backend(args)
+        for repository in (database.repo_b, database.repo_w, database.repo_u):
+            repository.cache.invalidate()
+
+        start = time.perf_counter()
+        await fill(size)
+        print(f"size {size}: filled in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+
+        for name, (function, arguments) in operations(size).items():
+            if args.operations and not any(x in name for x in args.operations):
+                continue
+            result = await measure(function, arguments, cached="(cached)" in name)
+            result = {"size": size, "operation": name, **result}
+            if args.backend in ("memory", "sqlite"):
+                result.update(commands=None, sent=None, received=None)
+            results.append(result)
+            _print(result)
+
+        await database.backend.close()
+    return results
+
+
+def _print(result: Dict):
+    line = "{size:>7} {operation:<34} {time:>10.3f} ms".format(
+        **{**result, "time": result["time"] * 1000}
+    )
+    if result["commands"] is not None:
+        line += " {commands:>9.1f} cmd {sent:>11.0f} B out {received:>11.0f} B in".format(**result)
+    print(line, file=sys.stderr)
+
+
+def _commit() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            check=True,
+        )
+        return result.stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark database repositories")
+    parser.add_argument("--backend", choices=("fake", "redis", "memory", "sqlite"), default="fake")
+    parser.add_argument("--db", type=int, default=15, help="Redis database, it is flushed")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--operations", nargs="+", help="measure only matching operations")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report = {
+        "commit": _commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "backend": args.backend,
+        "python": platform.python_version(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+
+if __name__ == "__main__":
+    main()
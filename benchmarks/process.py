@@ -0,0 +1,173 @@
+"""Message processing benchmark
+
+Compares ``Wormhole._process`` with the previous implementation, which searched the
+content once per kind of mention and replaced every found mention in the whole content.
+Messages of growing length are filled with user, role and channel mentions, emojis and
+code blocks; the database is the in-memory backend.
+
+Run from the bot directory:
+
+    python3 -m benchmarks.process --lengths 200 2000 20000
+"""
+
+import argparse
+import asyncio
+import random
+import re
+import sys
+import time
+from types import SimpleNamespace
+from typing import Callable, List
+
+from core import database
+from core.backends.memory import MemoryBackend
+from core.runtime import runtime
+
+from cogs.wormhole import Wormhole
+
+USERS = 50
+
+
+async def legacy_process(self, message) -> str:
+    """Wormhole._process before the tokenizer"""
+    content = message.content
+
+    users = re.findall(r"<@!?[0-9]+>", content)
+    roles = re.findall(r"<@&[0-9]+>", content)
+    channels = re.findall(r"<#[0-9]+>", content)
+    emojis = re.findall(r"<:[a-zA-Z0-9_]+:[0-9]+>", content)
+
+    for u in users:
+        user_id = int(u.replace("<@!", "").replace("<@", "").replace(">", ""))
+        nickname = await database.repo_u.get_attribute(user_id, "nickname")
+        if nickname is not None:
+            user = "((" + nickname + "))"
+        else:
+            user = str(self.bot.get_user(user_id))
+        content = content.replace(u, user)
+    for r in roles:
+        role = message.guild.get_role(int(r.replace("<@&", "").replace(">", ""))).name
+        content = content.replace(r, role)
+    for channel in channels:
+        ch = self.bot.get_channel(int(channel.replace("<#", "").replace(">", "")))
+        channel_name = self.sanitise(ch.name)
+        guild_name = self.sanitise(ch.guild.name)
+        content = content.replace(channel, f"__**{guild_name}/{channel_name}**__")
+    for emoji in emojis:
+        emoji_ = emoji.replace("<:", "").replace(">", "")
+        emoji_name = emoji_.split(":")[0]
+        emoji_id = int(emoji_.split(":")[1])
+        if self.bot.get_emoji(emoji_id) is None:
+            content = content.replace(emoji, ":" + emoji_name + ":")
+
+    if "```" in content:
+        backticks = re.findall(r"```[a-z0-9]*", content)
+        for b in backticks:
+            content = content.replace(f" {b}", f"\n{b}", 1)
+            content = content.replace(f"{b} ", f"{b}\n", 1)
+
+    content_ = content.split("\n")
+    content = ""
+    p = await self._get_prefix(message)
+    code = False
+    for i in range(len(content_)):
+        if i == 1:
+            p = await self._get_prefix(message, first_line=False)
+        line = content_[i]
+        if i == 0 and line.startswith("```"):
+            content += await self._get_prefix(message) + "\n"
+        if line.startswith("```"):
+            code = True
+        if code:
+            content += line + "\n"
+        else:
+            content += p + line + "\n"
+        if line.endswith("```") and code:
+            code = False
+
+    return content.replace("@", "@\u200b")
+
+
+def create_cog() -> Wormhole:
+    """Create the cog without a running bot"""
+    guild = SimpleNamespace(name="Guild", get_role=lambda i: SimpleNamespace(name=f"role{i}"))
+    bot = SimpleNamespace(
+        get_user=lambda i: None,
+        get_channel=lambda i: SimpleNamespace(name=f"channel{i}", guild=guild),
+        get_emoji=lambda i: object() if i % 2 else None,
+    )
+    cog = object.__new__(Wormhole)
+    cog.bot = bot
+    runtime.attach(bot)
+    return cog
+
+
+async def fill():
+    database.backend = MemoryBackend()
+    await database.repo_b.add(name="main", admin_id=0)
+    await database.repo_w.add(beam="main", discord_id=1)
+    for i in range(USERS):
+        await database.repo_u.add(discord_id=100 + i, nickname=f"user{i}")
+
+
+def create_message(length: int) -> SimpleNamespace:
+    """Create message of about given length, roughly every fifth word is markup"""
+    rnd = random.Random(length)
+    # fmt: off
+    words = (
+        ["lorem", "ipsum", "dolor", "sit", "amet"] * 4
+        + [f"<@{100 + i}>" for i in range(10)]
+        + [f"<@!{100 + i}>" for i in range(10, 20)]
+        + ["<@&7>", "<#8>", "<:wave:3>", "<:gone:4>", "\n", "```py", "```"]
+    )
+    # fmt: on
+    content = []
+    size = 0
+    while size < length:
+        word = rnd.choice(words)
+        content.append(word)
+        size += len(word) + 1
+    return SimpleNamespace(
+        content=" ".join(content),
+        channel=SimpleNamespace(id=1),
+        author=SimpleNamespace(id=100, name="user0"),
+        guild=SimpleNamespace(name="Guild", get_role=lambda i: SimpleNamespace(name=f"role{i}")),
+    )
+
+
+async def measure(function: Callable, cog: Wormhole, message, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await function(cog, message)
+    return (time.perf_counter() - start) / repeat
+
+
+async def run(lengths: List[int], repeat: int):
+    await fill()
+    cog = create_cog()
+    print(f"{'length':>7} {'mentions':>8} {'previous':>12} {'current':>12} {'speedup':>8}")
+    for length in lengths:
+        message = create_message(length)
+        mentions = len(re.findall(r"<[@#:]", message.content))
+        # also warms up object caches
+        if await legacy_process(cog, message) != await Wormhole._process(cog, message):
+            print(f"length {length}: outputs differ", file=sys.stderr)
+
+        previous = await measure(legacy_process, cog, message, repeat)
+        current = await measure(Wormhole._process, cog, message, repeat)
+        print(
+            f"{length:>7} {mentions:>8} {previous * 1000:>9.3f} ms {current * 1000:>9.3f} ms "
+            f"{previous / current:>7.1f}x"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message processing")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[200, 2000, 20000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.lengths, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
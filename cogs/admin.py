@@ -1,11 +1,15 @@
+import os
 import re
 import json
+import tempfile
+from datetime import datetime
 
 import discord
 from discord.ext import commands
 
-from core import checks, errors, wormcog
-from core.database import repo_b, repo_u, repo_w
+from core import checks, errors, metrics, snapshot, wormcog
+from core.runtime import runtime
+from core.database import backend, repo_b, repo_u, repo_w
 
 config = json.load(open("config.json"))
 
@@ -29,22 +33,214 @@ class Admin(wormcog.Wormcog):
     @commands.command(name="announce")
     async def announce_(self, ctx, *, message):
         """Send announcement"""
-        await self.announce(beam=repo_w.get_attribute(ctx.channel.id, "beam"), message=message)
+        await self.announce(
+            beam=await repo_w.get_attribute(ctx.channel.id, "beam"), message=message
+        )
 
     @commands.check(checks.in_wormhole)
     @commands.check(checks.is_mod)
     @commands.command(name="block", aliases=["ban"])
     async def block(self, ctx, member: discord.Member):
         """Block discord user from sending messages"""
-        nickname = self.sanitise(member.name, limit=16).replace(")", "").replace("(", "")
-        nickname = self.get_free_nickname(nickname)
+        nickname = await repo_u.get_attribute(member.id, "nickname")
+        if nickname is None:
+            nickname = self.sanitise(member.name, limit=16).replace(")", "").replace("(", "")
+            nickname = await repo_u.add(discord_id=member.id, nickname=nickname)
+            await self.event.sudo(ctx, f"{str(await repo_u.get(member.id))}.")
 
-        if not repo_u.exists(discord_id=member.id):
-            self.user_add(ctx, member_id=member.id, nickname=nickname)
-
-        repo_u.set(discord_id=member.id, key="readonly", value=1)
+        await repo_u.set(discord_id=member.id, key="readonly", value=1)
         await self.event.sudo(ctx, f"User **{nickname}** blocked.")
 
+    @commands.check(checks.is_admin)
+    @commands.check(checks.not_in_wormhole)
+    @commands.command(name="migrate")
+    async def migrate(self, ctx):
+        """Convert database to current storage layout"""
+        beams = await repo_b.migrate()
+        wormholes = await repo_w.migrate()
+        users = await repo_u.migrate()
+
+        message = f"Migrated {beams} beams, {wormholes} wormholes and {users} users."
+
+        beams = await repo_b.reindex()
+        wormholes = await repo_w.reindex()
+        users = await repo_u.reindex()
+
+        message += f"\nIndexed {beams} beams, {wormholes} wormholes and {users} users."
+        await self.event.sudo(ctx, message)
+        await ctx.send(message)
+
+    @commands.check(checks.is_admin)
+    @commands.check(checks.not_in_wormhole)
+    @commands.command(name="queues")
+    async def queues(self, ctx, action: str = None):
+        """Display outgoing message queues"""
+        if action == "reset":
+            runtime.queues.reset()
+            return await ctx.send("> Queue counters cleared.")
+
+        template = "{name:<32} {kind:<7} {depth:>5} {sent:>6} {wait:>8.1f} {max_wait:>8.1f}"
+        result = [
+            "{:<32} {:<7} {:>5} {:>6} {:>8} {:>8}".format(
+                "channel", "kind", "depth", "sent", "avg ms", "max ms"
+            ),
+        ]
+        for (kind, channel_id), queue in runtime.queues.get()[:20]:
+            channel = self.bot.get_channel(channel_id)
+            name = f"{channel.guild.name}/{channel.name}" if channel else str(channel_id)
+            result.append(
+                template.format(
+                    name=name[:32],
+                    kind=kind,
+                    depth=queue.jobs.qsize(),
+                    sent=queue.sent,
+                    wait=queue.wait * 1000 / (queue.sent or 1),
+                    max_wait=queue.max_wait * 1000,
+                )
+            )
+
+        sent, wait, max_wait = runtime.queues.totals()
+        since = datetime.fromtimestamp(runtime.queues.since)
+        result.append(
+            f"\n{len(runtime.queues)} queues, {sent} messages sent since "
+            f"{since.strftime('%Y-%m-%d %H:%M:%S')}, "
+            f"{wait * 1000 / (sent or 1):.1f} ms average and {max_wait * 1000:.1f} ms maximal wait."
+        )
+        await ctx.send("```" + "\n".join(result) + "```")
+
+    @commands.check(checks.is_admin)
+    @commands.check(checks.not_in_wormhole)
+    @commands.group(name="database", aliases=["db"])
+    async def database(self, ctx):
+        """Inspect the database layer"""
+        # import has to download the attachment first
+        if getattr(ctx.invoked_subcommand, "name", None) != "import":
+            await self.delete(ctx)
+
+        if ctx.invoked_subcommand is not None:
+            return
+
+        description = config["prefix"] + "database…"
+        values = [
+            "cache",
+            "pool",
+            "usage [reset]",
+            "export [beam]",
+            "import",
+        ]
+
+        embed = self.get_embed(ctx=ctx, title="Database", description=description)
+        embed.add_field(name="Commands", value="```" + "\n".join(values) + "```")
+        embed.add_field(
+            name="Online help",
+            value="https://sinus-x.github.io/discord-wormhole/administration#database",
+            inline=False,
+        )
+        await ctx.send(embed=embed)
+
+    @database.command(name="cache")
+    async def database_cache(self, ctx):
+        """Display repository cache statistics"""
+        template = "{name:<9} {size:>5}/{limit} objects, {hits} hits, {misses} misses ({ratio:.1%})"
+
+        result = []
+        for name, repo in (("beams", repo_b), ("wormholes", repo_w), ("users", repo_u)):
+            lookups = repo.cache.hits + repo.cache.misses
+            result.append(
+                template.format(
+                    name=name,
+                    size=len(repo.cache),
+                    limit=repo.cache.size,
+                    hits=repo.cache.hits,
+                    misses=repo.cache.misses,
+                    ratio=repo.cache.hits / lookups if lookups else 0,
+                )
+            )
+        result.append(f"{'routes':<9} {len(runtime.routes):>5} wormholes")
+        result.append(f"{'webhooks':<9} {len(runtime.webhooks):>5} channels")
+        result.append(f"{'sent':<9} {len(runtime.sent):>5} relayed messages")
+        await ctx.send("```" + "\n".join(result) + "```")
+
+    @database.command(name="pool")
+    async def database_pool(self, ctx):
+        """Display Redis connection pool statistics"""
+        stats = backend.pool_stats()
+        if stats is None:
+            return await ctx.send("> Database backend does not use connection pool.")
+        wait = stats["wait"] / stats["acquired"] if stats["acquired"] else 0
+        await ctx.send(
+            "```"
+            f"{stats['in use']}/{stats['size']} connections in use, "
+            f"{stats['created']} open, peak {stats['peak']}\n"
+            f"{stats['acquired']} acquisitions, {wait * 1000:.2f} ms average wait"
+            "```"
+        )
+
+    @database.command(name="usage")
+    async def database_usage(self, ctx, action: str = None):
+        """Display database operations and Redis commands per event handler and command"""
+        if action == "reset":
+            metrics.handlers.reset()
+            return await ctx.send("> Database usage counters cleared.")
+
+        template = "{name:<32} {calls:>7} {operations:>7.1f} {commands:>7.1f} {time:>8.2f}"
+        result = [
+            "{:<32} {:>7} {:>7} {:>7} {:>8}".format("handler", "calls", "ops", "cmds", "ms"),
+        ]
+        for name, usage in metrics.handlers.get()[:20]:
+            calls = usage.calls or 1
+            result.append(
+                template.format(
+                    name=name[:32],
+                    calls=usage.calls,
+                    operations=usage.operations / calls,
+                    commands=usage.commands / calls,
+                    time=usage.time * 1000 / calls,
+                )
+            )
+        since = datetime.fromtimestamp(metrics.handlers.since)
+        result.append(f"\nPer call averages since {since.strftime('%Y-%m-%d %H:%M:%S')}.")
+        await ctx.send("```" + "\n".join(result) + "```")
+
+    @database.command(name="export")
+    async def database_export(self, ctx, beam: str = None):
+        """Download the database, or one beam, as compressed snapshot"""
+        if beam is not None and not await repo_b.exists(beam):
+            return await ctx.send(f"> Beam **{self.sanitise(beam)}** not found.")
+
+        filename = "wormhole-{}{}.jsonl.gz".format(
+            datetime.now().strftime("%Y-%m-%d"), "-" + beam if beam else ""
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, filename)
+            with snapshot.open_file(path, "w") as handle:
+                result = await snapshot.export(handle, beam)
+            counts = ", ".join(f"{count} {kind}s" for kind, count in result.items())
+            try:
+                await ctx.send(f"> Exported {counts}.", file=discord.File(path, filename=filename))
+            except discord.HTTPException as e:
+                return await ctx.send(f"> Snapshot could not be sent: {e}")
+        await self.event.sudo(ctx, f"Database exported: {counts}.")
+
+    @database.command(name="import")
+    async def database_import(self, ctx):
+        """Restore records from snapshot attached to the message"""
+        if not ctx.message.attachments:
+            return await ctx.send("> Attach the snapshot file to the message.")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "snapshot")
+            await ctx.message.attachments[0].save(path)
+            await self.delete(ctx)
+            try:
+                with snapshot.open_file(path, "r") as handle:
+                    result = await snapshot.load(handle)
+            except (ValueError, KeyError) as e:
+                return await ctx.send(f"> Snapshot could not be imported: {e}")
+        counts = ", ".join(f"{count} {kind}s" for kind, count in result.items())
+        await self.event.sudo(ctx, f"Database imported: {counts}.")
+        await ctx.send(f"> Imported {counts}.")
+
     @commands.check(checks.is_admin)
     @commands.check(checks.not_in_wormhole)
     @commands.group(name="beam")
@@ -65,6 +261,9 @@ class Admin(wormcog.Wormcog):
             "edit <name> anonymity [none, guild, full]",
             "edit <name> replace [0, 1]",
             "edit <name> timeout <int>",
+            "edit <name> delivery [bot, webhook]",
+            "edit <name> coalesce <ms>",
+            "edit <name> attachments [link, upload]",
             "list",
         ]
 
@@ -85,31 +284,31 @@ class Admin(wormcog.Wormcog):
         if re.fullmatch(pattern, name) is None:
             raise errors.BadArgument(f"Beam name must match `{pattern}`")
 
-        repo_b.add(name=name, admin_id=ctx.author.id)
+        await repo_b.add(name=name, admin_id=ctx.author.id)
         await self.event.sudo(ctx, f"Beam **{name}** created.")
         await self.feedback(ctx, private=False, message=f"Beam **{name}** created and opened.")
 
     @beam.command(name="open", aliases=["enable"])
     async def beam_open(self, ctx, name: str):
         """Open closed beam"""
-        repo_b.set(name=name, key="active", value=1)
+        await repo_b.set(name=name, key="active", value=1)
         await self.event.sudo(ctx, f"Beam **{name}** opened.")
         await self.announce(beam=name, message="Beam opened!")
 
     @beam.command(name="close", aliases=["disable"])
     async def beam_close(self, ctx, name: str):
         """Close beam"""
-        repo_b.set(name=name, key="active", value=0)
+        await repo_b.set(name=name, key="active", value=0)
         await self.event.sudo(ctx, f"Beam **{name}** closed.")
         await self.announce(beam=name, message="Beam closed.")
 
     @beam.command(name="edit", aliases=["set"])
     async def beam_edit(self, ctx, name: str, key: str, value: str):
         """Edit beam"""
-        if not repo_b.exists(name):
+        if not await repo_b.exists(name):
             raise errors.BadArgument("Invalid beam")
 
-        if key in ("active", "admin_id", "replace", "timeout"):
+        if key in ("active", "admin_id", "replace", "timeout", "coalesce"):
             try:
                 value = int(value)
             except ValueError:
@@ -119,7 +318,7 @@ class Admin(wormcog.Wormcog):
         if key in ("admin_id"):
             announce = False
 
-        repo_b.set(name=name, key=key, value=value)
+        await repo_b.set(name=name, key=key, value=value)
 
         await self.event.sudo(ctx, f"Beam **{name}** updated: {key} = {value}.")
         if not announce:
@@ -131,12 +330,14 @@ class Admin(wormcog.Wormcog):
         """List all wormholes"""
         embed = discord.Embed(title="Beam list")
 
-        beam_names = repo_b.list_names()
-        for beam_name in beam_names:
-            beam = repo_b.get(beam_name)
-            ws = len(repo_w.list_ids(beam=beam.name))
+        for beam in await repo_b.list_objects():
+            ws = len(await repo_w.list_ids(beam=beam.name))
             name = f"**{beam.name}** ({'in' if not beam.active else ''}active) | {ws} wormholes"
-            value = f"Anonymity _{beam.anonymity}_, " + f"timeout _{beam.timeout} s_ "
+            value = (
+                f"Anonymity _{beam.anonymity}_, timeout _{beam.timeout} s_, "
+                f"delivery _{beam.delivery}_, coalesce _{beam.coalesce} ms_, "
+                f"attachments _{beam.attachments}_"
+            )
             embed.add_field(name=name, value=value, inline=False)
         await ctx.send(embed=embed)
 
@@ -179,7 +380,7 @@ class Admin(wormcog.Wormcog):
         if channel is None:
             raise errors.BadArgument("No such channel")
 
-        repo_w.add(beam=beam, discord_id=channel.id)
+        await repo_w.add(beam=beam, discord_id=channel.id)
         await self.event.sudo(
             ctx,
             f"{self._w2str_log(channel)} added. {ctx.author.mention}, can you set the local admin?",
@@ -198,8 +399,8 @@ class Admin(wormcog.Wormcog):
         if channel is None:
             raise errors.BadArgument("No such channel")
 
-        beam_name = repo_w.get_attribute(channel_id, "beam")
-        repo_w.delete(discord_id=channel_id)
+        beam_name = await repo_w.get_attribute(channel_id, "beam")
+        await repo_w.delete(discord_id=channel_id)
         await self.event.sudo(ctx, f"{self._w2str_log(channel)} removed.")
         await self.announce(beam=beam_name, message=f"Wormhole closed: {self._w2str_out(channel)}.")
         await channel.send(f"Wormhole closed: {self._w2str_out(channel)}.")
@@ -219,8 +420,8 @@ class Admin(wormcog.Wormcog):
 
         channel = self._get_channel(ctx=ctx, channel_id=channel_id)
 
-        beam_name = repo_w.get_attribute(channel_id, "beam")
-        repo_w.set(discord_id=channel.id, key=key, value=value)
+        beam_name = await repo_w.get_attribute(channel_id, "beam")
+        await repo_w.set(discord_id=channel.id, key=key, value=value)
         await self.event.sudo(ctx, f"{self._w2str_log(channel)}: {key} = {value}.")
 
         if not announce:
@@ -236,9 +437,9 @@ class Admin(wormcog.Wormcog):
         embed = self.get_embed(ctx=ctx, title="Wormholes")
         template = "**{mention}** ({guild}): active {active}, readonly {readonly}"
 
-        beams = repo_b.list_names()
+        beams = await repo_b.list_names()
         for beam in beams:
-            wormholes = repo_w.list_objects(beam=beam)
+            wormholes = await repo_w.list_objects(beam=beam)
             value = []
             for db_w in wormholes:
                 wormhole = self.bot.get_channel(db_w.discord_id)
@@ -294,24 +495,30 @@ class Admin(wormcog.Wormcog):
     @user.command(name="add")
     async def user_add(self, ctx, member_id: int, nickname: str):
         """Add user"""
-        repo_u.add(discord_id=member_id, nickname=nickname)
-        self.event.sudo(ctx, f"{str(repo_u.get(member_id))}.")
+        await repo_u.add(discord_id=member_id, nickname=nickname)
+        await self.event.sudo(ctx, f"{str(await repo_u.get(member_id))}.")
 
     @user.command(name="remove", alises=["delete"])
     async def user_remove(self, ctx, member_id: int):
         """Remove user"""
-        if ctx.author.id != config["admin id"] and repo_u.get_attribute(member_id, "mod") == 1:
+        if (
+            ctx.author.id != config["admin id"]
+            and await repo_u.get_attribute(member_id, "mod") == 1
+        ):
             return await ctx.send("> You do not have permission to alter mod accounts")
         if ctx.author.id != config["admin id"] and member_id == config["admin id"]:
             return await ctx.send("> You do not have permission to alter admin account")
 
-        repo_u.delete(member_id)
+        await repo_u.delete(member_id)
         await self.event.sudo(ctx, f"User **{member_id}** removed.")
 
     @user.command(name="edit", aliases=["set"])
     async def user_edit(self, ctx, member_id: int, key: str, value: str):
         """Edit user"""
-        if ctx.author.id != config["admin id"] and repo_u.get_attribute(member_id, "mod") == 1:
+        if (
+            ctx.author.id != config["admin id"]
+            and await repo_u.get_attribute(member_id, "mod") == 1
+        ):
             return await ctx.send("> You do not have permission to alter mod accounts")
         if ctx.author.id != config["admin id"] and member_id == config["admin id"]:
             return await ctx.send("> You do not have permission to alter admin account")
@@ -327,7 +534,7 @@ class Admin(wormcog.Wormcog):
             except ValueError:
                 raise errors.BadArgument("Value has to be integer.")
 
-        repo_u.set(discord_id=member_id, key=key, value=value)
+        await repo_u.set(discord_id=member_id, key=key, value=value)
         await self.event.sudo(ctx, f"{member_id} updated: {key} = {value}.")
 
     @user.command(name="list")
@@ -337,13 +544,13 @@ class Admin(wormcog.Wormcog):
         restraint: beam name, wormhole ID or user attribute
         """
         if restraint is None:
-            db_users = repo_u.list_objects()
-        elif repo_b.exists(restraint):
-            db_users = repo_u.list_objects_by_beam(restraint)
+            db_users = await repo_u.list_objects()
+        elif await repo_b.exists(restraint):
+            db_users = await repo_u.list_objects_by_beam(restraint)
         elif restraint in ("restricted", "readonly", "mod"):
-            db_users = repo_u.list_objects_by_attribute(restraint)
-        elif is_id(restraint) and repo_w.exists(int(restraint)):
-            db_users = repo_u.list_objects_by_wormhole(int(restraint))
+            db_users = await repo_u.list_objects_by_attribute(restraint)
+        elif is_id(restraint) and await repo_w.exists(int(restraint)):
+            db_users = await repo_u.list_objects_by_wormhole(int(restraint))
         else:
             raise errors.BadArgument("Value is not beam name nor wormhole ID.")
 
@@ -385,7 +592,7 @@ class Admin(wormcog.Wormcog):
                 result.append("- " + ", ".join(attrs))
 
         async def send_output(output: str):
-            if hasattr(ctx.channel, "id") and repo_w.exists(ctx.channel.id):
+            if hasattr(ctx.channel, "id") and await repo_w.exists(ctx.channel.id):
                 await ctx.author.send("```" + output + "```")
             else:
                 await ctx.send("```" + output + "```")
@@ -21,17 +21,16 @@ class User(wormcog.Wormcog):
     @commands.command()
     async def register(self, ctx):
         """Add yourself to the database"""
-        if repo_u.exists(ctx.author.id):
+        if await repo_u.exists(ctx.author.id):
             return await ctx.author.send("You are already registered.")
 
         nickname = self.sanitise(ctx.author.name, limit=16).replace(")", "").replace("(", "")
-        nickname = self.get_free_nickname(nickname)
 
         # register
-        repo_u.add(discord_id=ctx.author.id, nickname=nickname)
-        if isinstance(ctx.channel, discord.TextChannel) and repo_w.get(ctx.channel.id):
-            beam_name = repo_w.get(ctx.channel.id).beam
-            repo_u.set(ctx.author.id, key=f"home_id:{beam_name}", value=ctx.channel.id)
+        nickname = await repo_u.add(discord_id=ctx.author.id, nickname=nickname)
+        if isinstance(ctx.channel, discord.TextChannel) and await repo_w.get(ctx.channel.id):
+            beam_name = (await repo_w.get(ctx.channel.id)).beam
+            await repo_u.set(ctx.author.id, key=f"home_id:{beam_name}", value=ctx.channel.id)
 
         await self.event.user(ctx, f"Registered as **{nickname}**.")
         await ctx.author.send(
@@ -51,7 +50,7 @@ class User(wormcog.Wormcog):
 
         description = (
             f"**NOTE**: _You have to register first with_ `{self.p}register`"
-            if repo_u.get(ctx.author.id) is None
+            if await repo_u.get(ctx.author.id) is None
             else ""
         )
         # fmt: off
@@ -77,15 +76,17 @@ class User(wormcog.Wormcog):
     @set.command(name="home")
     async def set_home(self, ctx):
         """Set current channel as your home wormhole"""
-        if not repo_u.exists(ctx.author.id):
+        if not await repo_u.exists(ctx.author.id):
             return await ctx.author.send(f"Register with `{self.p}register`")
-        if repo_u.get_attribute(ctx.author.id, "restricted") == 1:
+        if await repo_u.get_attribute(ctx.author.id, "restricted") == 1:
             return await ctx.author.send("You are forbidden to alter your settings.")
-        if not isinstance(ctx.channel, discord.TextChannel) or not repo_w.exists(ctx.channel.id):
+        if not isinstance(ctx.channel, discord.TextChannel) or not await repo_w.exists(
+            ctx.channel.id
+        ):
             return await ctx.author.send("Home has to be a wormhole")
 
-        beam_name = repo_w.get(ctx.channel.id).beam
-        repo_u.set(ctx.author.id, key=f"home_id:{beam_name}", value=ctx.channel.id)
+        beam_name = (await repo_w.get(ctx.channel.id)).beam
+        await repo_u.set(ctx.author.id, key=f"home_id:{beam_name}", value=ctx.channel.id)
         await ctx.author.send("Home set to " + ctx.channel.mention)
         await self.event.user(
             ctx,
@@ -96,12 +97,12 @@ class User(wormcog.Wormcog):
     @set.command(name="name", aliases=["nick", "nickname"])
     async def set_name(self, ctx, *, name: str):
         """Set new display name"""
-        if not repo_u.exists(ctx.author.id):
+        if not await repo_u.exists(ctx.author.id):
             return await ctx.author.send(f"Register with `{self.p}register`")
-        if repo_u.get_attribute(ctx.author.id, "restricted") == 1:
+        if await repo_u.get_attribute(ctx.author.id, "restricted") == 1:
             return await ctx.author.send("You are forbidden to alter your settings.")
         name = self.sanitise(name, limit=32)
-        u = repo_u.get_by_nickname(name)
+        u = await repo_u.get_by_nickname(name)
         if u is not None:
             return await ctx.author.send("This name is already used by someone.")
         # fmt: off
@@ -116,8 +117,8 @@ class User(wormcog.Wormcog):
             if char in name:
                 return await ctx.author.send("The name contains forbidden characters.")
 
-        before = repo_u.get_attribute(ctx.author.id, "nickname")
-        repo_u.set(ctx.author.id, key="nickname", value=name)
+        before = await repo_u.get_attribute(ctx.author.id, "nickname")
+        await repo_u.set(ctx.author.id, key="nickname", value=name)
         await ctx.author.send(f"Your nickname was changed to **{name}**")
         await self.event.user(ctx, f"Nickname changed from **{before}** to **{name}**.")
 
@@ -126,7 +127,7 @@ class User(wormcog.Wormcog):
     async def me(self, ctx):
         """See your information"""
         await self.delete(ctx.message)
-        db_u = repo_u.get(ctx.author.id)
+        db_u = await repo_u.get(ctx.author.id)
         if db_u is None:
             return await ctx.author.send("You are not registered.")
         await self.display_user_info(ctx, db_u)
@@ -138,9 +139,19 @@ class User(wormcog.Wormcog):
         await self.delete(ctx.message)
         await self.event.user(ctx, f"Whois lookup for **{member}**.")
 
-        u = repo_u.get_by_nickname(member)
+        u = await repo_u.get_by_nickname(member)
         if u:
             return await self.display_user_info(ctx, u)
+
+        nicknames = await repo_u.search_nicknames(member)
+        # only case differs
+        if len(nicknames) == 1 and nicknames[0].casefold() == member.casefold():
+            u = await repo_u.get_by_nickname(nicknames[0])
+            if u:
+                return await self.display_user_info(ctx, u)
+        if nicknames:
+            suggestions = ", ".join(f"**{self.sanitise(x)}**" for x in nicknames)
+            return await ctx.author.send(f"User not found. Did you mean {suggestions}?")
         await ctx.author.send("User not found")
 
     async def display_user_info(self, ctx, db_u: objects.User):
@@ -195,7 +206,9 @@ class User(wormcog.Wormcog):
 
         result = []
         template = "{logo} **{guild}**, {name}: {link}"
-        for wormhole in repo_w.list_objects(repo_w.get_attribute(ctx.channel.id, "beam")):
+        for wormhole in await repo_w.list_objects(
+            await repo_w.get_attribute(ctx.channel.id, "beam")
+        ):
             if wormhole.invite is None:
                 continue
             channel = self.bot.get_channel(wormhole.discord_id)
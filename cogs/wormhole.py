@@ -1,15 +1,12 @@
 import asyncio
 import json
-import re
-from datetime import datetime
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
-from core import checks, wormcog
+from core import checks, sent, tokenizer, wormcog
 from core.database import repo_b, repo_u, repo_w
-
-started = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+from core.runtime import runtime
 
 config = json.load(open("config.json"))
 
@@ -20,8 +17,26 @@ class Wormhole(wormcog.Wormcog):
     def __init__(self, bot):
         super().__init__(bot)
 
-        # Global message counter
-        self.transferred = {}
+        # pending counts are kept by the counter, so they survive cog reload;
+        # the bot flushes them on shutdown
+        self.flush_counter.start()
+
+    def cog_unload(self):
+        self.flush_counter.cancel()
+
+    @tasks.loop(seconds=10)
+    async def flush_counter(self):
+        """Write message counts to the database"""
+        # failed counts are kept by the counter and written by the next flush
+        try:
+            await runtime.counter.flush()
+        except Exception as e:
+            try:
+                await self.event.system(
+                    f"Could not write message counts:\n>>>{type(e).__name__}\n{e}"
+                )
+            except discord.HTTPException:
+                pass
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -29,24 +44,24 @@ class Wormhole(wormcog.Wormcog):
         if not isinstance(message.channel, discord.TextChannel):
             return
 
-        # do not act if author is bot
-        if message.author.bot:
+        # do not act if author is bot, or if the message came through webhook
+        if message.author.bot or message.webhook_id is not None:
             return
 
         # get wormhole
-        db_w = repo_w.get(message.channel.id)
+        route = await runtime.routes.get(message.channel.id)
 
-        if db_w is None:
+        if route is None:
             return
 
         # get additional information
-        db_b = repo_b.get(db_w.beam)
+        db_w, db_b = route.source, route.beam
 
         # check for attributes
         # fmt: off
         if db_b.active == 0 \
         or db_w.active == 0 \
-        or repo_u.get_attribute(message.author.id, "readonly") == 1:
+        or await repo_u.get_attribute(message.author.id, "readonly") == 1:
             return await self.delete(message)
         # fmt: on
 
@@ -54,17 +69,23 @@ class Wormhole(wormcog.Wormcog):
         if message.content.startswith(config["prefix"]):
             return await self.delete(message)
 
-        # get wormhole channel objects
-        if db_b.name not in self.wormholes or len(self.wormholes[db_b.name]) == 0:
-            self.reconnect(db_b.name)
-
         # process incoming message
         content = await self._process(message)
 
-        # convert attachments to links
+        # download attachments once for all wormholes, if they fit everywhere
+        files, uploads = message.attachments, []
+        if files and db_b.attachments == "upload":
+            # the source guild, if no destination channel is available
+            limit = min(
+                (d.channel.guild.filesize_limit for d in route.destinations if d.channel),
+                default=message.guild.filesize_limit,
+            )
+            uploads, files = await runtime.attachments.download(files, limit)
+
+        # convert other attachments to links
         first_line = True
-        if message.attachments:
-            for f in message.attachments:
+        if files:
+            for f in files:
                 # don't add newline if message has only attachments
                 if first_line:
                     content += " " + f.url
@@ -72,14 +93,18 @@ class Wormhole(wormcog.Wormcog):
                 else:
                     content += "\n" + f.url
 
-        if len(content) < 1:
-            return
+        try:
+            if len(content) < 1 and not uploads:
+                return
 
-        # count the message
-        self._update_stats(message)
+            # count the message
+            await self._update_stats(message)
 
-        # send the message
-        await self.send(message=message, text=content, files=message.attachments)
+            # send the message
+            await self.send(message=message, text=content, files=files, uploads=uploads)
+        finally:
+            for buffer in uploads:
+                buffer.close()
 
     @commands.Cog.listener()
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
@@ -89,55 +114,91 @@ class Wormhole(wormcog.Wormcog):
         if after.author.bot:
             return
 
-        if not repo_w.exists(after.channel.id):
+        route = await runtime.routes.get(after.channel.id)
+        if route is None:
             return
 
         # get forwarded messages
-        forwarded = None
-        for m in self.sent:
-            if m[0].id == after.id:
-                forwarded = m
-                break
-        if not forwarded:
+        entry = await runtime.sent.find(after.id)
+        if entry is None:
             try:
                 await after.add_reaction("❎")
                 await asyncio.sleep(1)
                 await after.remove_reaction("❎", self.bot.user)
             except discord.Forbidden:
-                await after.channel.sent("_Edit not successful_ ❎", delete_after=1)
+                await after.channel.send("_Edit not successful_ ❎", delete_after=1)
             return
 
-        content = await self._process(after)
-        beam_name = repo_w.get_attribute(after.channel.id, "beam")
-        users = self._get_users_from_tags(beam_name=beam_name, text=content)
-        for message in forwarded[1:]:
-            await message.edit(
-                content=self._process_tags(
-                    beam_name=beam_name,
-                    wormhole_id=after.channel.id,
-                    users=users,
-                    text=content,
-                )
-            )
+        await self._edit_copies(after, entry, route.beam.name)
         try:
             await after.add_reaction("✅")
             await asyncio.sleep(1)
             await after.remove_reaction("✅", self.bot.user)
         except discord.Forbidden:
-            await after.channel.sent("_Edit successful_ ✅", delete_after=1)
+            await after.channel.send("_Edit successful_ ✅", delete_after=1)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        # messages in cache are handled by on_message_edit; the rest were sent before
+        # restart or seen by another process
+        if payload.cached_message is not None or "content" not in payload.data:
+            return
+        # relayed copies, sent by the bot or its webhooks
+        if payload.data.get("author", {}).get("bot") or payload.data.get("webhook_id"):
+            return
+
+        route = await runtime.routes.get(payload.channel_id)
+        channel = self.bot.get_channel(payload.channel_id)
+        if route is None or channel is None:
+            return
+        entry = await runtime.sent.find(payload.message_id)
+        if entry is None:
+            return
+        after = await channel.fetch_message(payload.message_id)
+        await self._edit_copies(after, entry, route.beam.name)
 
     @commands.Cog.listener()
     async def on_message_delete(self, message: discord.Message):
+        if message.author.bot or runtime.sent.is_own(message.id):
+            return
+        if await runtime.routes.get(message.channel.id) is None:
+            return
+
         # get forwarded messages
-        forwarded = None
-        for m in self.sent:
-            if m[0].id == message.id:
-                forwarded = m
-                break
-        if not forwarded:
+        entry = await runtime.sent.find(message.id)
+        if entry is not None:
+            await self._delete_copies(entry)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        # messages in cache are handled by on_message_delete
+        if payload.cached_message is not None:
             return
-        for m in forwarded[1:]:
-            await m.delete()
+        # copies and replaced originals deleted by the bot
+        if runtime.sent.is_own(payload.message_id):
+            return
+        if await runtime.routes.get(payload.channel_id) is None:
+            return
+        entry = await runtime.sent.find(payload.message_id)
+        if entry is not None:
+            await self._delete_copies(entry)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        bots = {m.id for m in payload.cached_messages if m.author.bot}
+        message_ids = [
+            i for i in payload.message_ids if i not in bots and not runtime.sent.is_own(i)
+        ]
+        if not message_ids or await runtime.routes.get(payload.channel_id) is None:
+            return
+        for entry in await runtime.sent.find_many(message_ids):
+            if entry is not None:
+                await self._delete_copies(entry)
+
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel: discord.abc.GuildChannel):
+        # the channel webhook may have been removed, look it up again before next send
+        runtime.webhooks.invalidate(channel.id)
 
     @commands.command()
     async def help(self, ctx: commands.Context):
@@ -152,7 +213,7 @@ class Wormhole(wormcog.Wormcog):
         embed.add_field(name=f"**{p}link**",              value="Link to GitHub repository")
         embed.add_field(name=f"**{p}invite**",            value="Bot invite link")
 
-        db_u = repo_u.get(ctx.author.id)
+        db_u = await repo_u.get(ctx.author.id)
         if "User" in self.bot.cogs and db_u is None:
             embed.add_field(name=f"**{p}register**",      value="Register your username")
             embed.add_field(name=f"**{p}whois**",         value="Get information about user")
@@ -188,23 +249,18 @@ class Wormhole(wormcog.Wormcog):
     @commands.command(name="remove", aliases=["d", "delete", "r"])
     async def remove(self, ctx: commands.Context):
         """Delete last sent message"""
-        if len(self.sent) == 0:
+        entry = await runtime.sent.find_last(ctx.author.id, ctx.channel.id)
+        if entry is None:
             return
 
-        for msgs in self.sent[::-1]:
-            # fmt: off
-            if isinstance(msgs[0], discord.Member) and ctx.author.id == msgs[0].id \
-            or isinstance(msgs[0], discord.Message) and ctx.author.id == msgs[0].author.id:
-                await self.delete(ctx.message)
-                for m in msgs:
-                    try:
-                        await self.delete(m)
-                    except discord.NotFound:
-                        pass
-                break
-            # fmt: on
-
-        # TODO Remove from self.sent
+        await self.delete(ctx.message)
+        await runtime.sent.forget(entry)
+        copies = entry.copies if entry.replaced else [entry.original] + entry.copies
+        for copy in copies:
+            try:
+                await copy.delete(self.bot)
+            except discord.HTTPException:
+                pass
 
     @commands.guild_only()
     @commands.check(checks.in_wormhole)
@@ -214,70 +270,60 @@ class Wormhole(wormcog.Wormcog):
 
         text: A new text
         """
-        if len(self.sent) == 0:
+        entry = await runtime.sent.find_last(ctx.author.id, ctx.channel.id)
+        if entry is None:
             return
 
-        for msgs in self.sent[::-1]:
-            # fmt: off
-            if isinstance(msgs[0], discord.Member)  and ctx.author.id == msgs[0].id \
-            or isinstance(msgs[0], discord.Message) and ctx.author.id == msgs[0].author.id:
-                await self.delete(ctx.message)
-                m = ctx.message
-                m.content = m.content.split(" ", 1)[1]
-                content = await self._process(m)
-
-                beam_name = repo_w.get_attribute(m.channel.id, "beam")
-                users = self._get_users_from_tags(beam_name=beam_name, text=content)
-                for message in msgs[1:]:
-                    try:
-                        await message.edit(
-                            content=self._process_tags(
-                                beam_name=beam_name,
-                                wormhole_id=message.channel.id,
-                                users=users,
-                                text=content,
-                            )
-                        )
-                    except Exception as e:
-                        await self.event.user(
-                            ctx, (
-                                f"Could not edit message in {self.sanitise(message.guild.name)}"
-                                f"/{self.sanitise(message.channel.name)}:\n>>> {e}"
-                            )
-                        )
-                        await ctx.channel.send(
-                            f"> **{self.sanitise(ctx.author.name)}**: " +
-                            f"Could not replicate edit in **{self.sanitise(message.guild.name)}**.",
-                            delete_after=0.5,
-                        )
-                break
-            # fmt: on
+        await self.delete(ctx.message)
+        m = ctx.message
+        m.content = m.content.split(" ", 1)[1]
+        content = await self._process(m)
+
+        beam_name = await repo_w.get_attribute(m.channel.id, "beam")
+        template = await self._get_template(beam_name=beam_name, text=content)
+        for copy in entry.copies:
+            try:
+                await copy.edit(self.bot, template.render(copy.channel_id))
+            except Exception as e:
+                channel = self.bot.get_channel(copy.channel_id)
+                await self.event.user(
+                    ctx,
+                    (
+                        f"Could not edit message in {self.sanitise(channel.guild.name)}"
+                        f"/{self.sanitise(channel.name)}:\n>>> {e}"
+                    ),
+                )
+                await ctx.channel.send(
+                    f"> **{self.sanitise(ctx.author.name)}**: "
+                    + f"Could not replicate edit in **{self.sanitise(channel.guild.name)}**.",
+                    delete_after=0.5,
+                )
 
     @commands.cooldown(rate=1, per=20, type=commands.BucketType.channel)
     @commands.command(aliases=["stat", "stats"])
     async def info(self, ctx: commands.Context):
         """Display information about wormholes"""
-        public = hasattr(ctx.channel, "id") and repo_w.get(ctx.channel.id) is not None
+        public = hasattr(ctx.channel, "id") and await repo_w.get(ctx.channel.id) is not None
 
         if public:
             await ctx.send(
-                self._get_info(repo_w.get_attribute(ctx.channel.id, "beam")),
+                await self._get_info(await repo_w.get_attribute(ctx.channel.id, "beam")),
                 delete_after=self.delay(),
             )
             return
 
-        user_beams = repo_u.get_home(ctx.author.id).keys()
+        user_beams = (await repo_u.get_home(ctx.author.id)).keys()
         for beam_name in user_beams:
-            await ctx.send(self._get_info(beam_name, title=True))
+            await ctx.send(await self._get_info(beam_name, title=True))
 
     @commands.guild_only()
     @commands.check(checks.in_wormhole)
     @commands.command()
     async def settings(self, ctx: commands.Context):
         """Display settings for current beam"""
-        db_w = repo_w.get(ctx.channel.id)
-        db_b = repo_b.get(db_w.beam)
-        db_u = repo_u.get(ctx.author.id)
+        db_w = await repo_w.get(ctx.channel.id)
+        db_b = await repo_b.get(db_w.beam)
+        db_u = await repo_u.get(ctx.author.id)
 
         msg = ">>> **Settings**:\n"
         # beam settings
@@ -286,6 +332,7 @@ class Wormhole(wormcog.Wormcog):
         pars.append("active" if db_b.active else "inactive")
         pars.append(f"replace (timeout **{db_b.timeout} s**)" if db_b.replace else "not replacing")
         pars.append(f"anonymity level **{db_b.anonymity}**")
+        pars.append(f"delivery by **{db_b.delivery}**")
         # fmt: on
         msg += ", ".join(pars)
 
@@ -323,10 +370,11 @@ class Wormhole(wormcog.Wormcog):
         # - send messages      - attach files
         # - manage messages    - use external emojis
         # - embed links        - add reactions
+        # - manage webhooks
         text = (
             "> **Invite link:** https://discordapp.com/oauth2/authorize?client_id="
             + str(self.bot.user.id)
-            + "&permissions=321600&scope=bot"
+            + "&permissions=537192512&scope=bot"
         )
         if hasattr(ctx.channel, "id"):
             await ctx.send(text, delete_after=self.delay())
@@ -334,17 +382,18 @@ class Wormhole(wormcog.Wormcog):
             await ctx.send(text)
         await self.delete(ctx.message)
 
-    def _get_prefix(self, message: discord.Message, first_line: bool = True):
+    async def _get_prefix(self, message: discord.Message, first_line: bool = True):
         """Get prefix for message"""
-        db_w = repo_w.get(message.channel.id)
-        db_b = repo_b.get(db_w.beam)
-        db_u = repo_u.get(message.author.id)
+        route = await runtime.routes.get(message.channel.id)
+        db_w, db_b = route.source, route.beam
+        db_u = await repo_u.get(message.author.id)
 
         # get user nickname
         if db_u is not None:
             if db_b.name in db_u.home_ids:
                 # user has home wormhole
-                home = repo_w.get(db_u.home_ids[db_b.name])
+                home = await runtime.routes.get(db_u.home_ids[db_b.name])
+                home = home.source if home is not None else None
             else:
                 # user is registered without home
                 home = None
@@ -384,102 +433,87 @@ class Wormhole(wormcog.Wormcog):
 
     async def _process(self, message: discord.Message):
         """Escape mentions and apply anonymity"""
-        content = message.content
+        tokens = tokenizer.tokenize(message.content)
+        # every distinct markup token is resolved once
+        markup = {token: tokenizer.parse(token) for token in tokens[1::2]}
 
-        users = re.findall(r"<@!?[0-9]+>", content)
-        roles = re.findall(r"<@&[0-9]+>", content)
-        channels = re.findall(r"<#[0-9]+>", content)
-        emojis = re.findall(r"<:[a-zA-Z0-9_]+:[0-9]+>", content)
+        # load all mentioned users at once
+        user_ids = list({int(v) for k, v in markup.values() if k == tokenizer.USER})
+        users = dict(zip(user_ids, await repo_u.get_many(user_ids)))
 
-        # prevent tagging
-        for u in users:
-            try:
+        resolved = {}
+        for token, (kind, value) in markup.items():
+            if kind == tokenizer.USER:
                 # Get discord user tags. If they're registered, translate to
                 # their ((nickname)); it will be converted on send.
-                user_id = int(u.replace("<@!", "").replace("<@", "").replace(">", ""))
-                nickname = repo_u.get_attribute(user_id, "nickname")
-                if nickname is not None:
-                    user = "((" + nickname + "))"
+                db_u = users[int(value)]
+                if db_u is not None:
+                    resolved[token] = "((" + db_u.nickname + "))"
                 else:
-                    user = str(self.bot.get_user(user_id))
-            except Exception as e:  # noqa: F841
-                user = "unknown-user"
-                await self.event.user(message, "Problem in user retrieval:\n>>>{e}")
-            content = content.replace(u, user)
-        for r in roles:
-            try:
-                role = message.guild.get_role(int(r.replace("<@&", "").replace(">", ""))).name
-            except Exception as e:  # noqa: F841
-                role = "unknown-role"
-                await self.event.user(message, "Problem in role retrieval:\n>>>{e}")
-            content = content.replace(r, role)
-        # convert channel tags to universal names
-        for channel in channels:
-            try:
-                ch = self.bot.get_channel(int(channel.replace("<#", "").replace(">", "")))
+                    user = self.bot.get_user(int(value))
+                    resolved[token] = str(user) if user is not None else "unknown-user"
+            elif kind == tokenizer.ROLE:
+                role = message.guild.get_role(int(value)) if message.guild else None
+                resolved[token] = role.name if role is not None else "unknown-role"
+            elif kind == tokenizer.CHANNEL:
+                # convert channel tags to universal names
+                ch = self.bot.get_channel(int(value))
+                if ch is None or not hasattr(ch, "guild"):
+                    resolved[token] = token
+                    continue
                 channel_name = self.sanitise(ch.name)
                 guild_name = self.sanitise(ch.guild.name)
-                content = content.replace(channel, f"__**{guild_name}/{channel_name}**__")
-            except Exception as e:  # noqa: F841
-                await self.event.user(message, "Problem in channel retrieval:\n>>>{e}")
-        # remove unavailable emojis
-        for emoji in emojis:
-            emoji_ = emoji.replace("<:", "").replace(">", "")
-            emoji_name = emoji_.split(":")[0]
-            emoji_id = int(emoji_.split(":")[1])
-            if self.bot.get_emoji(emoji_id) is None:
-                content = content.replace(emoji, ":" + emoji_name + ":")
-
-        # line preprocessor for codeblocks
-        if "```" in content:
-            backticks = re.findall(r"```[a-z0-9]*", content)
-            for b in backticks:
-                content = content.replace(f" {b}", f"\n{b}", 1)
-                content = content.replace(f"{b} ", f"{b}\n", 1)
-
-        # apply prefixes
-        content_ = content.split("\n")
-        content = ""
-        p = self._get_prefix(message)
-        code = False
-        for i in range(len(content_)):
-            if i == 1:
-                # use fill icon instead of guild one
-                p = self._get_prefix(message, first_line=False)
-            line = content_[i]
-            # add prefix if message starts with code block
-            if i == 0 and line.startswith("```"):
-                content += self._get_prefix(message) + "\n"
-            if line.startswith("```"):
-                code = True
-            if code:
-                content += line + "\n"
-            else:
-                content += p + line + "\n"
-            if line.endswith("```") and code:
-                code = False
+                resolved[token] = f"__**{guild_name}/{channel_name}**__"
+            elif kind == tokenizer.EMOJI:
+                # remove unavailable emojis
+                emoji_name, emoji_id = value.split(":")
+                if self.bot.get_emoji(int(emoji_id)) is None:
+                    resolved[token] = ":" + emoji_name + ":"
+                else:
+                    resolved[token] = token
+            elif kind == tokenizer.FENCE:
+                # put code block fences on their own lines
+                before = "\n" if token.startswith(" ") else ""
+                after = "\n" if token.endswith(" ") else ""
+                resolved[token] = before + value + after
+        tokens[1::2] = [resolved[token] for token in tokens[1::2]]
+        content = "".join(tokens)
+
+        # apply prefixes; webhook messages carry the author's name already
+        route = await runtime.routes.get(message.channel.id)
+        if route.beam.delivery == "webhook":
+            return content.replace("@", "@\u200b")
+        first_prefix = await self._get_prefix(message)
+        prefix = await self._get_prefix(message, first_line=False) if "\n" in content else ""
+        content = tokenizer.format_lines(content, first_prefix, prefix)
 
         return content.replace("@", "@\u200b")
 
-    def _update_stats(self, message: discord.Message):
+    async def _edit_copies(self, after: discord.Message, entry: sent.Entry, beam_name: str):
+        """Replace text of the copies with the edited message"""
+        content = await self._process(after)
+        template = await self._get_template(beam_name=beam_name, text=content)
+        for copy in entry.copies:
+            await copy.edit(self.bot, template.render(copy.channel_id))
+
+    async def _delete_copies(self, entry: sent.Entry):
+        await runtime.sent.forget(entry)
+        for copy in entry.copies:
+            await copy.delete(self.bot)
+
+    async def _update_stats(self, message: discord.Message):
         """Increment wormhole's statistics"""
         # try to get author's home wormhole
-        beam_name = repo_w.get_attribute(message.channel.id, "beam")
-        channel_id = repo_u.get_attribute(message.author.id, f"home_id:{beam_name}")
+        beam_name = (await runtime.routes.get(message.channel.id)).beam.name
+        channel_id = await repo_u.get_attribute(message.author.id, f"home_id:{beam_name}")
         if channel_id is None:
             # user is not registered, use current wormhole
             channel_id = message.channel.id
 
-        current = repo_w.get_attribute(channel_id, "messages")
-        repo_w.set(channel_id, "messages", current + 1)
+        runtime.counter.add(channel_id, beam_name)
+        runtime.count(beam_name)
 
-        beam_name = repo_w.get_attribute(message.channel.id, "beam")
-        if beam_name in self.transferred:
-            self.transferred[beam_name] += 1
-        else:
-            self.transferred[beam_name] = 1
-
-    def _get_info(self, beam_name: str, title: bool = False) -> str:
+    async def _get_info(self, beam_name: str, title: bool = False) -> str:
         """Get beam statistics.
 
         If title is True, the message has beam information.
@@ -487,7 +521,8 @@ class Wormhole(wormcog.Wormcog):
         # heading
         msg = ["**Beam __" + beam_name + "__**"] if title else []
 
-        since = self.transferred[beam_name] if beam_name in self.transferred else 0
+        since = runtime.transferred.get(beam_name, 0)
+        started = runtime.started.strftime("%Y-%m-%d %H:%M:%S")
         msg += [
             f">>> **[[total]]** messages sent in total "
             f"(**{since}** since {started}); "
@@ -496,13 +531,15 @@ class Wormhole(wormcog.Wormcog):
             "Currently opened wormholes:",
         ]
 
-        wormholes = repo_w.list_objects(beam_name)
-        wormholes.sort(key=lambda x: x.messages, reverse=True)
+        db_b = await repo_b.get(beam_name)
+        count = db_b.messages + runtime.counter.get_beam(beam_name)
+
+        wormholes = await repo_w.list_objects(beam_name)
+        messages = {w.discord_id: w.messages + runtime.counter.get(w.discord_id) for w in wormholes}
+        wormholes.sort(key=lambda x: messages[x.discord_id], reverse=True)
 
         # loop over wormholes in current beam
-        count = 0
         for wormhole in wormholes:
-            count += wormhole.messages
             line = []
             # logo
             if len(wormhole.logo):
@@ -511,7 +548,7 @@ class Wormhole(wormcog.Wormcog):
             channel = self.bot.get_channel(wormhole.discord_id)
             line.append(
                 f"**{self.sanitise(channel.guild.name)}** ({self.sanitise(channel.name)}): "
-                f"**{wormhole.messages}** messages"
+                f"**{messages[wormhole.discord_id]}** messages"
             )
             # inactive, ro
             pars = []
@@ -0,0 +1,211 @@
+"""Attachments uploaded to every wormhole
+
+Beams with ``attachments`` set to ``upload`` do not relay attachments as links. Each file
+is downloaded once, and the same data are uploaded to all destinations: every upload reads
+them through its own reader, nothing is copied per destination.
+
+Small files are kept in memory, larger ones in temporary files; all in-memory files
+together never take more than the memory budget. Files over the size limit (or over the
+upload limit of any destination guild) stay links. Downloads and uploads are limited by
+semaphores, so bursts of large files do not exhaust memory or bandwidth.
+"""
+
+import asyncio
+import io
+import json
+import os
+import tempfile
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import aiohttp
+import discord
+
+config = json.load(open("config.json"))
+
+# size of chunks read from the network
+CHUNK = 64 * 1024
+
+
+class Buffer:
+    """Downloaded file, readable by any number of uploads at once"""
+
+    def __init__(self, downloader: "Downloader", filename: str, size: int):
+        self.downloader = downloader
+        self.filename = filename
+        self.size = size
+        # in memory until the file or the budget is exceeded, then in temporary file
+        self._memory: Optional[io.BytesIO] = io.BytesIO()
+        self._path: Optional[str] = None
+        self._file = None
+        self._view: Optional[memoryview] = None
+        self._reserved = 0
+
+    def write(self, chunk: bytes):
+        if self._memory is not None and not self.downloader.reserve(self, len(chunk)):
+            # move to disk
+            fd, self._path = tempfile.mkstemp(prefix="wormhole-")
+            self._file = os.fdopen(fd, "wb")
+            self._file.write(self._memory.getbuffer())
+            self._memory = None
+            self.downloader.release(self)
+        if self._memory is not None:
+            self._memory.write(chunk)
+        else:
+            self._file.write(chunk)
+
+    def finish(self):
+        """Stop writing, the buffer can be read"""
+        if self._memory is not None:
+            self._view = self._memory.getbuffer()
+        else:
+            self._file.close()
+            self._file = None
+
+    def reader(self) -> io.IOBase:
+        """Get new reader of the data"""
+        if self._view is not None:
+            return io.BufferedReader(MemoryReader(self._view))
+        return open(self._path, "rb")
+
+    def file(self) -> discord.File:
+        return discord.File(self.reader(), filename=self.filename)
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._path is not None:
+            os.remove(self._path)
+            self._path = None
+        self.downloader.release(self)
+
+
+class MemoryReader(io.RawIOBase):
+    """Reader of shared memory with its own position"""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}
+        self._position = max(0, base[whence] + offset)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        data = self._view[self._position : self._position + len(buffer)]
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class Downloader:
+    def __init__(self, options: dict):
+        # fmt: off
+        options = {
+            "max size":      8 * 1024 * 1024,
+            "memory limit":  1024 * 1024,
+            "memory budget": 64 * 1024 * 1024,
+            "downloads":     4,
+            "uploads":       8,
+            **options,
+        }
+        # fmt: on
+        self.max_size = options["max size"]
+        self.memory_limit = options["memory limit"]
+        self.memory_budget = options["memory budget"]
+        self.downloads = asyncio.Semaphore(options["downloads"])
+        self.uploads = asyncio.Semaphore(options["uploads"])
+        # bytes of files held in memory
+        self.in_memory = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def download(
+        self, attachments: List[discord.Attachment], limit: int
+    ) -> Tuple[List[Buffer], List[discord.Attachment]]:
+        """Download attachments of at most limit bytes
+
+        Returns the buffers and attachments which were not downloaded, because they are
+        too large or the download failed. Buffers have to be closed after use.
+        """
+        limit = min(limit, self.max_size)
+        results = await asyncio.gather(
+            *[self._download(a) if a.size <= limit else _none() for a in attachments]
+        )
+        buffers = [b for b in results if b is not None]
+        skipped = [a for a, b in zip(attachments, results) if b is None]
+        return buffers, skipped
+
+    async def upload(
+        self, buffers: List[Buffer], send: Callable[[Optional[List[discord.File]]], Awaitable]
+    ):
+        """Call the send function with new files reading the buffers
+
+        Returns its result. Without buffers the function gets None.
+        """
+        if not buffers:
+            return await send(None)
+        files = [buffer.file() for buffer in buffers]
+        try:
+            async with self.uploads:
+                return await send(files)
+        finally:
+            # discord.File does not close readers it has not opened
+            for file in files:
+                file.close()
+                file.fp.close()
+
+    def reserve(self, buffer: Buffer, size: int) -> bool:
+        """Take memory for the buffer, False if the file should go to disk"""
+        if buffer._reserved + size > self.memory_limit:
+            return False
+        if self.in_memory + size > self.memory_budget:
+            return False
+        buffer._reserved += size
+        self.in_memory += size
+        return True
+
+    def release(self, buffer: Buffer):
+        self.in_memory -= buffer._reserved
+        buffer._reserved = 0
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _download(self, attachment: discord.Attachment) -> Optional[Buffer]:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+
+        buffer = Buffer(self, attachment.filename, attachment.size)
+        try:
+            async with self.downloads:
+                async with self._session.get(attachment.url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(CHUNK):
+                        buffer.write(chunk)
+            buffer.finish()
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+            buffer.close()
+            return None
+        return buffer
+
+
+async def _none():
+    return None
+
+
+downloader = Downloader(config.get("attachments", {}))
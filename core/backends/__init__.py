@@ -0,0 +1,21 @@
+from core.backends.base import Backend
+
+
+def create(config: dict) -> Backend:
+    """Create storage backend selected in the config file"""
+    name = config.get("backend", "redis")
+
+    if name == "redis":
+        from core.backends.redis import RedisBackend, connect
+
+        return RedisBackend(connect(config.get("redis", {})))
+    if name == "sqlite":
+        from core.backends.sqlite import SQLiteBackend
+
+        return SQLiteBackend(config.get("sqlite", {}).get("path", "wormhole.db"))
+    if name == "memory":
+        from core.backends.memory import MemoryBackend
+
+        return MemoryBackend()
+
+    raise ValueError(f"Unknown database backend: {name}.")
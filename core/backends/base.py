@@ -0,0 +1,161 @@
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+Identifier = Union[str, int]
+Record = Dict[str, Union[str, int]]
+
+
+class Backend:
+    """Storage interface used by the repositories
+
+    Objects are stored as records: flat dictionaries mapping attribute names to values.
+    Beams are identified by name, wormholes and users by their Discord ID. User's home
+    wormholes are stored as ``home_id:[beam name]`` attributes.
+
+    Values may be returned as strings; repositories convert them to the proper types.
+    Input is validated by the repositories, backends only have to keep the records and
+    their indexes consistent:
+
+    - beam's ``messages`` is the sum of ``messages`` of its wormholes
+    - deleting a wormhole, or moving it to another beam, removes it from homes of all users
+    - nicknames are unique
+    """
+
+    kinds = ("beam", "wormhole", "user")
+
+    ##
+    ## Records
+    ##
+
+    async def exists(self, kind: str, identifier: Identifier) -> bool:
+        raise NotImplementedError()
+
+    async def get(self, kind: str, identifier: Identifier) -> Optional[Record]:
+        """Get record, or None if it does not exist"""
+        raise NotImplementedError()
+
+    async def get_many(self, kind: str, identifiers: List[Identifier]) -> List[Optional[Record]]:
+        """Get records in the order of the identifiers"""
+        raise NotImplementedError()
+
+    async def add(self, kind: str, identifier: Identifier, record: Record):
+        """Add record
+
+        Raises DatabaseException when the record exists, or when wormhole's beam does not.
+        """
+        raise NotImplementedError()
+
+    async def add_user(self, identifier: Identifier, record: Record) -> Optional[str]:
+        """Add user record with a free nickname
+
+        If the record's nickname is used, the lowest number making it unique is appended
+        to it. Checking and storing the nickname is one atomic operation. Returns the
+        nickname, or None if the user already exists.
+        """
+        raise NotImplementedError()
+
+    async def set(self, kind: str, identifier: Identifier, key: str, value: Union[str, int]):
+        """Set one attribute
+
+        Raises DatabaseException when user's nickname is used by another user.
+        """
+        raise NotImplementedError()
+
+    async def delete(self, kind: str, identifier: Identifier):
+        """Delete record
+
+        Raises DatabaseException when the record does not exist, or when the beam has
+        wormholes.
+        """
+        raise NotImplementedError()
+
+    async def add_many(self, kind: str, records: List[Tuple[Identifier, Record]]):
+        """Store batch of records, replacing existing ones
+
+        Used to restore backups. Indexes of replaced records may stay stale until
+        ``reindex()`` is run.
+        """
+        raise NotImplementedError()
+
+    async def add_messages(self, counts: Dict[int, Tuple[str, int]]):
+        """Increase message counters
+
+        The argument maps wormhole ID to its beam name and number of new messages. Both
+        the wormhole's and the beam's counter are increased; wormholes that do not exist
+        anymore are skipped.
+        """
+        raise NotImplementedError()
+
+    ##
+    ## Queries
+    ##
+
+    async def list_ids(self, kind: str) -> List[Identifier]:
+        raise NotImplementedError()
+
+    async def scan(
+        self, kind: str, count: int = 1000
+    ) -> AsyncIterator[List[Tuple[Identifier, Record]]]:
+        """Iterate over all records in batches of about ``count`` records"""
+        identifiers = await self.list_ids(kind)
+        for i in range(0, len(identifiers), count):
+            chunk = identifiers[i : i + count]
+            records = await self.get_many(kind, chunk)
+            yield [(k, v) for k, v in zip(chunk, records) if v is not None]
+
+    async def list_wormholes(self, beam: str) -> List[int]:
+        """Get IDs of wormholes connected to the beam"""
+        raise NotImplementedError()
+
+    async def list_users_by_wormholes(self, wormholes: Iterable[int]) -> List[int]:
+        """Get IDs of users having any of the wormholes as their home"""
+        raise NotImplementedError()
+
+    async def list_users_by_flag(self, flag: str) -> List[int]:
+        """Get IDs of users with the flag set to 1"""
+        raise NotImplementedError()
+
+    async def find_user(self, nickname: str) -> Optional[int]:
+        """Get ID of user with given nickname"""
+        raise NotImplementedError()
+
+    async def list_nicknames(self) -> Dict[str, int]:
+        """Get all nicknames with IDs of their users"""
+        raise NotImplementedError()
+
+    ##
+    ## Expiring values
+    ##
+
+    async def set_expiring(self, values: List[Tuple[str, str, int]]):
+        """Store (key, value, seconds) triples, each value expires after its seconds"""
+        raise NotImplementedError()
+
+    async def get_expiring(self, keys: List[str]) -> List[Optional[str]]:
+        """Get values in the order of the keys, None for missing and expired ones"""
+        raise NotImplementedError()
+
+    async def delete_expiring(self, keys: List[str]):
+        raise NotImplementedError()
+
+    ##
+    ## Maintenance
+    ##
+
+    async def migrate(self, kind: str) -> int:
+        """Convert records stored in older layout, return their count"""
+        return 0
+
+    async def reindex(self, kind: str) -> int:
+        """Rebuild indexes and beam message counters, return number of records"""
+        raise NotImplementedError()
+
+    def pool_stats(self) -> Optional[Dict[str, Union[int, float]]]:
+        """Get connection pool utilisation, if the backend uses one"""
+        return None
+
+    async def open(self):
+        """Prepare the backend, called once at startup"""
+        pass
+
+    async def close(self):
+        pass
@@ -0,0 +1,176 @@
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from core.backends.base import Backend, Identifier, Record
+from core.errors import DatabaseException
+
+
+class MemoryBackend(Backend):
+    """Records kept in process memory
+
+    Nothing is persisted, all data are lost when the bot stops. Queries walk through all
+    records, which is fast enough for small deployments, tests and benchmarks.
+    """
+
+    def __init__(self):
+        self.records = {kind: {} for kind in self.kinds}
+        # key: (value, expiration time)
+        self.expiring: Dict[str, Tuple[str, float]] = {}
+
+    ##
+    ## Records
+    ##
+
+    async def exists(self, kind: str, identifier: Identifier) -> bool:
+        return identifier in self.records[kind]
+
+    async def get(self, kind: str, identifier: Identifier) -> Optional[Record]:
+        record = self.records[kind].get(identifier)
+        return dict(record) if record is not None else None
+
+    async def get_many(self, kind: str, identifiers: List[Identifier]) -> List[Optional[Record]]:
+        return [await self.get(kind, identifier) for identifier in identifiers]
+
+    async def add(self, kind: str, identifier: Identifier, record: Record):
+        if identifier in self.records[kind]:
+            raise DatabaseException(f"{kind.title()} `{identifier}` already exists.")
+        if kind == "wormhole" and record["beam"] not in self.records["beam"]:
+            raise DatabaseException(f"Beam {record['beam']} does not exist.")
+        self._store(kind, identifier, record)
+
+    async def add_user(self, identifier: Identifier, record: Record) -> Optional[str]:
+        if identifier in self.records["user"]:
+            return None
+        used = {user["nickname"] for user in self.records["user"].values()}
+        nickname = record["nickname"]
+        i = 0
+        while nickname in used:
+            nickname = f"{record['nickname']}{i}"
+            i += 1
+        self._store("user", identifier, {**record, "nickname": nickname})
+        return nickname
+
+    async def set(self, kind: str, identifier: Identifier, key: str, value: Union[str, int]):
+        record = self.records[kind][identifier]
+        if kind == "user" and key == "nickname":
+            owner = await self.find_user(value)
+            if owner is not None and owner != identifier:
+                raise DatabaseException(f"Nickname `{value}` is already used.")
+        if kind == "wormhole" and key in ("beam", "messages"):
+            messages = int(record.get("messages") or 0)
+            if key == "beam":
+                self._add_beam_messages(record["beam"], -messages)
+                self._add_beam_messages(value, messages)
+                if value != record["beam"]:
+                    self._reset_homes(identifier)
+            else:
+                self._add_beam_messages(record["beam"], value - messages)
+        record[key] = str(value)
+
+    async def delete(self, kind: str, identifier: Identifier):
+        if identifier not in self.records[kind]:
+            raise DatabaseException(f"{kind.title()} `{identifier}` not found.")
+        if kind == "beam" and await self.list_wormholes(identifier):
+            raise DatabaseException(f"Beam `{identifier}` has linked wormholes.")
+        record = self.records[kind].pop(identifier)
+        if kind != "wormhole":
+            return
+
+        self._add_beam_messages(record["beam"], -int(record.get("messages") or 0))
+        self._reset_homes(identifier)
+
+    async def add_many(self, kind: str, records: List[Tuple[Identifier, Record]]):
+        for identifier, record in records:
+            self._store(kind, identifier, record)
+
+    async def add_messages(self, counts: Dict[int, Tuple[str, int]]):
+        for discord_id, (beam, count) in counts.items():
+            wormhole = self.records["wormhole"].get(discord_id)
+            if wormhole is None:
+                continue
+            wormhole["messages"] = str(int(wormhole.get("messages") or 0) + count)
+            self._add_beam_messages(beam, count)
+
+    ##
+    ## Queries
+    ##
+
+    async def list_ids(self, kind: str) -> List[Identifier]:
+        return list(self.records[kind].keys())
+
+    async def list_wormholes(self, beam: str) -> List[int]:
+        return [k for k, v in self.records["wormhole"].items() if v["beam"] == beam]
+
+    async def list_users_by_wormholes(self, wormholes: Iterable[int]) -> List[int]:
+        wormholes = {str(x) for x in wormholes}
+        return [
+            discord_id
+            for discord_id, user in self.records["user"].items()
+            if any(k.startswith("home_id:") and v in wormholes for k, v in user.items())
+        ]
+
+    async def list_users_by_flag(self, flag: str) -> List[int]:
+        return [k for k, v in self.records["user"].items() if v.get(flag) == "1"]
+
+    async def find_user(self, nickname: str) -> Optional[int]:
+        for discord_id, user in self.records["user"].items():
+            if user.get("nickname") == nickname:
+                return discord_id
+        return None
+
+    async def list_nicknames(self) -> Dict[str, int]:
+        return {v["nickname"]: k for k, v in self.records["user"].items()}
+
+    ##
+    ## Expiring values
+    ##
+
+    async def set_expiring(self, values: List[Tuple[str, str, int]]):
+        now = time.monotonic()
+        self.expiring = {k: v for k, v in self.expiring.items() if v[1] > now}
+        for key, value, seconds in values:
+            self.expiring[key] = (value, now + seconds)
+
+    async def get_expiring(self, keys: List[str]) -> List[Optional[str]]:
+        now = time.monotonic()
+        result = []
+        for key in keys:
+            value, expires = self.expiring.get(key, (None, 0))
+            result.append(value if expires > now else None)
+        return result
+
+    async def delete_expiring(self, keys: List[str]):
+        for key in keys:
+            self.expiring.pop(key, None)
+
+    ##
+    ## Maintenance
+    ##
+
+    async def reindex(self, kind: str) -> int:
+        if kind == "wormhole":
+            totals = {name: 0 for name in self.records["beam"].keys()}
+            for wormhole in self.records["wormhole"].values():
+                if wormhole["beam"] in totals:
+                    totals[wormhole["beam"]] += int(wormhole.get("messages") or 0)
+            for name, total in totals.items():
+                self.records["beam"][name]["messages"] = str(total)
+        return len(self.records[kind])
+
+    ##
+    ## Helpers
+    ##
+
+    def _store(self, kind: str, identifier: Identifier, record: Record):
+        self.records[kind][identifier] = {k: str(v) for k, v in record.items()}
+
+    def _reset_homes(self, wormhole: Identifier):
+        for user in self.records["user"].values():
+            for field, value in list(user.items()):
+                if field.startswith("home_id:") and value == str(wormhole):
+                    del user[field]
+
+    def _add_beam_messages(self, name: str, amount: int):
+        beam = self.records["beam"].get(name)
+        if beam is not None:
+            beam["messages"] = str(int(beam.get("messages") or 0) + amount)
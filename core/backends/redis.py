@@ -0,0 +1,591 @@
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+
+from core import metrics
+from core.backends.base import Backend, Identifier, Record
+from core.errors import DatabaseException
+
+
+class ConnectionPool(redis.BlockingConnectionPool):
+    """Connection pool keeping usage statistics
+
+    When all connections are taken, callers wait up to ``timeout`` seconds for one to be
+    released instead of failing immediately.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created = 0
+        self.in_use = 0
+        self.peak = 0
+        self.acquired = 0
+        self.waited = 0.0
+
+    def make_connection(self):
+        self.created += 1
+        return super().make_connection()
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.monotonic()
+        connection = await super().get_connection(*args, **kwargs)
+        self.waited += time.monotonic() - start
+        self.acquired += 1
+        self.in_use += 1
+        self.peak = max(self.peak, self.in_use)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        self.in_use -= 1
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Get pool utilisation"""
+        return {
+            "size": self.max_connections,
+            "created": self.created,
+            "in use": self.in_use,
+            "peak": self.peak,
+            "acquired": self.acquired,
+            "wait": self.waited,
+        }
+
+
+class CountingMixin:
+    """Connection attributing sent commands to the current handler"""
+
+    def pack_command(self, *args):
+        metrics.handlers.add_command()
+        return super().pack_command(*args)
+
+
+class Connection(CountingMixin, redis.Connection):
+    pass
+
+
+class UnixDomainSocketConnection(CountingMixin, redis.UnixDomainSocketConnection):
+    pass
+
+
+def connect(options: dict) -> redis.Redis:
+    """Create Redis client from the "redis" section of the config file"""
+    # fmt: off
+    options = {
+        "host": "localhost",
+        "port": 6379,
+        "socket": None,
+        "db": 0,
+        "password": None,
+        "pool size": 50,
+        "pool timeout": 20,
+        "socket timeout": None,
+        "connect timeout": None,
+        "retry on timeout": False,
+        "health check interval": 0,
+        **options,
+    }
+    # fmt: on
+    kwargs = {
+        "db": options["db"],
+        "password": options["password"],
+        "socket_timeout": options["socket timeout"],
+        "socket_connect_timeout": options["connect timeout"],
+        "retry_on_timeout": options["retry on timeout"],
+        "health_check_interval": options["health check interval"],
+        "decode_responses": True,
+    }
+    if options["socket"]:
+        kwargs["connection_class"] = UnixDomainSocketConnection
+        kwargs["path"] = options["socket"]
+    else:
+        kwargs["connection_class"] = Connection
+        kwargs["host"] = options["host"]
+        kwargs["port"] = options["port"]
+
+    pool = ConnectionPool(
+        max_connections=options["pool size"], timeout=options["pool timeout"], **kwargs
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+# Lua helper keeping user indexes in sync with user's hash
+index_user = """
+local function index_user(id, key, value, add)
+    if value == false or value == nil then
+        return
+    end
+    local attribute = string.match(key, "^[^:]+")
+    if attribute == "nickname" then
+        if add then
+            redis.call("HSET", "index:nicknames", value, id)
+        else
+            redis.call("HDEL", "index:nicknames", value)
+        end
+    elseif attribute == "home_id" then
+        if not add then
+            redis.call("SREM", "index:wormhole:" .. value .. ":users", id)
+        elseif tonumber(value) ~= 0 then
+            redis.call("SADD", "index:wormhole:" .. value .. ":users", id)
+        end
+    elseif attribute == "mod" or attribute == "readonly" or attribute == "restricted" then
+        if not add then
+            redis.call("SREM", "index:user:" .. attribute, id)
+        elseif tonumber(value) == 1 then
+            redis.call("SADD", "index:user:" .. attribute, id)
+        end
+    end
+end
+"""
+
+# Lua helper removing the wormhole from homes of its users
+reset_homes = """
+local function reset_homes(id)
+    local users = "index:wormhole:" .. id .. ":users"
+    for _, user in ipairs(redis.call("SMEMBERS", users)) do
+        local data = redis.call("HGETALL", "user:" .. user)
+        for i = 1, #data, 2 do
+            if string.sub(data[i], 1, 8) == "home_id:" and data[i + 1] == id then
+                redis.call("HDEL", "user:" .. user, data[i])
+            end
+        end
+    end
+    redis.call("DEL", users)
+end
+"""
+
+# Keys derived from record content (beam name, user IDs) cannot be declared upfront, so
+# the scripts are not suitable for Redis Cluster.
+scripts = {
+    # KEYS: record; ARGV: kind, ID, field, value, ...
+    # returns 0 if the record exists, -1 if wormhole's beam does not
+    "add": index_user
+    + """
+    if redis.call("EXISTS", KEYS[1]) == 1 then
+        return 0
+    end
+    local kind, id = ARGV[1], ARGV[2]
+    local fields = {}
+    for i = 3, #ARGV, 2 do
+        fields[ARGV[i]] = ARGV[i + 1]
+    end
+    if kind == "wormhole" and redis.call("EXISTS", "beam:" .. fields["beam"]) == 0 then
+        return -1
+    end
+
+    redis.call("HSET", KEYS[1], unpack(ARGV, 3))
+    redis.call("SADD", "index:" .. kind .. "s", id)
+    if kind == "wormhole" then
+        redis.call("SADD", "index:beam:" .. fields["beam"] .. ":wormholes", id)
+    elseif kind == "user" then
+        for key, value in pairs(fields) do
+            index_user(id, key, value, true)
+        end
+    end
+    return 1
+    """,
+    # KEYS: user; ARGV: ID, nickname, field, value, ...
+    "add_user": index_user
+    + """
+    if redis.call("EXISTS", KEYS[1]) == 1 then
+        return false
+    end
+    local id, nickname = ARGV[1], ARGV[2]
+    local i = 0
+    while redis.call("HSETNX", "index:nicknames", nickname, id) == 0 do
+        nickname = ARGV[2] .. i
+        i = i + 1
+    end
+
+    redis.call("HSET", KEYS[1], "nickname", nickname, unpack(ARGV, 3))
+    redis.call("SADD", "index:users", id)
+    for i = 3, #ARGV, 2 do
+        index_user(id, ARGV[i], ARGV[i + 1], true)
+    end
+    return nickname
+    """,
+    # KEYS: beam; ARGV: name
+    # returns 0 if the beam does not exist, -1 if it has wormholes
+    "delete_beam": """
+    if redis.call("EXISTS", KEYS[1]) == 0 then
+        return 0
+    end
+    local wormholes = "index:beam:" .. ARGV[1] .. ":wormholes"
+    if redis.call("SCARD", wormholes) > 0 then
+        return -1
+    end
+    redis.call("DEL", KEYS[1], wormholes)
+    redis.call("SREM", "index:beams", ARGV[1])
+    return 1
+    """,
+    # KEYS: wormhole; ARGV: ID
+    "delete_wormhole": reset_homes
+    + """
+    local id = ARGV[1]
+    local beam = redis.call("HGET", KEYS[1], "beam")
+    if not beam then
+        return 0
+    end
+    local messages = tonumber(redis.call("HGET", KEYS[1], "messages") or 0)
+
+    reset_homes(id)
+    redis.call("DEL", KEYS[1])
+    redis.call("SREM", "index:wormholes", id)
+    redis.call("SREM", "index:beam:" .. beam .. ":wormholes", id)
+    if redis.call("EXISTS", "beam:" .. beam) == 1 then
+        redis.call("HINCRBY", "beam:" .. beam, "messages", -messages)
+    end
+    return 1
+    """,
+    # KEYS: user; ARGV: ID
+    "delete_user": index_user
+    + """
+    local data = redis.call("HGETALL", KEYS[1])
+    if #data == 0 then
+        return 0
+    end
+    for i = 1, #data, 2 do
+        index_user(ARGV[1], data[i], data[i + 1], false)
+    end
+    redis.call("DEL", KEYS[1])
+    redis.call("SREM", "index:users", ARGV[1])
+    return 1
+    """,
+    # KEYS: wormhole; ARGV: ID, "beam" or "messages", value
+    "set_wormhole": reset_homes
+    + """
+    local id, key, value = ARGV[1], ARGV[2], ARGV[3]
+    local beam = redis.call("HGET", KEYS[1], "beam")
+    if not beam then
+        return 0
+    end
+    local messages = tonumber(redis.call("HGET", KEYS[1], "messages") or 0)
+
+    if key == "beam" then
+        if redis.call("EXISTS", "beam:" .. value) == 0 then
+            return 0
+        end
+        redis.call("SREM", "index:beam:" .. beam .. ":wormholes", id)
+        redis.call("SADD", "index:beam:" .. value .. ":wormholes", id)
+        redis.call("HINCRBY", "beam:" .. beam, "messages", -messages)
+        redis.call("HINCRBY", "beam:" .. value, "messages", messages)
+        if value ~= beam then
+            reset_homes(id)
+        end
+    else
+        redis.call("HINCRBY", "beam:" .. beam, "messages", tonumber(value) - messages)
+    end
+    redis.call("HSET", KEYS[1], key, value)
+    return 1
+    """,
+    # KEYS: user; ARGV: ID, field, value
+    "set_user": index_user
+    + """
+    if redis.call("EXISTS", KEYS[1]) == 0 then
+        return 0
+    end
+    if ARGV[2] == "nickname" then
+        local owner = redis.call("HGET", "index:nicknames", ARGV[3])
+        if owner and owner ~= ARGV[1] then
+            return -1
+        end
+    end
+    index_user(ARGV[1], ARGV[2], redis.call("HGET", KEYS[1], ARGV[2]), false)
+    redis.call("HSET", KEYS[1], ARGV[2], ARGV[3])
+    index_user(ARGV[1], ARGV[2], ARGV[3], true)
+    return 1
+    """,
+    # KEYS: wormhole, beam; ARGV: message count
+    "add_messages": """
+    if redis.call("EXISTS", KEYS[1]) == 0 then
+        return 0
+    end
+    redis.call("HINCRBY", KEYS[1], "messages", ARGV[1])
+    if redis.call("EXISTS", KEYS[2]) == 1 then
+        redis.call("HINCRBY", KEYS[2], "messages", ARGV[1])
+    end
+    return 1
+    """,
+}
+
+
+class RedisBackend(Backend):
+    """Records stored as Redis hashes
+
+    Secondary indexes are kept in sets under the ``index:`` prefix. Operations touching
+    more than one key are Lua scripts, so each of them is one atomic round trip.
+    """
+
+    flags = ("mod", "readonly", "restricted")
+
+    # attributes stored as separate string keys by older versions
+    # fmt: off
+    legacy = {
+        "beam":     ("active", "admin_id", "anonymity", "replace", "timeout"),
+        "wormhole": ("beam", "admin_id", "active", "logo", "readonly", "messages", "invite"),
+        "user":     ("mod", "nickname", "readonly", "restricted"),
+    }
+    # fmt: on
+
+    def __init__(self, client: redis.Redis):
+        self.db = client
+        self.scripts = {name: client.register_script(code) for name, code in scripts.items()}
+
+    ##
+    ## Records
+    ##
+
+    async def exists(self, kind: str, identifier: Identifier) -> bool:
+        return bool(await self.db.exists(f"{kind}:{identifier}"))
+
+    async def get(self, kind: str, identifier: Identifier) -> Optional[Record]:
+        return await self.db.hgetall(f"{kind}:{identifier}") or None
+
+    async def get_many(self, kind: str, identifiers: List[Identifier]) -> List[Optional[Record]]:
+        if not identifiers:
+            return []
+        pipe = self.db.pipeline(transaction=False)
+        for identifier in identifiers:
+            pipe.hgetall(f"{kind}:{identifier}")
+        return [x or None for x in await pipe.execute()]
+
+    async def add(self, kind: str, identifier: Identifier, record: Record):
+        args = [kind, identifier, *(x for item in record.items() for x in item)]
+        result = await self.scripts["add"](keys=[f"{kind}:{identifier}"], args=args)
+        if result == 0:
+            raise DatabaseException(f"{kind.title()} `{identifier}` already exists.")
+        if result == -1:
+            raise DatabaseException(f"Beam {record['beam']} does not exist.")
+
+    async def set(self, kind: str, identifier: Identifier, key: str, value: Union[str, int]):
+        if kind == "user":
+            result = await self.scripts["set_user"](
+                keys=[f"user:{identifier}"], args=[identifier, key, value]
+            )
+            if result == -1:
+                raise DatabaseException(f"Nickname `{value}` is already used.")
+        elif kind == "wormhole" and key in ("beam", "messages"):
+            await self.scripts["set_wormhole"](
+                keys=[f"wormhole:{identifier}"], args=[identifier, key, value]
+            )
+        else:
+            await self.db.hset(f"{kind}:{identifier}", key, value)
+
+    async def add_user(self, identifier: Identifier, record: Record) -> Optional[str]:
+        record = dict(record)
+        args = [identifier, record.pop("nickname"), *(x for item in record.items() for x in item)]
+        return await self.scripts["add_user"](keys=[f"user:{identifier}"], args=args)
+
+    async def delete(self, kind: str, identifier: Identifier):
+        result = await self.scripts[f"delete_{kind}"](
+            keys=[f"{kind}:{identifier}"], args=[identifier]
+        )
+        if result == 0:
+            raise DatabaseException(f"{kind.title()} `{identifier}` not found.")
+        if result == -1:
+            raise DatabaseException(f"Beam `{identifier}` has linked wormholes.")
+
+    async def add_many(self, kind: str, records: List[Tuple[Identifier, Record]]):
+        pipe = self.db.pipeline(transaction=False)
+        for identifier, record in records:
+            pipe.delete(f"{kind}:{identifier}")
+            pipe.hset(f"{kind}:{identifier}", mapping=record)
+            pipe.sadd(f"index:{kind}s", identifier)
+            if kind == "wormhole":
+                pipe.sadd(f"index:beam:{record['beam']}:wormholes", identifier)
+            elif kind == "user":
+                for key, value in record.items():
+                    self._index_user(pipe, identifier, key, value)
+        await pipe.execute()
+
+    async def add_messages(self, counts: Dict[int, Tuple[str, int]]):
+        pipe = self.db.pipeline(transaction=False)
+        for discord_id, (beam, count) in counts.items():
+            await self.scripts["add_messages"](
+                keys=[f"wormhole:{discord_id}", f"beam:{beam}"], args=[count], client=pipe
+            )
+        await pipe.execute()
+
+    ##
+    ## Queries
+    ##
+
+    async def list_ids(self, kind: str) -> List[Identifier]:
+        result = await self.db.smembers(f"index:{kind}s")
+        return list(result) if kind == "beam" else [int(x) for x in result]
+
+    async def scan(
+        self, kind: str, count: int = 1000
+    ) -> AsyncIterator[List[Tuple[Identifier, Record]]]:
+        cursor = None
+        while cursor != 0:
+            cursor, identifiers = await self.db.sscan(f"index:{kind}s", cursor or 0, count=count)
+            if not identifiers:
+                continue
+            if kind != "beam":
+                identifiers = [int(x) for x in identifiers]
+            records = await self.get_many(kind, identifiers)
+            yield [(k, v) for k, v in zip(identifiers, records) if v is not None]
+
+    async def list_wormholes(self, beam: str) -> List[int]:
+        return [int(x) for x in await self.db.smembers(f"index:beam:{beam}:wormholes")]
+
+    async def list_users_by_wormholes(self, wormholes: Iterable[int]) -> List[int]:
+        keys = [f"index:wormhole:{w}:users" for w in wormholes]
+        if not keys:
+            return []
+        return [int(x) for x in await self.db.sunion(keys)]
+
+    async def list_users_by_flag(self, flag: str) -> List[int]:
+        return [int(x) for x in await self.db.smembers(f"index:user:{flag}")]
+
+    async def find_user(self, nickname: str) -> Optional[int]:
+        discord_id = await self.db.hget("index:nicknames", nickname)
+        return int(discord_id) if discord_id is not None else None
+
+    async def list_nicknames(self) -> Dict[str, int]:
+        return {k: int(v) for k, v in (await self.db.hgetall("index:nicknames")).items()}
+
+    ##
+    ## Expiring values
+    ##
+
+    async def set_expiring(self, values: List[Tuple[str, str, int]]):
+        pipe = self.db.pipeline(transaction=False)
+        for key, value, seconds in values:
+            pipe.set(key, value, ex=max(1, seconds))
+        await pipe.execute()
+
+    async def get_expiring(self, keys: List[str]) -> List[Optional[str]]:
+        if not keys:
+            return []
+        return await self.db.mget(keys)
+
+    async def delete_expiring(self, keys: List[str]):
+        if keys:
+            await self.db.delete(*keys)
+
+    ##
+    ## Maintenance
+    ##
+
+    async def migrate(self, kind: str) -> int:
+        """Convert records stored as per-attribute string keys into hashes"""
+        attributes = self.legacy[kind]
+        marker = "readonly" if kind == "user" else "active"
+
+        count = 0
+        async for key in self.db.scan_iter(match=f"{kind}:*:{marker}", count=1000):
+            identifier = key.split(":")[1]
+            keys = [f"{kind}:{identifier}:{attribute}" for attribute in attributes]
+            values = await self.db.mget(keys)
+            mapping = {k: v for k, v in zip(attributes, values) if v is not None}
+
+            if kind == "user":
+                homes = [
+                    x
+                    async for x in self.db.scan_iter(
+                        match=f"user:{identifier}:home_id:*", count=1000
+                    )
+                ]
+                for home, home_id in zip(homes, await self.db.mget(homes) if homes else []):
+                    if home_id is not None:
+                        mapping["home_id:" + home.split(":")[-1]] = home_id
+                keys += homes
+
+            pipe = self.db.pipeline()
+            pipe.hset(f"{kind}:{identifier}", mapping=mapping)
+            pipe.delete(*keys)
+            await pipe.execute()
+            count += 1
+        return count
+
+    async def reindex(self, kind: str) -> int:
+        if kind == "beam":
+            return await self._reindex_beams()
+        if kind == "wormhole":
+            return await self._reindex_wormholes()
+        return await self._reindex_users()
+
+    def pool_stats(self) -> Optional[Dict[str, Union[int, float]]]:
+        pool = self.db.connection_pool
+        return pool.stats() if isinstance(pool, ConnectionPool) else None
+
+    async def open(self):
+        # EVALSHA would load missing scripts on their first call, do it now instead
+        for code in scripts.values():
+            await self.db.script_load(code)
+
+    async def close(self):
+        await self.db.connection_pool.disconnect()
+
+    ##
+    ## Helpers
+    ##
+
+    async def _reindex_beams(self) -> int:
+        names = [
+            x.split(":")[1]
+            async for x in self.db.scan_iter(match="beam:*", _type="HASH", count=1000)
+        ]
+
+        pipe = self.db.pipeline()
+        pipe.delete("index:beams")
+        if names:
+            pipe.sadd("index:beams", *names)
+        await pipe.execute()
+        return len(names)
+
+    async def _reindex_wormholes(self) -> int:
+        keys = [x async for x in self.db.scan_iter(match="wormhole:*", _type="HASH", count=1000)]
+        pipe = self.db.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, "beam", "messages")
+        wormholes = await pipe.execute()
+
+        stale = [x async for x in self.db.scan_iter(match="index:beam:*:wormholes", count=1000)]
+        totals = {beam: 0 for beam in await self.db.smembers("index:beams")}
+
+        pipe = self.db.pipeline()
+        pipe.delete("index:wormholes", *stale)
+        for key, (beam, messages) in zip(keys, wormholes):
+            discord_id = int(key.split(":")[1])
+            pipe.sadd("index:wormholes", discord_id)
+            pipe.sadd(f"index:beam:{beam}:wormholes", discord_id)
+            if beam in totals:
+                totals[beam] += int(messages or 0)
+        for beam, total in totals.items():
+            pipe.hset(f"beam:{beam}", "messages", total)
+        await pipe.execute()
+        return len(keys)
+
+    async def _reindex_users(self) -> int:
+        keys = [x async for x in self.db.scan_iter(match="user:*", _type="HASH", count=1000)]
+        pipe = self.db.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        users = await pipe.execute()
+
+        stale = ["index:users", "index:nicknames"]
+        stale += [f"index:user:{flag}" for flag in self.flags]
+        stale += [x async for x in self.db.scan_iter(match="index:wormhole:*:users", count=1000)]
+
+        pipe = self.db.pipeline()
+        pipe.delete(*stale)
+        for key, data in zip(keys, users):
+            discord_id = int(key.split(":")[1])
+            pipe.sadd("index:users", discord_id)
+            for attribute, value in data.items():
+                self._index_user(pipe, discord_id, attribute, value)
+        await pipe.execute()
+        return len(keys)
+
+    def _index_user(self, pipe: Pipeline, discord_id: int, key: str, value):
+        attr = key if ":" not in key else key.split(":")[0]
+        if attr == "nickname":
+            pipe.hset("index:nicknames", value, discord_id)
+        elif attr == "home_id" and int(value):
+            pipe.sadd(f"index:wormhole:{value}:users", discord_id)
+        elif attr in self.flags and int(value) == 1:
+            pipe.sadd(f"index:user:{attr}", discord_id)
@@ -0,0 +1,459 @@
+import asyncio
+import functools
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from core.backends.base import Backend, Identifier, Record
+from core.errors import DatabaseException
+
+# fmt: off
+schema = """
+CREATE TABLE IF NOT EXISTS beams (
+    "name"      TEXT PRIMARY KEY,
+    "active"    INTEGER NOT NULL DEFAULT 1,
+    "admin_id"  INTEGER NOT NULL DEFAULT 0,
+    "anonymity" TEXT    NOT NULL DEFAULT 'none',
+    "replace"   INTEGER NOT NULL DEFAULT 1,
+    "timeout"   INTEGER NOT NULL DEFAULT 60,
+    "delivery"  TEXT    NOT NULL DEFAULT 'bot',
+    "coalesce"  INTEGER NOT NULL DEFAULT 0,
+    "attachments" TEXT  NOT NULL DEFAULT 'link',
+    "messages"  INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS wormholes (
+    "discord_id" INTEGER PRIMARY KEY,
+    "beam"       TEXT    NOT NULL,
+    "admin_id"   INTEGER NOT NULL DEFAULT 0,
+    "active"     INTEGER NOT NULL DEFAULT 1,
+    "logo"       TEXT    NOT NULL DEFAULT '',
+    "readonly"   INTEGER NOT NULL DEFAULT 0,
+    "messages"   INTEGER NOT NULL DEFAULT 0,
+    "invite"     TEXT    NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS wormholes_beam ON wormholes ("beam");
+CREATE TABLE IF NOT EXISTS users (
+    "discord_id" INTEGER PRIMARY KEY,
+    "nickname"   TEXT    NOT NULL,
+    "mod"        INTEGER NOT NULL DEFAULT 0,
+    "readonly"   INTEGER NOT NULL DEFAULT 0,
+    "restricted" INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_nickname ON users ("nickname");
+CREATE INDEX IF NOT EXISTS users_mod        ON users ("discord_id") WHERE "mod" = 1;
+CREATE INDEX IF NOT EXISTS users_readonly   ON users ("discord_id") WHERE "readonly" = 1;
+CREATE INDEX IF NOT EXISTS users_restricted ON users ("discord_id") WHERE "restricted" = 1;
+CREATE TABLE IF NOT EXISTS homes (
+    "user_id"     INTEGER NOT NULL,
+    "beam"        TEXT    NOT NULL,
+    "wormhole_id" INTEGER NOT NULL,
+    PRIMARY KEY ("user_id", "beam")
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS homes_wormhole ON homes ("wormhole_id");
+CREATE TABLE IF NOT EXISTS expiring (
+    "key"     TEXT PRIMARY KEY,
+    "value"   TEXT NOT NULL,
+    "expires" REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS expiring_expires ON expiring ("expires");
+"""
+
+# kind: (table, primary key, columns)
+tables = {
+    "beam":     ("beams",     "name",       ("active", "admin_id", "anonymity", "replace",
+                                             "timeout", "delivery", "coalesce", "attachments",
+                                             "messages")),
+    "wormhole": ("wormholes", "discord_id", ("beam", "admin_id", "active", "logo", "readonly",
+                                             "messages", "invite")),
+    "user":     ("users",     "discord_id", ("nickname", "mod", "readonly", "restricted")),
+}
+
+# values of columns missing in restored records
+defaults = {
+    "active": 1, "admin_id": 0, "anonymity": "none", "replace": 1, "timeout": 60,
+    "delivery": "bot", "coalesce": 0, "attachments": "link", "messages": 0, "logo": "",
+    "readonly": 0, "invite": "", "mod": 0, "restricted": 0,
+}
+# fmt: on
+
+
+class SQLiteBackend(Backend):
+    """Records stored in SQLite database file
+
+    Queries are run one at a time in a worker thread, so they do not block the event loop.
+    User's homes are kept in a separate table, indexed by wormhole.
+    """
+
+    # maximal number of query parameters in old SQLite versions is 999
+    chunk = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(schema)
+        self._add_columns()
+        self._add_unique_nicknames()
+
+    ##
+    ## Records
+    ##
+
+    async def exists(self, kind: str, identifier: Identifier) -> bool:
+        table, key, _ = tables[kind]
+        query = f'SELECT 1 FROM {table} WHERE "{key}" = ?'
+        return bool(await self._run(self._fetch, query, (identifier,)))
+
+    async def get(self, kind: str, identifier: Identifier) -> Optional[Record]:
+        return (await self.get_many(kind, [identifier]))[0]
+
+    async def get_many(self, kind: str, identifiers: List[Identifier]) -> List[Optional[Record]]:
+        return await self._run(self._get_many, kind, identifiers)
+
+    async def add(self, kind: str, identifier: Identifier, record: Record):
+        await self._run(self._add, kind, identifier, record)
+
+    async def add_user(self, identifier: Identifier, record: Record) -> Optional[str]:
+        return await self._run(self._add_user, identifier, record)
+
+    async def set(self, kind: str, identifier: Identifier, key: str, value: Union[str, int]):
+        await self._run(self._set, kind, identifier, key, value)
+
+    async def delete(self, kind: str, identifier: Identifier):
+        await self._run(self._delete, kind, identifier)
+
+    async def add_many(self, kind: str, records: List[Tuple[Identifier, Record]]):
+        await self._run(self._add_many, kind, records)
+
+    async def add_messages(self, counts: Dict[int, Tuple[str, int]]):
+        await self._run(self._add_messages, counts)
+
+    ##
+    ## Queries
+    ##
+
+    async def list_ids(self, kind: str) -> List[Identifier]:
+        table, key, _ = tables[kind]
+        return [row[0] for row in await self._run(self._fetch, f'SELECT "{key}" FROM {table}')]
+
+    async def list_wormholes(self, beam: str) -> List[int]:
+        query = 'SELECT "discord_id" FROM wormholes WHERE "beam" = ?'
+        return [row[0] for row in await self._run(self._fetch, query, (beam,))]
+
+    async def list_users_by_wormholes(self, wormholes: Iterable[int]) -> List[int]:
+        return await self._run(self._list_users_by_wormholes, list(wormholes))
+
+    async def list_users_by_flag(self, flag: str) -> List[int]:
+        if flag not in tables["user"][2]:
+            raise ValueError(f"Invalid user flag: {flag}.")
+        query = f'SELECT "discord_id" FROM users WHERE "{flag}" = 1'
+        return [row[0] for row in await self._run(self._fetch, query)]
+
+    async def find_user(self, nickname: str) -> Optional[int]:
+        query = 'SELECT "discord_id" FROM users WHERE "nickname" = ? LIMIT 1'
+        rows = await self._run(self._fetch, query, (nickname,))
+        return rows[0][0] if rows else None
+
+    async def list_nicknames(self) -> Dict[str, int]:
+        query = 'SELECT "nickname", "discord_id" FROM users'
+        return {row[0]: row[1] for row in await self._run(self._fetch, query)}
+
+    ##
+    ## Expiring values
+    ##
+
+    async def set_expiring(self, values: List[Tuple[str, str, int]]):
+        await self._run(self._set_expiring, values)
+
+    async def get_expiring(self, keys: List[str]) -> List[Optional[str]]:
+        return await self._run(self._get_expiring, keys)
+
+    async def delete_expiring(self, keys: List[str]):
+        await self._run(self._delete_expiring, keys)
+
+    ##
+    ## Maintenance
+    ##
+
+    async def reindex(self, kind: str) -> int:
+        return await self._run(self._reindex, kind)
+
+    async def close(self):
+        await self._run(self.conn.close)
+        self._executor.shutdown()
+
+    ##
+    ## Helpers
+    ##
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args))
+
+    def _add_columns(self):
+        """Add columns introduced after the database file was created"""
+        for table, _, columns in tables.values():
+            present = {row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            for column in columns:
+                if column in present:
+                    continue
+                # defaults are constants above, parameters are not allowed here
+                default = defaults[column]
+                if isinstance(default, int):
+                    kind, default = "INTEGER", str(default)
+                else:
+                    kind, default = "TEXT", f"'{default}'"
+                query = (
+                    f'ALTER TABLE {table} ADD COLUMN "{column}" {kind} NOT NULL DEFAULT {default}'
+                )
+                with self.conn:
+                    self.conn.execute(query)
+
+    def _add_unique_nicknames(self):
+        """Make nickname index of database files created before it was unique"""
+        for row in self.conn.execute("PRAGMA index_list(users)").fetchall():
+            if row["name"] != "users_nickname" or row["unique"]:
+                continue
+            try:
+                with self.conn:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    self.conn.execute("DROP INDEX users_nickname")
+                    self.conn.execute('CREATE UNIQUE INDEX users_nickname ON users ("nickname")')
+            except sqlite3.IntegrityError:
+                raise DatabaseException("Nicknames are not unique, rename the duplicate users.")
+
+    def _fetch(self, query: str, parameters: tuple = ()) -> List[sqlite3.Row]:
+        return self.conn.execute(query, parameters).fetchall()
+
+    def _get_many(self, kind: str, identifiers: List[Identifier]) -> List[Optional[Record]]:
+        table, key, _ = tables[kind]
+        result = {}
+        for i in range(0, len(identifiers), self.chunk):
+            chunk = identifiers[i : i + self.chunk]
+            marks = ", ".join("?" * len(chunk))
+            for row in self.conn.execute(
+                f'SELECT * FROM {table} WHERE "{key}" IN ({marks})', chunk
+            ):
+                result[row[key]] = {k: row[k] for k in row.keys() if k != key}
+            if kind != "user":
+                continue
+            query = f'SELECT * FROM homes WHERE "user_id" IN ({marks})'
+            for row in self.conn.execute(query, chunk):
+                result[row["user_id"]]["home_id:" + row["beam"]] = row["wormhole_id"]
+        return [result.get(identifier) for identifier in identifiers]
+
+    def _add(self, kind: str, identifier: Identifier, record: Record):
+        with self.conn:
+            if (
+                kind == "wormhole"
+                and not self.conn.execute(
+                    'SELECT 1 FROM beams WHERE "name" = ?', (record["beam"],)
+                ).fetchone()
+            ):
+                raise DatabaseException(f"Beam {record['beam']} does not exist.")
+            try:
+                self._insert(kind, identifier, record)
+            except sqlite3.IntegrityError:
+                raise DatabaseException(f"{kind.title()} `{identifier}` already exists.")
+
+    def _add_user(self, identifier: Identifier, record: Record) -> Optional[str]:
+        with self.conn:
+            # lock the database for writing, other processes cannot take the nickname
+            self.conn.execute("BEGIN IMMEDIATE")
+            if self.conn.execute(
+                'SELECT 1 FROM users WHERE "discord_id" = ?', (identifier,)
+            ).fetchone():
+                return None
+            nickname = record["nickname"]
+            i = 0
+            while self.conn.execute(
+                'SELECT 1 FROM users WHERE "nickname" = ?', (nickname,)
+            ).fetchone():
+                nickname = f"{record['nickname']}{i}"
+                i += 1
+            try:
+                self._insert("user", identifier, {**record, "nickname": nickname})
+            except sqlite3.IntegrityError:
+                # taken by a connection not respecting the lock
+                raise DatabaseException(f"Nickname `{nickname}` is already used.")
+        return nickname
+
+    def _add_many(self, kind: str, records: List[Tuple[Identifier, Record]]):
+        table, key, columns = tables[kind]
+        names = ", ".join(f'"{k}"' for k in (key, *columns))
+        marks = ", ".join("?" * (len(columns) + 1))
+        rows = [
+            (identifier, *(record.get(k, defaults.get(k)) for k in columns))
+            for identifier, record in records
+        ]
+        homes = [
+            (identifier, field.split(":", 1)[1], value)
+            for identifier, record in records
+            for field, value in record.items()
+            if field.startswith("home_id:")
+        ]
+        with self.conn:
+            # not INSERT OR REPLACE, which would delete other users with the same nickname
+            updates = ", ".join(f'"{k}" = excluded."{k}"' for k in columns)
+            try:
+                self.conn.executemany(
+                    f"INSERT INTO {table} ({names}) VALUES ({marks}) "
+                    f'ON CONFLICT ("{key}") DO UPDATE SET {updates}',
+                    rows,
+                )
+            except sqlite3.IntegrityError:
+                raise DatabaseException("Restored users have nicknames of other users.")
+            if kind == "user":
+                self.conn.executemany(
+                    'DELETE FROM homes WHERE "user_id" = ?', [(x[0],) for x in records]
+                )
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO homes ("user_id", "beam", "wormhole_id") '
+                    "VALUES (?, ?, ?)",
+                    homes,
+                )
+
+    def _set(self, kind: str, identifier: Identifier, key: str, value: Union[str, int]):
+        table, primary, columns = tables[kind]
+        with self.conn:
+            if kind == "user" and key.startswith("home_id:"):
+                self._set_home(identifier, key.split(":", 1)[1], value)
+                return
+            if key not in columns:
+                raise ValueError(f"Invalid {kind} attribute: {key}.")
+            if kind == "user" and key == "nickname":
+                self.conn.execute("BEGIN IMMEDIATE")
+                if self.conn.execute(
+                    'SELECT 1 FROM users WHERE "nickname" = ? AND "discord_id" != ?',
+                    (value, identifier),
+                ).fetchone():
+                    raise DatabaseException(f"Nickname `{value}` is already used.")
+
+            if kind == "wormhole" and key in ("beam", "messages"):
+                beam, messages = self.conn.execute(
+                    'SELECT "beam", "messages" FROM wormholes WHERE "discord_id" = ?',
+                    (identifier,),
+                ).fetchone()
+                if key == "beam":
+                    self._add_beam_messages(beam, -messages)
+                    self._add_beam_messages(value, messages)
+                    if value != beam:
+                        self.conn.execute(
+                            'DELETE FROM homes WHERE "wormhole_id" = ?', (identifier,)
+                        )
+                else:
+                    self._add_beam_messages(beam, value - messages)
+
+            try:
+                self.conn.execute(
+                    f'UPDATE {table} SET "{key}" = ? WHERE "{primary}" = ?', (value, identifier)
+                )
+            except sqlite3.IntegrityError:
+                raise DatabaseException(f"Nickname `{value}` is already used.")
+
+    def _delete(self, kind: str, identifier: Identifier):
+        table, key, _ = tables[kind]
+        with self.conn:
+            if not self.conn.execute(
+                f'SELECT 1 FROM {table} WHERE "{key}" = ?', (identifier,)
+            ).fetchone():
+                raise DatabaseException(f"{kind.title()} `{identifier}` not found.")
+            if (
+                kind == "beam"
+                and self.conn.execute(
+                    'SELECT 1 FROM wormholes WHERE "beam" = ? LIMIT 1', (identifier,)
+                ).fetchone()
+            ):
+                raise DatabaseException(f"Beam `{identifier}` has linked wormholes.")
+            if kind == "wormhole":
+                beam, messages = self.conn.execute(
+                    'SELECT "beam", "messages" FROM wormholes WHERE "discord_id" = ?',
+                    (identifier,),
+                ).fetchone()
+                self._add_beam_messages(beam, -messages)
+                self.conn.execute('DELETE FROM homes WHERE "wormhole_id" = ?', (identifier,))
+            elif kind == "user":
+                self.conn.execute('DELETE FROM homes WHERE "user_id" = ?', (identifier,))
+            self.conn.execute(f'DELETE FROM {table} WHERE "{key}" = ?', (identifier,))
+
+    def _add_messages(self, counts: Dict[int, Tuple[str, int]]):
+        with self.conn:
+            for discord_id, (beam, count) in counts.items():
+                cursor = self.conn.execute(
+                    'UPDATE wormholes SET "messages" = "messages" + ? WHERE "discord_id" = ?',
+                    (count, discord_id),
+                )
+                if cursor.rowcount:
+                    self._add_beam_messages(beam, count)
+
+    def _set_expiring(self, values: List[Tuple[str, str, int]]):
+        # expiration time is wall clock time, shared by all processes using the file
+        now = time.time()
+        with self.conn:
+            self.conn.execute('DELETE FROM expiring WHERE "expires" <= ?', (now,))
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO expiring ("key", "value", "expires") VALUES (?, ?, ?)',
+                [(key, value, now + seconds) for key, value, seconds in values],
+            )
+
+    def _get_expiring(self, keys: List[str]) -> List[Optional[str]]:
+        result = {}
+        for i in range(0, len(keys), self.chunk):
+            chunk = keys[i : i + self.chunk]
+            marks = ", ".join("?" * len(chunk))
+            query = (
+                f'SELECT "key", "value" FROM expiring WHERE "key" IN ({marks}) AND "expires" > ?'
+            )
+            result.update(self.conn.execute(query, (*chunk, time.time())).fetchall())
+        return [result.get(key) for key in keys]
+
+    def _delete_expiring(self, keys: List[str]):
+        with self.conn:
+            self.conn.executemany('DELETE FROM expiring WHERE "key" = ?', [(key,) for key in keys])
+
+    def _list_users_by_wormholes(self, wormholes: List[int]) -> List[int]:
+        result = set()
+        for i in range(0, len(wormholes), self.chunk):
+            chunk = wormholes[i : i + self.chunk]
+            marks = ", ".join("?" * len(chunk))
+            query = f'SELECT "user_id" FROM homes WHERE "wormhole_id" IN ({marks})'
+            result.update(row[0] for row in self.conn.execute(query, chunk))
+        return list(result)
+
+    def _reindex(self, kind: str) -> int:
+        table, _, _ = tables[kind]
+        with self.conn:
+            self.conn.execute(f"REINDEX {table}")
+            if kind == "user":
+                self.conn.execute("REINDEX homes")
+            if kind == "wormhole":
+                self.conn.execute(
+                    'UPDATE beams SET "messages" = (SELECT COALESCE(SUM("messages"), 0) '
+                    'FROM wormholes WHERE wormholes."beam" = beams."name")'
+                )
+        return self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def _insert(self, kind: str, identifier: Identifier, record: Record):
+        table, key, columns = tables[kind]
+        data = {k: v for k, v in record.items() if k in columns}
+        names = ", ".join(f'"{k}"' for k in (key, *data.keys()))
+        marks = ", ".join("?" * (len(data) + 1))
+        self.conn.execute(
+            f"INSERT INTO {table} ({names}) VALUES ({marks})", (identifier, *data.values())
+        )
+        for field, value in record.items():
+            if field.startswith("home_id:"):
+                self._set_home(identifier, field.split(":", 1)[1], value)
+
+    def _set_home(self, discord_id: int, beam: str, wormhole_id: int):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO homes ("user_id", "beam", "wormhole_id") VALUES (?, ?, ?)',
+            (discord_id, beam, wormhole_id),
+        )
+
+    def _add_beam_messages(self, name: str, amount: int):
+        self.conn.execute(
+            'UPDATE beams SET "messages" = "messages" + ? WHERE "name" = ?', (amount, name)
+        )
@@ -0,0 +1,165 @@
+"""Coalescing of relayed messages
+
+Beams with ``coalesce`` window do not send every message to every wormhole right away.
+Copies for one channel are collected for the window and sent as one message, which saves
+API calls when the beam is busy. The window adapts to traffic of the beam: when messages
+are rare, the copies are sent immediately; the busier the beam, the longer they wait, up
+to the configured window. A batch is also sent when it would get too long.
+
+The sent message is shared by the relayed messages it contains. Each of them gets a
+:class:`Part` which can be edited and deleted like a :class:`core.sent.Copy`, so the rest
+of the combined message stays untouched.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import discord
+
+from core import sent
+
+# maximal length of Discord message
+LIMIT = 2000
+# weight of the newest interval in the traffic average
+ALPHA = 0.25
+
+
+class Batch:
+    """Texts waiting to be sent to one channel as one message"""
+
+    def __init__(self, identity: Any, deliver: Callable[[str], Awaitable[discord.Message]]):
+        # texts of relayed messages, None when deleted
+        self.parts: List[Optional[str]] = []
+        self.identity = identity
+        self.deliver = deliver
+        self.copy: Optional[sent.Copy] = None
+        self.sent = asyncio.get_event_loop().create_future()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.render())
+
+    def render(self) -> str:
+        return "\n".join(part.rstrip("\n") for part in self.parts if part is not None)
+
+    async def send(self):
+        try:
+            self.copy = sent.Copy.of(await self.deliver(self.render()))
+        except Exception as e:
+            self.sent.set_exception(e)
+        else:
+            self.sent.set_result(self.copy)
+
+    async def update(self, bot: discord.Client, index: int, text: Optional[str]):
+        """Replace or remove text of one relayed message"""
+        async with self.lock:
+            self.parts[index] = text
+            if any(part is not None for part in self.parts):
+                await self.copy.edit(bot, self.render())
+            else:
+                await self.copy.delete(bot)
+
+
+class Part:
+    """Relayed message sent as a part of combined message
+
+    Used in place of its copy, for editing and deleting.
+    """
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch: Batch, index: int):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def channel_id(self) -> int:
+        return self.batch.copy.channel_id
+
+    @property
+    def message_id(self) -> int:
+        return self.batch.copy.message_id
+
+    async def edit(self, bot: discord.Client, content: str):
+        await self.batch.update(bot, self.index, content)
+
+    async def delete(self, bot: discord.Client):
+        await self.batch.update(bot, self.index, None)
+
+
+class Traffic:
+    __slots__ = ("last", "interval")
+
+    def __init__(self, last: float, interval: float):
+        self.last = last
+        # average time between messages of the beam
+        self.interval = interval
+
+
+class Coalescer:
+    def __init__(self):
+        # channel ID: batch being collected
+        self._batches: Dict[int, Batch] = {}
+        # beam name: its traffic
+        self._traffic: Dict[str, Traffic] = {}
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def window(self, beam: str, maximum: float) -> float:
+        """Count a message of the beam, get seconds its copies may wait
+
+        Copies wait only if next message is expected within the window, for about four
+        average intervals between messages.
+        """
+        now = time.monotonic()
+        traffic = self._traffic.get(beam)
+        if traffic is None:
+            traffic = self._traffic[beam] = Traffic(now, maximum)
+        else:
+            traffic.interval += ALPHA * (now - traffic.last - traffic.interval)
+            traffic.last = now
+
+        if traffic.interval >= maximum:
+            return 0.0
+        return min(maximum, traffic.interval * 4)
+
+    async def send(
+        self,
+        channel_id: int,
+        text: str,
+        *,
+        window: float,
+        identity: Any,
+        deliver: Callable[[str], Awaitable[discord.Message]],
+    ) -> Part:
+        """Add text to the channel's batch, wait until the batch is sent
+
+        Texts are only combined with texts of the same identity. ``deliver`` sends the
+        combined text when the batch is started by this text.
+        """
+        batch = self._batches.get(channel_id)
+        if batch is not None and (batch.identity != identity or len(batch) + len(text) >= LIMIT):
+            self._flush(channel_id, batch)
+            batch = None
+        if batch is None:
+            batch = self._batches[channel_id] = Batch(identity, deliver)
+            loop = asyncio.get_event_loop()
+            batch.timer = loop.call_later(window, self._flush, channel_id, batch)
+
+        batch.parts.append(text)
+        part = Part(batch, len(batch.parts) - 1)
+        await asyncio.shield(batch.sent)
+        return part
+
+    def _flush(self, channel_id: int, batch: Batch):
+        """Stop collecting the batch and send it"""
+        if self._batches.get(channel_id) is batch:
+            del self._batches[channel_id]
+        batch.timer.cancel()
+        asyncio.ensure_future(batch.send())
+
+
+batches = Coalescer()
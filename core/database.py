@@ -1,85 +1,393 @@
-import redis
-from typing import Union, Optional, List, Dict
-
-from core import objects
+import asyncio
+import bisect
+import functools
+import json
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Hashable, Tuple, Union, Optional, List, Dict, Set
+
+from core import backends, metrics, objects
 from core.errors import DatabaseException
 
-db = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+config = json.load(open("config.json"))
+
+backend = metrics.instrument(backends.create(config))
+
+# functions called with name of the beam when the beam or its wormholes are changed;
+# None means any beam may have changed
+listeners: List[Callable[[Optional[str]], None]] = []
+
+
+def _notify(beam: Optional[str]):
+    for listener in listeners:
+        listener(beam)
+
+
+class Cache:
+    """Bounded in-process LRU cache with time-to-live
+
+    Repositories keep loaded objects (including ``None`` for unknown IDs) here, so the
+    relay path does not have to ask Redis for data that rarely changes. Every write
+    through the repository invalidates the affected entry; the TTL limits how long
+    changes made by other processes stay invisible.
+    """
+
+    def __init__(self, *, size: int = 4096, ttl: float = 60.0):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Return (found, value) tuple"""
+        item = self._items.get(key)
+        if item is None or item[0] < time.monotonic():
+            self.misses += 1
+            return False, None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return True, item[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key: Hashable = None):
+        """Drop one entry or, if the key is omitted, the whole cache"""
+        if key is None:
+            self._items.clear()
+        else:
+            self._items.pop(key, None)
+
+
+class NicknameIndex:
+    """In-process nickname search index
+
+    Supports exact, case-insensitive, prefix and fuzzy (trigram similarity) lookups
+    without asking the database. It is filled from the backend on first use and kept
+    in sync by the user repository. Like the ``Cache``, it is loaded again after its
+    TTL, so nicknames changed by other processes show up.
+    """
+
+    # fuzzy search only scores nicknames sharing the most trigrams with the query
+    candidates = 100
+
+    def __init__(self, *, ttl: float = 60.0):
+        self.ttl = ttl
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def clear(self):
+        """Drop all nicknames; the index will be loaded again on next use"""
+        self.loaded = False
+        self.expires = 0.0
+        # nickname: user ID
+        self._ids = {}
+        # case folded nickname: nicknames
+        self._folded = {}
+        # sorted case folded nicknames
+        self._sorted = []
+        # trigram: case folded nicknames
+        self._trigrams = {}
+        # case folded nickname: number of its trigrams
+        self._sizes = {}
+
+    def load(self, nicknames: Dict[str, int]):
+        self.clear()
+        for nickname, discord_id in nicknames.items():
+            self.add(nickname, discord_id)
+        self.loaded = True
+        self.expires = time.monotonic() + self.ttl
+
+    def is_stale(self) -> bool:
+        """Whether the index has to be loaded before use"""
+        return not self.loaded or self.expires < time.monotonic()
+
+    def add(self, nickname: str, discord_id: int):
+        self._ids[nickname] = discord_id
+        folded = nickname.casefold()
+        if folded in self._folded:
+            self._folded[folded].add(nickname)
+            return
+        self._folded[folded] = {nickname}
+        bisect.insort(self._sorted, folded)
+        trigrams = self._get_trigrams(folded)
+        self._sizes[folded] = len(trigrams)
+        for trigram in trigrams:
+            self._trigrams.setdefault(trigram, set()).add(folded)
+
+    def remove(self, nickname: str):
+        if self._ids.pop(nickname, None) is None:
+            return
+        folded = nickname.casefold()
+        self._folded[folded].discard(nickname)
+        if self._folded[folded]:
+            return
+        del self._folded[folded]
+        del self._sorted[bisect.bisect_left(self._sorted, folded)]
+        del self._sizes[folded]
+        for trigram in self._get_trigrams(folded):
+            self._trigrams[trigram].discard(folded)
+            if not self._trigrams[trigram]:
+                del self._trigrams[trigram]
+
+    def get(self, nickname: str) -> Optional[int]:
+        """Get user ID by exact nickname"""
+        return self._ids.get(nickname)
+
+    def get_casefold(self, nickname: str) -> List[str]:
+        """Get nicknames equal to the string, ignoring case"""
+        return sorted(self._folded.get(nickname.casefold(), ()))
+
+    def get_prefix(self, prefix: str, limit: int = 5) -> List[str]:
+        """Get nicknames starting with the string, ignoring case"""
+        prefix = prefix.casefold()
+        result = []
+        i = bisect.bisect_left(self._sorted, prefix)
+        while i < len(self._sorted) and len(result) < limit:
+            if not self._sorted[i].startswith(prefix):
+                break
+            result += sorted(self._folded[self._sorted[i]])
+            i += 1
+        return result[:limit]
+
+    def get_similar(self, nickname: str, limit: int = 5, threshold: float = 0.3) -> List[str]:
+        """Get nicknames ordered by trigram similarity to the string
+
+        A typo changes up to three trigrams, which is most of them in short nicknames.
+        Nicknames one typo (or swap of neighbouring letters) away from a string of at least
+        four letters are therefore accepted with the threshold score.
+        """
+        query = nickname.casefold()
+        trigrams = self._get_trigrams(query)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+
+        scores = []
+        for folded, count in shared.most_common(self.candidates):
+            score = count / (len(trigrams) + self._sizes[folded] - count)
+            if score < threshold and self._is_typo(query, folded):
+                score = threshold
+            if score >= threshold:
+                scores.append((-score, folded))
+
+        result = []
+        for _, folded in sorted(scores)[:limit]:
+            result += sorted(self._folded[folded])
+        return result[:limit]
+
+    def search(self, nickname: str, limit: int = 5) -> List[str]:
+        """Get nicknames matching the string
+
+        Exact match comes first, followed by case-insensitive, prefix and fuzzy matches.
+        """
+        result = [nickname] if nickname in self._ids else []
+        for search in (self.get_casefold, self.get_prefix, self.get_similar):
+            if len(result) >= limit:
+                break
+            candidates = (
+                search(nickname) if search == self.get_casefold else search(nickname, limit)
+            )
+            result += [x for x in candidates if x not in result]
+        return result[:limit]
+
+    def _get_trigrams(self, string: str) -> Set[str]:
+        string = f"  {string} "
+        return {string[i : i + 3] for i in range(len(string) - 2)}
+
+    def _is_typo(self, query: str, nickname: str) -> bool:
+        """Whether the strings differ by one edit or one swap of neighbouring letters"""
+        if len(query) < 4 or abs(len(query) - len(nickname)) > 1:
+            return False
+        # optimal string alignment distance, rows of the previous two prefixes of query
+        before, previous = None, list(range(len(nickname) + 1))
+        for i in range(1, len(query) + 1):
+            current = [i] + [0] * len(nickname)
+            for j in range(1, len(nickname) + 1):
+                cost = query[i - 1] != nickname[j - 1]
+                current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+                if (
+                    i > 1
+                    and j > 1
+                    and query[i - 1] == nickname[j - 2]
+                    and query[i - 2] == nickname[j - 1]
+                ):
+                    current[j] = min(current[j], before[j - 2] + 1)
+            before, previous = previous, current
+        return previous[-1] <= 1
+
+
+async def _get_many(cache: Cache, kind: str, ids: List[Hashable], build: Callable) -> List[Any]:
+    """Get objects by their IDs
+
+    Objects missing from the cache are loaded from the backend together, with one round
+    trip. The build function converts backend record into object.
+    """
+    result = {}
+    missing = []
+    for identifier in ids:
+        found, value = cache.get(identifier)
+        if found:
+            result[identifier] = value
+        elif identifier not in missing:
+            missing.append(identifier)
+
+    if missing:
+        for identifier, data in zip(missing, await backend.get_many(kind, missing)):
+            result[identifier] = build(identifier, data)
+
+    return [result[identifier] for identifier in ids]
+
+
+class MessageCounter:
+    """Write-behind accumulator of relayed message counts
+
+    Relayed messages are counted in memory and added to the wormhole's and its beam's
+    ``messages`` field in batches by ``flush()``, which has to be called periodically
+    and on shutdown. Counters of wormholes deleted in the meantime are dropped.
+    """
+
+    def __init__(self):
+        # wormhole ID: [beam name, message count]
+        self.pending = {}
+
+    def add(self, discord_id: int, beam: str, amount: int = 1):
+        if discord_id in self.pending:
+            self.pending[discord_id][1] += amount
+        else:
+            self.pending[discord_id] = [beam, amount]
+
+    def get(self, discord_id: int) -> int:
+        """Get number of messages not yet written to wormhole"""
+        return self.pending[discord_id][1] if discord_id in self.pending else 0
+
+    def get_beam(self, beam: str) -> int:
+        """Get number of messages not yet written to beam"""
+        return sum(count for b, count in self.pending.values() if b == beam)
+
+    async def flush(self) -> int:
+        """Write pending counters to the database with one round trip"""
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+
+        try:
+            await backend.add_messages(pending)
+        except Exception:
+            for discord_id, (beam, count) in pending.items():
+                self.add(discord_id, beam, count)
+            raise
+
+        for discord_id, (beam, count) in pending.items():
+            repo_w.cache.invalidate(discord_id)
+            repo_b.cache.invalidate(beam)
+        return sum(count for _, count in pending.values())
 
 
 class BeamRepository:
     def __init__(self):
-        self.attributes = ("active", "admin_id", "anonymity", "replace", "timeout")
+        # fmt: off
+        self.attributes = ("active", "admin_id", "anonymity", "replace", "timeout", "delivery",
+                           "coalesce", "attachments", "messages")
+        # fmt: on
+        self.cache = Cache()
 
     ##
     ## Interface
     ##
 
-    def exists(self, name: str) -> bool:
-        return db.exists(f"beam:{name}:active")
+    async def exists(self, name: str) -> bool:
+        return await self.get(name) is not None
 
-    def add(self, *, name: str, admin_id: int):
+    async def add(self, *, name: str, admin_id: int):
         self._name_check(name)
-        self._availability_check(name)
+        await self._availability_check(name)
 
-        db.mset(
+        await backend.add(
+            "beam",
+            name,
             {
-                f"beam:{name}:active": 1,
-                f"beam:{name}:admin_id": admin_id,
-                f"beam:{name}:anonymity": "none",
-                f"beam:{name}:replace": 1,
-                f"beam:{name}:timeout": 60,
-            }
+                "active": 1,
+                "admin_id": admin_id,
+                "anonymity": "none",
+                "replace": 1,
+                "timeout": 60,
+                "delivery": "bot",
+                "coalesce": 0,
+                "attachments": "link",
+                "messages": 0,
+            },
         )
+        self.cache.invalidate(name)
+        _notify(name)
 
-    def get(self, name: str) -> Optional[objects.Beam]:
-        if not self.exists(name):
-            return None
+    async def get(self, name: str) -> Optional[objects.Beam]:
+        found, result = self.cache.get(name)
+        if found:
+            return result
 
-        result = objects.Beam(name)
-        result.active = self.get_attribute(name, "active")
-        result.admin_id = self.get_attribute(name, "admin_id")
-        result.anonymity = self.get_attribute(name, "anonymity")
-        result.replace = self.get_attribute(name, "replace")
-        result.timeout = self.get_attribute(name, "timeout")
+        return self._build(name, await backend.get("beam", name))
 
-        return result
+    async def get_many(self, names: List[str]) -> List[Optional[objects.Beam]]:
+        return await _get_many(self.cache, "beam", names, self._build)
 
-    def get_attribute(self, name: str, attribute: str) -> Optional[Union[str, int]]:
+    async def get_attribute(self, name: str, attribute: str) -> Optional[Union[str, int]]:
         if attribute not in self.attributes:
             raise DatabaseException(f"Invalid beam attribute: {attribute}.")
-        result = db.get(f"beam:{name}:{attribute}")
-        if attribute in ("active", "admin_id", "replace", "timeout") and result:
-            result = int(result)
-        return result
+        return getattr(await self.get(name), attribute, None)
 
-    def list_names(self) -> List[str]:
-        result = []
-        for r in db.scan_iter(match="beam:*:active"):
-            result.append(r)
-        return [x.split(":")[1] for x in result]
+    async def list_names(self) -> List[str]:
+        return await backend.list_ids("beam")
 
-    def list_objects(self) -> List[objects.Beam]:
-        names = self.list_names()
-        return [self.get(x) for x in names]
+    async def list_objects(self) -> List[objects.Beam]:
+        names = await self.list_names()
+        return [x for x in await self.get_many(names) if x is not None]
 
-    def set(self, name: str, key: str, value):
-        self._existence_check(name)
+    async def set(self, name: str, key: str, value):
+        await self._existence_check(name)
 
         if not self.is_valid_attribute(key, value):
             raise DatabaseException(f"Invalid beam attribute: {key} = {value}.")
 
-        db.set(f"beam:{name}:{key}", value)
+        await backend.set("beam", name, key, value)
+        self.cache.invalidate(name)
+        _notify(name)
+
+    async def delete(self, name: str):
+        await self._existence_check(name)
 
-    def delete(self, name: str):
-        self._existence_check(name)
+        linked = len(await backend.list_wormholes(name))
+        if linked:
+            raise DatabaseException(f"Found {linked} linked wormholes, halting.")
 
-        wormholes = [db.get(x) for x in db.scan(match="wormhole:*:beam")[1]]
-        if name in wormholes:
-            raise DatabaseException(f"Found {len(wormholes)} linked wormholes, halting.")
+        await backend.delete("beam", name)
+        self.cache.invalidate(name)
+        _notify(name)
 
-        for attribute in self.attributes:
-            db.delete(f"beam:{name}:{attribute}")
+    ##
+    ## Maintenance
+    ##
+
+    async def migrate(self) -> int:
+        """Convert beams stored in older layout"""
+        count = await backend.migrate("beam")
+        self.cache.invalidate()
+        _notify(None)
+        return count
+
+    async def reindex(self) -> int:
+        """Rebuild beam index"""
+        return await backend.reindex("beam")
 
     ##
     ## Logic
@@ -90,7 +398,10 @@ class BeamRepository:
         if key not in self.attributes \
         or key in ("active", "replace")   and value not in (0, 1) \
         or key in ("anonymity")           and value not in ("none", "guild", "full") \
-        or key in ("admin_id", "timeout") and type(value) != int \
+        or key in ("delivery")            and value not in ("bot", "webhook") \
+        or key in ("attachments")         and value not in ("link", "upload") \
+        or key in ("admin_id", "timeout", "messages") and type(value) != int \
+        or key in ("coalesce")            and (type(value) != int or value < 0) \
         or key in ("name", "invite")      and type(value) != str:
             return False
         return True
@@ -100,21 +411,26 @@ class BeamRepository:
     ## Helpers
     ##
 
-    def _get_beam_name(self, string: str) -> str:
-        return string.split(":")[1]
+    def _build(self, name: str, data: Optional[Dict[str, str]]) -> Optional[objects.Beam]:
+        if not data:
+            self.cache.set(name, None)
+            return None
+
+        result = objects.Beam.from_record(name, data)
+
+        self.cache.set(name, result)
+        return result
 
     def _name_check(self, name: str):
         if ":" in name:
             raise DatabaseException(f"Beam name `{name}` contains semicolon.")
 
-    def _availability_check(self, name: str):
-        result = db.get(f"beam:{name}:active")
-        if result is not None:
+    async def _availability_check(self, name: str):
+        if await backend.exists("beam", name):
             raise DatabaseException(f"Beam name `{name}` already exists.")
 
-    def _existence_check(self, name: str):
-        result = db.get(f"beam:{name}:active")
-        if result is None:
+    async def _existence_check(self, name: str):
+        if not await backend.exists("beam", name):
             raise DatabaseException(f"Beam name `{name}` not found.")
 
 
@@ -129,85 +445,114 @@ class WormholeRepository:
             "messages",
             "invite",
         )
+        self.cache = Cache()
 
     ##
     ## Interface
     ##
 
-    def exists(self, discord_id: int) -> bool:
-        return db.exists(f"wormhole:{discord_id}:active")
+    async def exists(self, discord_id: int) -> bool:
+        return await self.get(discord_id) is not None
 
-    def add(self, *, beam: str, discord_id: int):
-        self._check_availability(beam, discord_id)
+    async def add(self, *, beam: str, discord_id: int):
+        await self._check_availability(beam, discord_id)
 
-        db.mset(
+        await backend.add(
+            "wormhole",
+            discord_id,
             {
-                f"wormhole:{discord_id}:beam": beam,
-                f"wormhole:{discord_id}:admin_id": 0,
-                f"wormhole:{discord_id}:active": 1,
-                f"wormhole:{discord_id}:logo": "",
-                f"wormhole:{discord_id}:readonly": 0,
-                f"wormhole:{discord_id}:messages": 0,
-                f"wormhole:{discord_id}:invite": "",
-            }
+                "beam": beam,
+                "admin_id": 0,
+                "active": 1,
+                "logo": "",
+                "readonly": 0,
+                "messages": 0,
+                "invite": "",
+            },
         )
+        self.cache.invalidate(discord_id)
+        _notify(beam)
 
-    def get(self, discord_id: int) -> Optional[objects.Wormhole]:
-        if not self.exists(discord_id):
-            return None
+    async def get(self, discord_id: int) -> Optional[objects.Wormhole]:
+        found, result = self.cache.get(discord_id)
+        if found:
+            return result
 
-        result = objects.Wormhole(discord_id)
-        result.active = self.get_attribute(discord_id, "active")
-        result.admin_id = self.get_attribute(discord_id, "admin_id")
-        result.beam = self.get_attribute(discord_id, "beam")
-        result.logo = self.get_attribute(discord_id, "logo")
-        result.messages = self.get_attribute(discord_id, "messages")
-        result.readonly = self.get_attribute(discord_id, "readonly")
-        result.invite = self.get_attribute(discord_id, "invite")
+        return self._build(discord_id, await backend.get("wormhole", discord_id))
 
-        return result
+    async def get_many(self, discord_ids: List[int]) -> List[Optional[objects.Wormhole]]:
+        return await _get_many(self.cache, "wormhole", discord_ids, self._build)
 
-    def get_attribute(self, discord_id: int, attribute: str) -> Optional[Union[str, int]]:
+    async def get_attribute(self, discord_id: int, attribute: str) -> Optional[Union[str, int]]:
         if attribute not in self.attributes:
             raise DatabaseException(f"Invalid wormhole attribute: {attribute}.")
-        result = db.get(f"wormhole:{discord_id}:{attribute}")
-
-        # get data types
-        if attribute in ("active", "admin_id", "messages", "readonly") and result:
-            result = int(result)
+        return getattr(await self.get(discord_id), attribute, None)
 
-        return result
-
-    def list_ids(self, beam: str = None) -> List[int]:
-        result = []
-        for r in db.scan_iter(match="wormhole:*:active"):
-            result.append(r)
-
-        result = [int(x.split(":")[1]) for x in result]
+    async def list_ids(self, beam: str = None) -> List[int]:
         if beam is None:
-            return result
-        return [w for w in result if self.get_attribute(w, "beam") == beam]
+            return await backend.list_ids("wormhole")
+        return await backend.list_wormholes(beam)
 
-    def list_objects(self, beam: str = None) -> List[objects.Wormhole]:
-        return [self.get(x) for x in self.list_ids(beam)]
+    async def list_objects(self, beam: str = None) -> List[objects.Wormhole]:
+        return [x for x in await self.get_many(await self.list_ids(beam)) if x is not None]
 
-    def set(self, discord_id: int, key: str, value):
-        self._check_existance(discord_id)
+    async def set(self, discord_id: int, key: str, value):
+        await self._check_existance(discord_id)
 
         if not self.is_valid_attribute(key, value):
             raise DatabaseException(f"Invalid wormhole attribute: {key} = {value}.")
 
-        db.set(f"wormhole:{discord_id}:{key}", value)
+        if key == "beam" and not await backend.exists("beam", value):
+            raise DatabaseException(f"Beam {value} does not exist.")
+
+        # beam's message counter follows its wormholes
+        beams = [(await backend.get("wormhole", discord_id))["beam"]]
+        users = []
+        if key == "beam" and value != beams[0]:
+            beams.append(value)
+            # the wormhole stops being home of its users
+            users = await backend.list_users_by_wormholes([discord_id])
+
+        await backend.set("wormhole", discord_id, key, value)
+        self.cache.invalidate(discord_id)
+        for beam in beams:
+            if key in ("beam", "messages"):
+                repo_b.cache.invalidate(beam)
+            if key != "messages":
+                _notify(beam)
+        for user in users:
+            repo_u.cache.invalidate(user)
+
+    async def delete(self, discord_id: int):
+        await self._check_existance(discord_id)
+
+        beam = (await backend.get("wormhole", discord_id))["beam"]
+        users = await backend.list_users_by_wormholes([discord_id])
+
+        await backend.delete("wormhole", discord_id)
+        self.cache.invalidate(discord_id)
+        repo_b.cache.invalidate(beam)
+        _notify(beam)
+        for user in users:
+            repo_u.cache.invalidate(user)
+
+    ##
+    ## Maintenance
+    ##
 
-    def delete(self, discord_id: int):
-        self._check_existance(discord_id)
-        for attribute in self.attributes:
-            db.delete(f"wormhole:{discord_id}:{attribute}")
+    async def migrate(self) -> int:
+        """Convert wormholes stored in older layout"""
+        count = await backend.migrate("wormhole")
+        self.cache.invalidate()
+        _notify(None)
+        return count
 
-        # reset homes
-        for home in db.scan_iter(match="user:*:home_id:*"):
-            if str(discord_id) == db.get(home):
-                db.delete(home)
+    async def reindex(self) -> int:
+        """Rebuild beam membership indexes and beam message counters"""
+        count = await backend.reindex("wormhole")
+        repo_b.cache.invalidate()
+        _notify(None)
+        return count
 
     ##
     ## Logic
@@ -227,18 +572,24 @@ class WormholeRepository:
     ## Helpers
     ##
 
-    def _get_wormhole_discord_id(self, string: str) -> int:
-        return int(string.split(":")[1])
+    def _build(self, discord_id: int, data: Optional[Dict[str, str]]) -> Optional[objects.Wormhole]:
+        if not data:
+            self.cache.set(discord_id, None)
+            return None
 
-    def _check_availability(self, beam: str, discord_id: int):
-        if not db.exists(f"beam:{beam}:active"):
+        result = objects.Wormhole.from_record(discord_id, data)
+
+        self.cache.set(discord_id, result)
+        return result
+
+    async def _check_availability(self, beam: str, discord_id: int):
+        if not await backend.exists("beam", beam):
             raise DatabaseException(f"Beam {beam} does not exist.")
-        if db.exists(f"wormhole:{discord_id}:active"):
+        if await backend.exists("wormhole", discord_id):
             raise DatabaseException(f"Channel `{discord_id}` is already a wormhole.")
 
-    def _check_existance(self, discord_id: int):
-        result = db.get(f"wormhole:{discord_id}:active")
-        if result is None:
+    async def _check_existance(self, discord_id: int):
+        if not await backend.exists("wormhole", discord_id):
             raise DatabaseException(f"Channel `{discord_id}` is not a wormhole.")
 
 
@@ -252,125 +603,168 @@ class UserRepository:
             "readonly",
             "restricted",
         )
+        self.flags = ("mod", "readonly", "restricted")
+        self.cache = Cache()
+        self.nicknames = NicknameIndex()
+        # shortest tag resolved by prefix
+        self.min_prefix = 3
 
     ##
     ## Interface
     ##
 
-    def exists(self, discord_id: int) -> bool:
-        return db.exists(f"user:{discord_id}:readonly")
+    async def exists(self, discord_id: int) -> bool:
+        return await self.get(discord_id) is not None
 
-    def add(self, *, discord_id: int, nickname: str):
-        self._availability_check(discord_id)
+    async def add(self, *, discord_id: int, nickname: str) -> str:
+        """Add user, return their nickname
 
-        db.mset(
+        If the nickname is used by someone else, the lowest number making it unique is
+        appended to it. The check is done by the database, so two users can never get
+        the same nickname.
+        """
+        nickname = await backend.add_user(
+            discord_id,
             {
-                f"user:{discord_id}:mod": 0,
-                f"user:{discord_id}:nickname": nickname,
-                f"user:{discord_id}:readonly": 0,
-                f"user:{discord_id}:restricted": 0,
-            }
+                "mod": 0,
+                "nickname": nickname,
+                "readonly": 0,
+                "restricted": 0,
+            },
         )
+        if nickname is None:
+            raise DatabaseException(f"User ID `{discord_id}` is already known.")
+
+        self.cache.invalidate(discord_id)
+        if self.nicknames.loaded:
+            self.nicknames.add(nickname, discord_id)
+        return nickname
+
+    async def get(self, discord_id: int) -> Optional[objects.User]:
+        found, result = self.cache.get(discord_id)
+        if found:
+            return result
 
-    def get(self, discord_id: int) -> Optional[objects.User]:
-        if not self.exists(discord_id):
+        return self._build(discord_id, await backend.get("user", discord_id))
+
+    async def get_many(self, discord_ids: List[int]) -> List[Optional[objects.User]]:
+        return await _get_many(self.cache, "user", discord_ids, self._build)
+
+    async def get_by_nickname(self, nickname: str) -> Optional[objects.User]:
+        discord_id = await backend.find_user(nickname)
+        if discord_id is None:
             return None
+        return await self.get(discord_id)
 
-        result = objects.User(discord_id)
-        result.home_ids = self.get_home(discord_id)
-        result.mod = self.get_attribute(discord_id, "mod")
-        result.nickname = self.get_attribute(discord_id, "nickname")
-        result.readonly = self.get_attribute(discord_id, "readonly")
-        result.restricted = self.get_attribute(discord_id, "restricted")
+    async def search_nicknames(self, nickname: str, limit: int = 5) -> List[str]:
+        """Get nicknames matching the string exactly, ignoring case, by prefix or fuzzily"""
+        return (await self._get_nicknames()).search(nickname, limit)
 
-        return result
+    async def resolve_nickname(self, nickname: str) -> Optional[str]:
+        """Get the only nickname equal to the string ignoring case, or starting with it
 
-    def get_by_nickname(self, nickname: str) -> Optional[objects.User]:
-        for r in db.scan_iter(match="user:*:nickname"):
-            if db.get(r) == nickname:
-                return self.get(int(r.split(":")[1]))
-        return None
+        Returns None if there is no such nickname, or more of them.
+        """
+        index = await self._get_nicknames()
+        candidates = index.get_casefold(nickname)
+        if not candidates and len(nickname) >= self.min_prefix:
+            candidates = index.get_prefix(nickname, limit=2)
+        return candidates[0] if len(candidates) == 1 else None
 
-    def get_attribute(self, discord_id: int, attribute: str) -> Optional[Union[str, int]]:
+    async def get_attribute(self, discord_id: int, attribute: str) -> Optional[Union[str, int]]:
         attr = attribute if ":" not in attribute else attribute.split(":")[0]
         if attr not in self.attributes:
             raise DatabaseException(f"Invalid user attribute: {attribute}.")
 
-        result = db.get(f"user:{discord_id}:{attribute}")
-        if attr in ("home_id", "mod", "readonly", "restricted") and result:
-            result = int(result)
-        return result
+        result = await self.get(discord_id)
+        if result is None:
+            return None
+        if attr == "home_id":
+            return result.home_ids.get(attribute.split(":", 1)[1])
+        return getattr(result, attr, None)
 
-    def get_home(self, discord_id: int, beam: str = None) -> Dict[str, int]:
-        match = f"user:{discord_id}:home_id:" + ("*" if beam is None else beam)
+    async def get_home(self, discord_id: int, beam: str = None) -> Dict[str, int]:
+        result = await self.get(discord_id)
+        if result is None:
+            return {}
+        if beam is not None:
+            return {beam: result.home_ids[beam]} if beam in result.home_ids else {}
+        return dict(result.home_ids)
 
-        result = {}
-        for r in db.scan_iter(match=match):
-            result[r.split(":")[-1]] = int(db.get(r))
-        return result
+    async def list_ids(self) -> List[int]:
+        return await backend.list_ids("user")
 
-    def list_ids(self) -> List[int]:
-        result = []
-        for r in db.scan_iter(match="user:*:readonly"):
-            result.append(r)
-        return [int(x.split(":")[1]) for x in result]
+    async def list_ids_by_beam(self, beam: str) -> List[int]:
+        return await backend.list_users_by_wormholes(await backend.list_wormholes(beam))
 
-    def list_ids_by_beam(self, beam: str) -> List[int]:
-        result = []
-        for r in db.scan_iter(match=f"user:*:home_id:{beam}"):
-            result.append(r)
-        return [int(x.split(":")[1]) for x in result]
+    async def list_ids_by_wormhole(self, discord_id: int) -> List[int]:
+        return await backend.list_users_by_wormholes([discord_id])
 
-    def list_ids_by_wormhole(self, discord_id: int) -> List[int]:
-        result = []
-        users = []
-        for r in db.scan_iter(match="user:*:home_id:*"):
-            user = r.split(":")[1]
-            if user not in users:
-                users.append(user)
-                result.append(r)
-        return [int(x.split(":")[1]) for x in result if db.get(x) == str(discord_id)]
-
-    def list_ids_by_attribute(self, attribute: str) -> List[int]:
-        result = []
-        for r in db.scan_iter(match=f"user:*:{attribute}"):
-            if db.get(r) == "1":
-                result.append(r)
-        return [int(x.split(":")[1]) for x in result]
+    async def list_ids_by_attribute(self, attribute: str) -> List[int]:
+        if attribute not in self.flags:
+            raise DatabaseException(f"Invalid user flag: {attribute}.")
+        return await backend.list_users_by_flag(attribute)
 
-    def list_objects(self) -> List[objects.User]:
-        return [self.get(x) for x in self.list_ids()]
+    async def list_objects(self) -> List[objects.User]:
+        return [x for x in await self.get_many(await self.list_ids()) if x is not None]
 
-    def list_objects_by_beam(self, beam: str) -> List[objects.User]:
-        return [self.get(x) for x in self.list_ids_by_beam(beam)]
+    async def list_objects_by_beam(self, beam: str) -> List[objects.User]:
+        ids = await self.list_ids_by_beam(beam)
+        return [x for x in await self.get_many(ids) if x is not None]
 
-    def list_objects_by_wormhole(self, discord_id: int) -> List[objects.User]:
-        return [self.get(x) for x in self.list_ids_by_wormhole(discord_id)]
+    async def list_objects_by_wormhole(self, discord_id: int) -> List[objects.User]:
+        ids = await self.list_ids_by_wormhole(discord_id)
+        return [x for x in await self.get_many(ids) if x is not None]
 
-    def list_objects_by_attribute(self, attribute: str) -> List[objects.User]:
-        return [self.get(x) for x in self.list_ids_by_attribute(attribute)]
+    async def list_objects_by_attribute(self, attribute: str) -> List[objects.User]:
+        ids = await self.list_ids_by_attribute(attribute)
+        return [x for x in await self.get_many(ids) if x is not None]
 
-    def set(self, discord_id: int, key: str, value):
-        self._existence_check(discord_id)
+    async def set(self, discord_id: int, key: str, value):
+        await self._existence_check(discord_id)
 
         k = key if ":" not in key else key.split(":")[0]
         if not self.is_valid_attribute(k, value):
             raise DatabaseException(f"Invalid user attribute: {key} = {value}.")
         if k == "home_id":
             beam = key.split(":")[1]
-            if not db.exists(f"beam:{beam}:active"):
+            if not await backend.exists("beam", beam):
                 raise DatabaseException(f"Beam not found: {beam}.")
+        if k == "nickname":
+            before = (await backend.get("user", discord_id)).get("nickname")
 
-        db.set(f"user:{discord_id}:{key}", value)
+        await backend.set("user", discord_id, key, value)
+        self.cache.invalidate(discord_id)
+        if k == "nickname" and self.nicknames.loaded:
+            self.nicknames.remove(before)
+            self.nicknames.add(value, discord_id)
 
-    def delete(self, discord_id: int):
-        self._existence_check(discord_id)
+    async def delete(self, discord_id: int):
+        await self._existence_check(discord_id)
+        nickname = (await backend.get("user", discord_id)).get("nickname")
 
-        for item in db.scan_iter(match=f"user:{discord_id}:*"):
-            db.delete(item)
+        await backend.delete("user", discord_id)
+        self.cache.invalidate(discord_id)
+        self.nicknames.remove(nickname)
 
-    def is_nickname_used(self, nickname: str) -> bool:
-        return nickname in [db.get(x) for x in db.scan(match="user:*:nickname")[1]]
+    async def is_nickname_used(self, nickname: str) -> bool:
+        return await backend.find_user(nickname) is not None
+
+    ##
+    ## Maintenance
+    ##
+
+    async def migrate(self) -> int:
+        """Convert users stored in older layout"""
+        count = await backend.migrate("user")
+        self.cache.invalidate()
+        self.nicknames.clear()
+        return count
+
+    async def reindex(self) -> int:
+        """Rebuild nickname, home and flag indexes"""
+        self.nicknames.clear()
+        return await backend.reindex("user")
 
     ##
     ## Logic
@@ -390,17 +784,58 @@ class UserRepository:
     ## Helpers
     ##
 
-    def _availability_check(self, discord_id: int):
-        result = db.get(f"user:{discord_id}:readonly")
-        if result is not None:
-            raise DatabaseException(f"User ID `{discord_id}` is already known.")
+    def _build(self, discord_id: int, data: Optional[Dict[str, str]]) -> Optional[objects.User]:
+        if not data:
+            self.cache.set(discord_id, None)
+            return None
 
-    def _existence_check(self, discord_id: int):
-        result = db.get(f"user:{discord_id}:readonly")
-        if result is None:
+        result = objects.User.from_record(discord_id, data)
+
+        self.cache.set(discord_id, result)
+        return result
+
+    async def _get_nicknames(self) -> NicknameIndex:
+        if self.nicknames.is_stale():
+            self.nicknames.load(await backend.list_nicknames())
+        return self.nicknames
+
+    async def _existence_check(self, discord_id: int):
+        if not await backend.exists("user", discord_id):
             raise DatabaseException(f"User ID `{discord_id}` unknown.")
 
 
 repo_b = BeamRepository()
 repo_w = WormholeRepository()
 repo_u = UserRepository()
+counter = MessageCounter()
+
+
+class SyncRepository:
+    """Blocking facade over a repository, for scripts running outside of the bot
+
+    Every coroutine method of the wrapped repository is run to completion on a private
+    event loop. Do not use it from code that already runs inside an event loop (cogs).
+    """
+
+    _loop = None
+
+    def __init__(self, repository):
+        self._repository = repository
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._repository, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def wrapper(*args, **kwargs):
+            if SyncRepository._loop is None:
+                SyncRepository._loop = asyncio.new_event_loop()
+            return SyncRepository._loop.run_until_complete(attribute(*args, **kwargs))
+
+        return wrapper
+
+
+repo_b_sync = SyncRepository(repo_b)
+repo_w_sync = SyncRepository(repo_w)
+repo_u_sync = SyncRepository(repo_u)
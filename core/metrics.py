@@ -0,0 +1,93 @@
+"""Database usage accounting
+
+Every database operation and every Redis command is attributed to the event handler or
+command that caused it. The bot sets the current handler at the start of each event and
+command invocation; asyncio copies the context into tasks started from there, so work
+spread over several tasks is still counted to its origin.
+"""
+
+import contextvars
+import functools
+import inspect
+import time
+from typing import Dict, List, Tuple
+
+# name of event handler or command being run
+handler = contextvars.ContextVar("handler", default="background")
+# set while backend operation is measured, so operations calling other ones count once
+_measured = contextvars.ContextVar("measured", default=False)
+
+
+class Usage:
+    __slots__ = ("calls", "operations", "commands", "time")
+
+    def __init__(self):
+        self.calls = 0
+        self.operations = 0
+        self.commands = 0
+        self.time = 0.0
+
+
+class HandlerStats:
+    """Running database usage totals per handler"""
+
+    def __init__(self):
+        self.handlers: Dict[str, Usage] = {}
+        self.since = time.time()
+
+    def start(self, name: str):
+        """Attribute following database usage of the current task to the handler"""
+        handler.set(name)
+        self._get(name).calls += 1
+
+    def add_operation(self, seconds: float):
+        usage = self._get(handler.get())
+        usage.operations += 1
+        usage.time += seconds
+
+    def add_command(self):
+        self._get(handler.get()).commands += 1
+
+    def get(self) -> List[Tuple[str, Usage]]:
+        """Get handlers ordered by number of database commands"""
+        return sorted(
+            self.handlers.items(), key=lambda x: (x[1].commands, x[1].operations), reverse=True
+        )
+
+    def reset(self):
+        self.handlers = {}
+        self.since = time.time()
+
+    def _get(self, name: str) -> Usage:
+        usage = self.handlers.get(name)
+        if usage is None:
+            usage = self.handlers[name] = Usage()
+        return usage
+
+
+handlers = HandlerStats()
+
+
+def instrument(backend):
+    """Measure all coroutine methods of the database backend"""
+    for name, method in inspect.getmembers(backend, inspect.iscoroutinefunction):
+        if not name.startswith("_"):
+            setattr(backend, name, _measure(method))
+    return backend
+
+
+def _measure(method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if _measured.get():
+            return await method(*args, **kwargs)
+
+        token = _measured.set(True)
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            handlers.add_operation(time.perf_counter() - start)
+            _measured.reset(token)
+
+    return wrapper
@@ -1,33 +1,50 @@
-class Beam:
-    name = None
-    active = 0
-    anonymity = "none"
-    replace = 1
-    timeout = 60
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Tuple, Union
 
-    def __init__(self, name: str = None):
-        self.name = name
+# Objects are immutable named tuples: they have no per-instance __dict__ and are shared by
+# the repository caches. Use `_replace()` to get a changed copy.
+
+
+class Beam(NamedTuple):
+    name: str
+    active: int = 0
+    admin_id: int = 0
+    anonymity: str = "none"
+    replace: int = 1
+    timeout: int = 60
+    delivery: str = "bot"
+    coalesce: int = 0
+    attachments: str = "link"
+    messages: int = 0
+
+    @classmethod
+    def from_record(cls, name: str, record: Dict[str, Union[str, int]]) -> "Beam":
+        """Create beam from its database record"""
+        return cls._make(_decode(cls, name, record))
 
     def __repr__(self):
         return (
             f"Beam {self.name}: "
             f"active {self.active}, anonymity {self.anonymity}, "
-            f"replace {self.replace}, timeout {self.timeout}"
+            f"replace {self.replace}, timeout {self.timeout}, delivery {self.delivery}, "
+            f"coalesce {self.coalesce}, attachments {self.attachments}"
         )
 
 
-class Wormhole:
-    discord_id = None
-    beam = None
-    admin_id = 0
-    active = 1
-    logo = ""
-    messages = 0
-    readonly = 0
-    invite = ""
+class Wormhole(NamedTuple):
+    discord_id: int
+    beam: str = None
+    admin_id: int = 0
+    active: int = 1
+    logo: str = ""
+    messages: int = 0
+    readonly: int = 0
+    invite: str = ""
 
-    def __init__(self, discord_id: int = None):
-        self.discord_id = discord_id
+    @classmethod
+    def from_record(cls, discord_id: int, record: Dict[str, Union[str, int]]) -> "Wormhole":
+        """Create wormhole from its database record"""
+        return cls._make(_decode(cls, discord_id, record))
 
     def __repr__(self):
         return (
@@ -38,18 +55,55 @@ class Wormhole:
         )
 
 
-class User:
-    discord_id = None
-    mod = 0
-    nickname = ""
-    readonly = 0
-    restricted = 0
+class User(NamedTuple):
+    discord_id: int
+    mod: int = 0
+    nickname: str = ""
+    readonly: int = 0
+    restricted: int = 0
+    # beam name: wormhole ID, read-only like the rest of the object
+    home_ids: Mapping[str, int] = MappingProxyType({})
 
-    def __init__(self, discord_id: int = None):
-        self.discord_id = discord_id
+    @classmethod
+    def from_record(cls, discord_id: int, record: Dict[str, Union[str, int]]) -> "User":
+        """Create user from their database record
+
+        Home wormholes are read from ``home_id:[beam name]`` fields.
+        """
+        values = _decode(cls, discord_id, record)
+        homes = {k[8:]: int(v) for k, v in record.items() if k.startswith("home_id:") and v}
+        values.append(MappingProxyType(homes))
+        return cls._make(values)
 
     def __repr__(self):
         return (
             f"User {self.discord_id}: nickname {self.nickname}, "
             f"mod {self.mod}, readonly {self.readonly}, restricted {self.restricted}"
         )
+
+
+def _get_decoders(cls: type, exclude: Tuple[str, ...] = ()) -> List[Tuple[str, Callable, Any]]:
+    """Get (field, type, default) of fields read from the record, except the first one"""
+    return [
+        (name, cls.__annotations__[name], cls._field_defaults.get(name))
+        for name in cls._fields[1:]
+        if name not in exclude
+    ]
+
+
+# fmt: off
+_decoders = {
+    Beam:     _get_decoders(Beam),
+    Wormhole: _get_decoders(Wormhole),
+    User:     _get_decoders(User, exclude=("home_ids",)),
+}
+# fmt: on
+
+
+def _decode(cls: type, identifier, record: Dict[str, Union[str, int]]) -> List:
+    """Convert record values to field types, missing and empty values to field defaults"""
+    values = [identifier]
+    for name, kind, default in _decoders[cls]:
+        value = record.get(name)
+        values.append(kind(value) if value is not None and value != "" else default)
+    return values
@@ -0,0 +1,158 @@
+"""Outgoing message queues
+
+Relayed messages are not sent directly. Every destination channel has a queue with one
+consumer task, which sends the messages in order and keeps to Discord's rate limit of the
+channel on its own: a token bucket delays sends that would exceed it, so a burst is spread
+over time instead of running into 429 responses and retries. A slow or limited channel
+only delays its own queue. Bot messages and webhook messages have separate limits, so they
+have separate queues. Consumers stop after a minute without messages.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+# queue key: delivery kind and channel ID
+Key = Tuple[str, int]
+
+
+class TokenBucket:
+    """Allows ``capacity`` sends per ``period`` seconds, refilled continuously"""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token, return seconds to wait before the send"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class SendQueue:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.jobs = asyncio.Queue()
+        self.task = None
+        self.sent = 0
+        # seconds spent by messages in the queue
+        self.wait = 0.0
+        self.max_wait = 0.0
+
+
+class Outbox:
+    # kind: (messages, seconds)
+    limits = {"bot": (5, 5.0), "webhook": (5, 2.0)}
+    # seconds without messages after which the consumer stops
+    idle = 60
+
+    def __init__(self):
+        self._queues: Dict[Key, SendQueue] = {}
+        # totals of stopped queues
+        self.sent = 0
+        self.wait = 0.0
+        self.max_wait = 0.0
+        self.since = time.time()
+
+    def __len__(self) -> int:
+        return len(self._queues)
+
+    async def send(self, kind: str, channel_id: int, function: Callable[[], Awaitable]):
+        """Queue the send and wait for its result
+
+        ``function`` is called by the consumer when the message is due, exceptions it
+        raises are raised here.
+        """
+        key = (kind, channel_id)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = SendQueue(TokenBucket(*self.limits[kind]))
+
+        future = asyncio.get_event_loop().create_future()
+        queue.jobs.put_nowait((function, future, time.monotonic()))
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.ensure_future(self._consume(key, queue))
+        return await future
+
+    def get(self) -> List[Tuple[Key, SendQueue]]:
+        """Get running queues, longest first"""
+        return sorted(
+            self._queues.items(), key=lambda x: (x[1].jobs.qsize(), x[1].sent), reverse=True
+        )
+
+    def totals(self) -> Tuple[int, float, float]:
+        """Get number of sent messages, total and maximal queue wait"""
+        sent, wait, max_wait = self.sent, self.wait, self.max_wait
+        for queue in self._queues.values():
+            sent += queue.sent
+            wait += queue.wait
+            max_wait = max(max_wait, queue.max_wait)
+        return sent, wait, max_wait
+
+    def reset(self):
+        self.sent, self.wait, self.max_wait = 0, 0.0, 0.0
+        for queue in self._queues.values():
+            queue.sent, queue.wait, queue.max_wait = 0, 0.0, 0.0
+        self.since = time.time()
+
+    async def _consume(self, key: Key, queue: SendQueue):
+        future = None
+        try:
+            while True:
+                try:
+                    function, future, queued = await asyncio.wait_for(queue.jobs.get(), self.idle)
+                except asyncio.TimeoutError:
+                    if not queue.jobs.empty():
+                        continue
+                    self._queues.pop(key, None)
+                    self.sent += queue.sent
+                    self.wait += queue.wait
+                    self.max_wait = max(self.max_wait, queue.max_wait)
+                    return
+
+                # the sender is gone, e.g. the cog was unloaded
+                if future.cancelled():
+                    continue
+
+                await asyncio.sleep(queue.bucket.take())
+                wait = time.monotonic() - queued
+                queue.sent += 1
+                queue.wait += wait
+                queue.max_wait = max(queue.max_wait, wait)
+                await self._call(function, future)
+        except asyncio.CancelledError:
+            # the consumer was cancelled, e.g. on shutdown; nobody else resolves the senders
+            if future is not None:
+                future.cancel()
+            while not queue.jobs.empty():
+                queue.jobs.get_nowait()[1].cancel()
+            raise
+
+    async def _call(self, function: Callable[[], Awaitable], future: asyncio.Future):
+        """Call the function and pass its result, exception or cancellation to the future"""
+        # waiting for the task, unlike awaiting it, tells its cancellation from the
+        # cancellation of the consumer
+        task = asyncio.ensure_future(function())
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if task.cancelled():
+            future.cancel()
+            return
+        error = task.exception()
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(task.result())
+
+
+queues = Outbox()
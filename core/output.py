@@ -14,6 +14,7 @@ class Event:
 
         self.user_template = "{user} in {location}: {message}"
         self.sudo_template = "**SUDO** {user} in {location}: {message}"
+        self.system_template = "**SYSTEM** {message}"
 
     def get_channel(self):
         if self.channel is None:
@@ -43,3 +44,12 @@ class Event:
             message=message,
         ))
         # fmt: on
+
+    async def system(self, message: str):
+        """Events not caused by users"""
+        print(message)
+        channel = self.get_channel()
+        if channel is None:
+            print("ERROR: Log channel not found")
+            return
+        await channel.send(self.system_template.format(message=message))
@@ -0,0 +1,127 @@
+"""Beam routing table
+
+Relaying a message needs the source wormhole, its beam and all destination channels. The
+table keeps them in memory, keyed by source channel ID, so the relay does not have to ask
+the database. Repositories report changed beams; such beam is forgotten and loaded again
+on next use. Beams are also loaded again after a minute, so changes made by other
+processes are seen, and channels the bot could not see are looked up again on every use.
+"""
+
+import time
+from typing import Dict, List, NamedTuple, Optional, Set
+
+import discord
+
+from core import database, objects
+
+
+class Destination(NamedTuple):
+    # None if the bot cannot see the channel
+    channel: Optional[discord.TextChannel]
+    wormhole: objects.Wormhole
+
+
+class Route(NamedTuple):
+    beam: objects.Beam
+    source: objects.Wormhole
+    # all wormholes of the beam, including the source; shared by routes of the beam
+    destinations: List[Destination]
+
+
+class RoutingTable:
+    # seconds after which a beam is loaded again
+    ttl = 60
+
+    def __init__(self):
+        # used to resolve channels, set by the wormhole cogs
+        self.bot: Optional[discord.Client] = None
+        # source channel ID: route
+        self._routes: Dict[int, Route] = {}
+        # beam name: IDs of its wormholes
+        self._beams: Dict[str, List[int]] = {}
+        # beam name: time its routes expire
+        self._expires: Dict[str, float] = {}
+        # beams with destination channels the bot could not resolve
+        self._unresolved: Set[str] = set()
+        # channel known not to be wormhole: time the knowledge expires
+        self._missing: Dict[int, float] = {}
+        # increased on every change, beams loaded meanwhile are not stored
+        self._version = 0
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    async def get(self, channel_id: int) -> Optional[Route]:
+        """Get route of the channel, or None if it is not a wormhole"""
+        now = time.monotonic()
+        route = self._routes.get(channel_id)
+        if route is not None and self._expires.get(route.beam.name, 0) <= now:
+            # the wormhole may have been moved to another beam meanwhile
+            self._forget(route.beam.name)
+            route = None
+        if route is not None:
+            if route.beam.name in self._unresolved:
+                self._resolve(route.beam.name, route.destinations)
+            return route
+        if self._missing.get(channel_id, 0) > now:
+            return None
+
+        db_w = await database.repo_w.get(channel_id)
+        if db_w is None:
+            self._missing[channel_id] = now + self.ttl
+            return None
+        return (await self._load(db_w.beam)).get(channel_id)
+
+    def invalidate(self, beam: Optional[str] = None):
+        """Forget the beam, or all beams, so it is loaded again on next use"""
+        self._version += 1
+        self._missing = {}
+        if beam is None:
+            self._routes = {}
+            self._beams = {}
+            self._expires = {}
+            self._unresolved = set()
+            return
+        self._forget(beam)
+
+    def _forget(self, beam: str):
+        for channel_id in self._beams.pop(beam, ()):
+            self._routes.pop(channel_id, None)
+        self._expires.pop(beam, None)
+        self._unresolved.discard(beam)
+
+    def _resolve(self, beam: str, destinations: List[Destination]):
+        """Look up destination channels the bot could not see before"""
+        for i, destination in enumerate(destinations):
+            if destination.channel is None:
+                channel = self.bot.get_channel(destination.wormhole.discord_id)
+                destinations[i] = destination._replace(channel=channel)
+        if all(destination.channel is not None for destination in destinations):
+            self._unresolved.discard(beam)
+
+    async def _load(self, beam_name: str) -> Dict[int, Route]:
+        """Get routes of the beam's wormholes and store them in the table"""
+        version = self._version
+        db_b = await database.repo_b.get(beam_name)
+        if db_b is None:
+            return {}
+        wormholes = await database.repo_w.list_objects(beam_name)
+        destinations = [
+            Destination(self.bot.get_channel(db_w.discord_id), db_w) for db_w in wormholes
+        ]
+        routes = {db_w.discord_id: Route(db_b, db_w, destinations) for db_w in wormholes}
+
+        # the beam was changed while loading, the routes may be outdated
+        if version != self._version:
+            return routes
+        self._forget(beam_name)
+        self._routes.update(routes)
+        self._beams[beam_name] = list(routes.keys())
+        self._expires[beam_name] = time.monotonic() + self.ttl
+        if any(destination.channel is None for destination in destinations):
+            self._unresolved.add(beam_name)
+        return routes
+
+
+table = RoutingTable()
+database.listeners.append(table.invalidate)
@@ -0,0 +1,45 @@
+"""Runtime state shared by all cogs
+
+Cogs are loaded and reloaded one by one, so they keep no state of their own between
+events. Everything the relay needs is registered here, once per process: routes of
+wormhole channels, relayed messages kept for editing, webhooks, send queues, coalescing
+batches, attachment downloads and message counters. A change made by one cog, for
+example the admin cog editing a beam, is seen by the relay on the next message.
+"""
+
+from datetime import datetime
+from typing import Dict, Optional
+
+import discord
+
+from core import attachments, coalescing, database, outbox, routing, sent, webhooks
+
+
+class Runtime:
+    def __init__(self):
+        self.bot: Optional[discord.Client] = None
+        self.started = datetime.now()
+
+        self.routes = routing.table
+        self.sent = sent.store
+        self.webhooks = webhooks.pool
+        self.queues = outbox.queues
+        self.batches = coalescing.batches
+        self.attachments = attachments.downloader
+        # message counts waiting to be written to the database
+        self.counter = database.counter
+        # beam name: messages relayed since start
+        self.transferred: Dict[str, int] = {}
+
+    def attach(self, bot: discord.Client):
+        """Use the bot to resolve channels, called by every cog"""
+        self.bot = bot
+        self.routes.bot = bot
+        self.sent.bot = bot
+
+    def count(self, beam_name: str):
+        """Count message relayed in the beam since start"""
+        self.transferred[beam_name] = self.transferred.get(beam_name, 0) + 1
+
+
+runtime = Runtime()
@@ -0,0 +1,295 @@
+"""Relayed messages kept for editing and deleting
+
+Every relayed message has an entry with the IDs of its copies, found either by the
+original message ID or as the last message of the author in a channel. Entries hold no
+Discord objects; copies are edited and deleted through partial messages (or the channel's
+webhook), so memory does not depend on message size. Entries expire after the beam
+timeout. All of them share one timing wheel, advanced once per second by one task.
+
+Entries are also written to the database as expiring values, so edits and deletions work
+after restart and in other bot processes. Writes are collected and stored together;
+entries not found in memory are looked up there. Failed writes are reported to the log
+channel and tried again with the next entries.
+"""
+
+import asyncio
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import discord
+
+from core import database, output, webhooks
+
+
+class Copy(NamedTuple):
+    channel_id: int
+    message_id: int
+    # sent through webhook, has to be edited by the webhook
+    webhook: bool = False
+
+    @classmethod
+    def of(cls, message: discord.Message) -> "Copy":
+        return cls(message.channel.id, message.id, message.webhook_id is not None)
+
+    async def edit(self, bot: discord.Client, content: str):
+        channel = bot.get_channel(self.channel_id)
+        if channel is None:
+            return
+        if not self.webhook:
+            return await channel.get_partial_message(self.message_id).edit(content=content)
+        webhook = await webhooks.pool.get(channel)
+        if webhook is not None:
+            await webhook.edit_message(self.message_id, content=content)
+
+    async def delete(self, bot: discord.Client):
+        channel = bot.get_channel(self.channel_id)
+        if channel is None:
+            return
+        if not self.webhook:
+            return await channel.get_partial_message(self.message_id).delete()
+        webhook = await webhooks.pool.get(channel)
+        if webhook is not None:
+            await webhook.delete_message(self.message_id)
+
+
+class Entry:
+    __slots__ = ("original", "author_id", "replaced", "copies", "rounds", "removed")
+
+    # key of entry by original message ID, and of ID of author's last message in channel
+    key = "sent:{message_id}"
+    last_key = "sent:last:{author_id}:{channel_id}"
+
+    def __init__(self, original: Copy, author_id: int, replaced: bool):
+        self.original = original
+        self.author_id = author_id
+        # the original was deleted by the bot
+        self.replaced = replaced
+        # Copy, or coalescing.Part for copies sent in combined message
+        self.copies: list = []
+        # full turns of the timing wheel left
+        self.rounds = 0
+        self.removed = False
+
+    def encode(self) -> str:
+        """Get compact text form of the entry
+
+        ``author channel replaced copy…``, where each copy is ``channel:message`` with
+        ``:w`` appended for webhook messages. Copies in combined messages are not included,
+        they can only be changed by this process.
+        """
+        copies = [
+            f"{copy.channel_id}:{copy.message_id}" + (":w" if copy.webhook else "")
+            for copy in self.copies
+            if isinstance(copy, Copy)
+        ]
+        return " ".join(
+            [str(self.author_id), str(self.original.channel_id), str(int(self.replaced))] + copies
+        )
+
+    @classmethod
+    def decode(cls, message_id: int, value: str) -> "Entry":
+        author_id, channel_id, replaced, *copies = value.split(" ")
+        entry = cls(Copy(int(channel_id), message_id), int(author_id), replaced == "1")
+        for copy in copies:
+            channel_id, copy_id, *webhook = copy.split(":")
+            entry.copies.append(Copy(int(channel_id), int(copy_id), bool(webhook)))
+        return entry
+
+
+class TimingWheel:
+    """Calls the function for items after their number of seconds
+
+    Items are put in the slot where they expire, counting also the full turns of the
+    wheel; every second the next slot is visited. Adding is O(1) and expiry visits each
+    item once per turn.
+    """
+
+    def __init__(self, expire: Callable[[Entry], None], size: int = 64):
+        self.expire = expire
+        self.slots: List[List[Entry]] = [[] for _ in range(size)]
+        self.cursor = 0
+        self.count = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def add(self, entry: Entry, seconds: int):
+        ticks = max(1, seconds)
+        entry.rounds = (ticks - 1) // len(self.slots)
+        self.slots[(self.cursor + ticks) % len(self.slots)].append(entry)
+        self.count += 1
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+
+    def tick(self):
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        waiting = []
+        for entry in self.slots[self.cursor]:
+            if entry.rounds:
+                entry.rounds -= 1
+                waiting.append(entry)
+            else:
+                self.count -= 1
+                self.expire(entry)
+        self.slots[self.cursor] = waiting
+
+    async def _run(self):
+        # ticks are counted from the start, so slow iterations do not delay expiry
+        start = time.monotonic()
+        ticks = 0
+        while self.count:
+            await asyncio.sleep(max(0.0, start + ticks + 1 - time.monotonic()))
+            for _ in range(int(time.monotonic() - start) - ticks):
+                self.tick()
+                ticks += 1
+
+
+class SentStore:
+    def __init__(self):
+        # original message ID: entry
+        self._originals: Dict[int, Entry] = {}
+        # (author ID, channel ID): entries, oldest first
+        self._authors: Dict[Tuple[int, int], List[Entry]] = {}
+        # message ID: number of entries, for copies and replaced originals of the entries;
+        # their deletion does not have to be looked up
+        self._own: Dict[int, int] = {}
+        self._wheel = TimingWheel(self.remove)
+        # entries waiting to be written, with their timeouts
+        self._pending: List[Tuple[Entry, int]] = []
+        self._writer: Optional[asyncio.Task] = None
+        # used to report failed writes, set by the cogs
+        self.bot: Optional[discord.Client] = None
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._authors.values())
+
+    def add(self, entry: Entry, timeout: int):
+        """Keep the entry for timeout seconds"""
+        # replaced originals are gone, their deletion must not delete the copies
+        if not entry.replaced:
+            self._originals[entry.original.message_id] = entry
+        else:
+            self._count_own([entry.original], 1)
+        key = (entry.author_id, entry.original.channel_id)
+        self._authors.setdefault(key, []).append(entry)
+        self._wheel.add(entry, timeout)
+
+    def save(self, entry: Entry, timeout: int):
+        """Write the entry to the database, once all its copies are sent"""
+        if not entry.removed:
+            self._count_own(entry.copies, 1)
+        self._pending.append((entry, timeout))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._write())
+
+    def is_own(self, message_id: int) -> bool:
+        """Whether the message is a copy or replaced original of a kept entry"""
+        return message_id in self._own
+
+    async def find(self, message_id: int) -> Optional[Entry]:
+        """Get entry by ID of the original message, from memory or the database"""
+        return (await self.find_many([message_id]))[0]
+
+    async def find_many(self, message_ids: List[int]) -> List[Optional[Entry]]:
+        """Get entries of original messages, looking up missing ones in one request"""
+        result = {i: self._originals.get(i) for i in message_ids}
+        missing = [i for i, entry in result.items() if entry is None]
+        if missing:
+            keys = [Entry.key.format(message_id=i) for i in missing]
+            for message_id, value in zip(missing, await database.backend.get_expiring(keys)):
+                entry = Entry.decode(message_id, value) if value is not None else None
+                # replaced originals are not found by ID, see add()
+                if entry is not None and not entry.replaced:
+                    result[message_id] = entry
+        return [result[i] for i in message_ids]
+
+    def last(self, author_id: int, channel_id: int) -> Optional[Entry]:
+        """Get the latest entry of the author in the channel"""
+        entries = self._authors.get((author_id, channel_id))
+        return entries[-1] if entries else None
+
+    async def find_last(self, author_id: int, channel_id: int) -> Optional[Entry]:
+        """Get the latest entry of the author in the channel, from memory or the database"""
+        entry = self.last(author_id, channel_id)
+        if entry is not None:
+            return entry
+        key = Entry.last_key.format(author_id=author_id, channel_id=channel_id)
+        message_id = (await database.backend.get_expiring([key]))[0]
+        if message_id is None:
+            return None
+        key = Entry.key.format(message_id=message_id)
+        value = (await database.backend.get_expiring([key]))[0]
+        return Entry.decode(int(message_id), value) if value is not None else None
+
+    async def forget(self, entry: Entry):
+        """Remove the entry from memory and the database
+
+        The author's last message in the channel is forgotten too, unless it is a newer one.
+        """
+        self.remove(entry)
+        message_id = entry.original.message_id
+        last_key = Entry.last_key.format(
+            author_id=entry.author_id, channel_id=entry.original.channel_id
+        )
+        keys = [Entry.key.format(message_id=message_id)]
+        if (await database.backend.get_expiring([last_key]))[0] == str(message_id):
+            keys.append(last_key)
+        await database.backend.delete_expiring(keys)
+
+    def remove(self, entry: Entry):
+        """Forget the entry in memory, its copies cannot be edited anymore"""
+        if entry.removed:
+            return
+        entry.removed = True
+        # entries loaded from the database are not kept in memory
+        if self._originals.get(entry.original.message_id) is entry:
+            del self._originals[entry.original.message_id]
+        key = (entry.author_id, entry.original.channel_id)
+        entries = self._authors.get(key, [])
+        if entry in entries:
+            entries.remove(entry)
+            if not entries:
+                del self._authors[key]
+            self._count_own(entry.copies + ([entry.original] if entry.replaced else []), -1)
+
+    def _count_own(self, copies: list, change: int):
+        for copy in copies:
+            # copies in combined message share its ID
+            count = self._own.get(copy.message_id, 0) + change
+            if count > 0:
+                self._own[copy.message_id] = count
+            else:
+                self._own.pop(copy.message_id, None)
+
+    async def _write(self):
+        while self._pending:
+            pending, self._pending = self._pending, []
+            values = []
+            for entry, timeout in pending:
+                if entry.removed:
+                    continue
+                message_id = entry.original.message_id
+                key = Entry.last_key.format(
+                    author_id=entry.author_id, channel_id=entry.original.channel_id
+                )
+                values.append((Entry.key.format(message_id=message_id), entry.encode(), timeout))
+                values.append((key, str(message_id), timeout))
+            if not values:
+                continue
+            try:
+                await database.backend.set_expiring(values)
+            except Exception as e:
+                # keep the entries for the next write, the writer is started by next save
+                self._pending = pending + self._pending
+                await self._report(e)
+                return
+
+    async def _report(self, error: Exception):
+        if self.bot is None:
+            return
+        message = f"Could not store relayed messages:\n>>>{type(error).__name__}\n{error}"
+        try:
+            await output.Event(self.bot).system(message)
+        except discord.HTTPException:
+            pass
+
+
+store = SentStore()
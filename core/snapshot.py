@@ -0,0 +1,154 @@
+"""Export and import of the whole database
+
+Snapshot is a line-delimited JSON file. The first line is a header, every following line
+holds one record: ``{"kind": "beam", "id": "main", "record": {...}}``. Beams come first,
+then wormholes and users, so the file can be restored in one pass. Files with ``.gz``
+suffix are compressed.
+
+Run ``python3 -m core.snapshot --help`` to use it from the command line.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import time
+from typing import Dict, IO, List, Optional
+
+from core import database
+
+VERSION = 1
+BATCH = 1000
+
+
+def open_file(path: str, mode: str) -> IO[str]:
+    """Open snapshot file for reading ("r") or writing ("w")
+
+    Written files are compressed if the path ends with ``.gz``, read files are
+    recognised by their content.
+    """
+    if mode == "w":
+        if path.endswith(".gz"):
+            return gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+        return open(path, "w", encoding="utf-8")
+
+    with open(path, "rb") as handle:
+        compressed = handle.read(2) == b"\x1f\x8b"
+    if compressed:
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+async def export(handle: IO[str], beam: Optional[str] = None) -> Dict[str, int]:
+    """Write all records, or records related to one beam, into the file
+
+    Records are read in batches, so the memory use does not depend on the database size.
+    Returns number of exported records of each kind.
+    """
+    # include messages counted since the last flush
+    await database.counter.flush()
+
+    header = {"wormhole": VERSION, "created": int(time.time()), "beam": beam}
+    handle.write(json.dumps(header) + "\n")
+
+    if beam is None:
+        batches = {kind: database.backend.scan(kind, BATCH) for kind in database.backend.kinds}
+    else:
+        wormholes = await database.backend.list_wormholes(beam)
+        users = await database.backend.list_users_by_wormholes(wormholes)
+        batches = {
+            "beam": _get_batches("beam", [beam]),
+            "wormhole": _get_batches("wormhole", wormholes),
+            "user": _get_batches("user", users),
+        }
+
+    result = {}
+    for kind, records in batches.items():
+        result[kind] = 0
+        async for batch in records:
+            handle.write(
+                "".join(
+                    json.dumps({"kind": kind, "id": k, "record": v}, separators=(",", ":")) + "\n"
+                    for k, v in batch
+                )
+            )
+            result[kind] += len(batch)
+    return result
+
+
+async def load(handle: IO[str]) -> Dict[str, int]:
+    """Restore records from the file, replacing existing ones
+
+    Records are written in batches. Indexes and beam message counters are rebuilt
+    afterwards. Returns number of imported records of each kind.
+    """
+    header = json.loads(handle.readline() or "{}")
+    if header.get("wormhole") != VERSION:
+        raise ValueError("Not a wormhole snapshot or unsupported version.")
+
+    result = {kind: 0 for kind in database.backend.kinds}
+    kind = None
+    batch = []
+    for line in handle:
+        item = json.loads(line)
+        if item["kind"] != kind or len(batch) >= BATCH:
+            await _add_batch(kind, batch)
+            result[kind] = result.get(kind, 0) + len(batch)
+            kind, batch = item["kind"], []
+        batch.append((item["id"], item["record"]))
+    await _add_batch(kind, batch)
+    result[kind] = result.get(kind, 0) + len(batch)
+    result.pop(None, None)
+
+    await database.repo_b.reindex()
+    await database.repo_w.reindex()
+    await database.repo_u.reindex()
+    for repository in (database.repo_b, database.repo_w, database.repo_u):
+        repository.cache.invalidate()
+    return result
+
+
+async def _get_batches(kind: str, identifiers: List):
+    for i in range(0, len(identifiers), BATCH):
+        chunk = identifiers[i : i + BATCH]
+        records = await database.backend.get_many(kind, chunk)
+        yield [(k, v) for k, v in zip(chunk, records) if v is not None]
+
+
+async def _add_batch(kind: Optional[str], batch: List):
+    if kind not in database.backend.kinds:
+        if batch:
+            raise ValueError(f"Unknown record kind: {kind}.")
+        return
+    await database.backend.add_many(kind, batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the wormhole database")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    parser_export = subparsers.add_parser("export", help="write database to a file")
+    parser_export.add_argument("file", help="snapshot file, compressed if it ends with .gz")
+    parser_export.add_argument("--beam", help="export only one beam with its wormholes and users")
+    parser_import = subparsers.add_parser("import", help="restore database from a file")
+    parser_import.add_argument("file", help="snapshot file")
+    args = parser.parse_args()
+
+    async def run():
+        start = time.monotonic()
+        try:
+            if args.action == "export":
+                with open_file(args.file, "w") as handle:
+                    result = await export(handle, args.beam)
+            else:
+                with open_file(args.file, "r") as handle:
+                    result = await load(handle)
+        finally:
+            await database.backend.close()
+        counts = ", ".join(f"{count} {kind}s" for kind, count in result.items())
+        print(f"{args.action.title()}ed {counts} in {time.monotonic() - start:.2f} s.")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Message content tokenizer
+
+Splits message content into text and Discord markup tokens in one pass, so the relay can
+resolve all mentions and emojis and build the output without repeated searching and
+replacing.
+"""
+
+import re
+from typing import Dict, List, Tuple
+
+from core import objects
+
+# fmt: off
+USER    = "user"     # <@123>, <@!123>
+ROLE    = "role"     # <@&123>
+CHANNEL = "channel"  # <#123>
+EMOJI   = "emoji"    # <:name:123>
+FENCE   = "fence"    # ```lang, with one surrounding space on each side
+# fmt: on
+
+# one capturing group, so splitting keeps the markup tokens
+pattern = re.compile(r"(<@!?[0-9]+>|<@&[0-9]+>|<#[0-9]+>|<:[a-zA-Z0-9_]+:[0-9]+>| ?```[a-z0-9]* ?)")
+
+
+# ((nickname)) tag, the nickname is captured
+tag_pattern = re.compile(r"\(\(([^\(\)]*)\)\)")
+
+
+def tokenize(content: str) -> List[str]:
+    """Split content into tokens
+
+    Text tokens are at even positions, markup tokens at odd ones; joined tokens are the
+    content.
+    """
+    return pattern.split(content)
+
+
+def parse(token: str) -> Tuple[str, str]:
+    """Get kind and value of markup token
+
+    Value is the ID for mentions, ``name:ID`` for emojis and the fence for code fences.
+    """
+    if token.startswith("<@&"):
+        return ROLE, token[3:-1]
+    if token.startswith("<@"):
+        return USER, token[2:-1].lstrip("!")
+    if token.startswith("<#"):
+        return CHANNEL, token[2:-1]
+    if token.startswith("<:"):
+        return EMOJI, token[2:-1]
+    return FENCE, token.strip(" ")
+
+
+def format_lines(content: str, first_prefix: str, prefix: str) -> str:
+    """Put prefix in front of every line outside of code blocks
+
+    First line gets the first prefix. If the message starts with code block, the first
+    prefix is put on its own line. Every line is terminated by newline.
+    """
+    result = []
+    code = False
+    for i, line in enumerate(content.split("\n")):
+        if i == 0 and line.startswith("```"):
+            result.append(first_prefix + "\n")
+        if line.startswith("```"):
+            code = True
+        if code:
+            result.append(line + "\n")
+        else:
+            result.append((first_prefix if i == 0 else prefix) + line + "\n")
+        if code and line.endswith("```"):
+            code = False
+    return "".join(result)
+
+
+class Template:
+    """Message text with slots for ((nickname)) tags of registered users
+
+    The text is split once and every destination only picks its rendering: a tagged user
+    is mentioned in their home wormhole and written in bold elsewhere. Destinations that
+    are not home of any tagged user share one string, which is the text itself if there
+    are no tags. ``aliases`` map tags which are not exact nicknames to the nicknames.
+    """
+
+    __slots__ = ("default", "homes")
+
+    def __init__(
+        self,
+        text: str,
+        beam_name: str,
+        users: List[objects.User],
+        aliases: Dict[str, str] = None,
+    ):
+        users = {user.nickname: user for user in users if beam_name in user.home_ids}
+        aliases = aliases or {}
+        # nicknames are at odd positions
+        parts = tag_pattern.split(text)
+        slots = [i for i in range(1, len(parts), 2) if aliases.get(parts[i], parts[i]) in users]
+        # wormhole ID: its rendering
+        self.homes: Dict[int, str] = {}
+        if not slots:
+            self.default = text
+            return
+
+        tagged = {i: users[aliases.get(parts[i], parts[i])] for i in slots}
+        for i in range(1, len(parts), 2):
+            nickname = tagged[i].nickname if i in tagged else parts[i]
+            parts[i] = f"**__{nickname}__**" if i in tagged else f"(({nickname}))"
+        self.default = "".join(parts)
+
+        for home in {user.home_ids[beam_name] for user in tagged.values()}:
+            rendered = list(parts)
+            for i, user in tagged.items():
+                if user.home_ids[beam_name] == home:
+                    rendered[i] = f"<@!{user.discord_id}>"
+            self.homes[home] = "".join(rendered)
+
+    def render(self, wormhole_id: int) -> str:
+        """Get text for the destination wormhole"""
+        return self.homes.get(wormhole_id, self.default)
@@ -0,0 +1,129 @@
+"""Webhooks of wormhole channels
+
+Beams with webhook delivery post through a webhook of each wormhole channel, under the
+author's name and avatar. Every channel has one webhook owned by the bot; it is looked up
+or created on first use and kept in memory, across cog reloads.
+
+Kept webhooks are checked against the channel's webhooks before use once in a while, and
+forgotten when the guild changes webhooks of the channel, so a webhook removed by the
+guild is replaced before the next send. If it is removed just before a send anyway, the
+send is repeated with a new webhook. Channels where the bot may not manage webhooks are
+not asked again for a while; the relay sends there as the bot, with the author's name in
+front of the text.
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import discord
+
+# name of webhooks created by the bot
+NAME = "Wormhole"
+# seconds to wait before asking again for webhooks of channel without permissions
+RETRY = 600
+# seconds after which a kept webhook is checked before use
+VALIDATE = 600
+
+
+class WebhookPool:
+    def __init__(self):
+        # channel ID: webhook
+        self._webhooks: Dict[int, discord.Webhook] = {}
+        # channel ID: time the webhook should be checked again
+        self._expires: Dict[int, float] = {}
+        # channel ID: lock, so concurrent sends do not create several webhooks
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # channel ID: time of the next attempt
+        self._forbidden: Dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._webhooks)
+
+    async def get(self, channel: discord.TextChannel) -> Optional[discord.Webhook]:
+        """Get webhook of the channel, or None if the bot cannot manage them"""
+        webhook = self._webhooks.get(channel.id)
+        if webhook is not None and self._expires[channel.id] > time.monotonic():
+            return webhook
+        if webhook is None and self._forbidden.get(channel.id, 0) > time.monotonic():
+            return None
+
+        lock = self._locks.setdefault(channel.id, asyncio.Lock())
+        async with lock:
+            webhook = self._webhooks.get(channel.id)
+            # kept webhook is looked up again, which also checks it still exists
+            if webhook is None or self._expires[channel.id] <= time.monotonic():
+                webhook = await self._load(channel)
+        return webhook
+
+    def invalidate(self, channel_id: Optional[int] = None):
+        """Forget webhook of the channel, or of all channels"""
+        if channel_id is None:
+            self._webhooks = {}
+            self._expires = {}
+            self._forbidden = {}
+            return
+        self._webhooks.pop(channel_id, None)
+        self._expires.pop(channel_id, None)
+        self._forbidden.pop(channel_id, None)
+
+    async def send(
+        self,
+        channel: discord.TextChannel,
+        content: str,
+        *,
+        username: str,
+        avatar_url: str,
+        allowed_mentions: discord.AllowedMentions = None,
+        files: List[discord.File] = None,
+    ) -> Optional[discord.WebhookMessage]:
+        """Send message through webhook of the channel
+
+        Returns None if the channel has no usable webhook, the message should be sent by
+        the bot instead.
+        """
+        # the second attempt uses a new webhook, if the cached one was deleted
+        for _ in range(2):
+            webhook = await self.get(channel)
+            if webhook is None:
+                return None
+            # files may have been read by the failed attempt
+            for file in files or ():
+                file.reset()
+            try:
+                return await webhook.send(
+                    content,
+                    username=username,
+                    avatar_url=avatar_url,
+                    allowed_mentions=allowed_mentions,
+                    files=files,
+                    wait=True,
+                )
+            except discord.NotFound:
+                self._webhooks.pop(channel.id, None)
+                self._expires.pop(channel.id, None)
+        return None
+
+    async def _load(self, channel: discord.TextChannel) -> Optional[discord.Webhook]:
+        """Find bot's webhook in the channel or create one"""
+        try:
+            webhook = discord.utils.find(
+                lambda w: w.token is not None
+                and w.user is not None
+                and w.user.id == channel.guild.me.id,
+                await channel.webhooks(),
+            )
+            if webhook is None:
+                webhook = await channel.create_webhook(name=NAME, reason="Wormhole delivery")
+        except discord.Forbidden:
+            self._webhooks.pop(channel.id, None)
+            self._expires.pop(channel.id, None)
+            self._forbidden[channel.id] = time.monotonic() + RETRY
+            return None
+
+        self._webhooks[channel.id] = webhook
+        self._expires[channel.id] = time.monotonic() + VALIDATE
+        return webhook
+
+
+pool = WebhookPool()
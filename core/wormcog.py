@@ -2,18 +2,22 @@ import asyncio
 import datetime
 import json
 import re
-from typing import List
+from typing import List, NamedTuple, Optional
 
 import discord
 from discord.ext import commands
 
-from core import output, objects
-from core.database import repo_b, repo_u, repo_w
+from core import attachments, output, routing, sent, tokenizer
+from core.runtime import runtime
+from core.database import repo_u, repo_w
 
-# TODO When the message is removed, remove it from sent[], too
+config = json.load(open("config.json"))
 
 
-config = json.load(open("config.json"))
+class Identity(NamedTuple):
+    # name and avatar of messages sent through webhooks
+    name: str
+    avatar_url: Optional[str]
 
 
 async def presence(bot: commands.Bot):
@@ -26,11 +30,8 @@ class Wormcog(commands.Cog):
         super().__init__()
         self.bot = bot
 
-        # active text channels acting as wormholes
-        self.wormholes = {}
-
-        # sent messages still held in memory
-        self.sent = []
+        # state shared by all cogs, kept across reloads
+        runtime.attach(bot)
 
         # bot management logging
         self.event = output.Event(self.bot)
@@ -39,35 +40,17 @@ class Wormcog(commands.Cog):
     ## FUNCTIONS
     ##
 
-    def reconnect(self, beam: str = None):
-        if beam is None:
-            self.wormholes = {}
-        else:
-            self.wormholes[beam] = []
-
-        wormholes = repo_w.list_objects(beam)
-        for wormhole in wormholes:
-            self.wormholes[beam].append(self.bot.get_channel(wormhole.discord_id))
-
     def delay(self, key: str = "user"):
         if key == "user":
             return 20
         if key == "admin":
             return 10
 
-    def get_free_nickname(self, nickname: str) -> str:
-        i = 0
-        orig_name = nickname
-        while repo_u.is_nickname_used(nickname):
-            nickname = f"{orig_name}{i}"
-            i += 1
-        return nickname
-
     async def smart_send(self, ctx, *, content: str = None, embed: discord.Embed = None):
         if content is None and embed is None:
             return
 
-        if hasattr(ctx.channel, "id") and repo_w.get(ctx.channel.id) is not None:
+        if hasattr(ctx.channel, "id") and await repo_w.get(ctx.channel.id) is not None:
             await ctx.send(content=content, embed=embed, delete_after=self.delay())
         else:
             await ctx.send(content=content, embed=embed)
@@ -78,28 +61,35 @@ class Wormcog(commands.Cog):
         message: discord.Message,
         text: str,
         files: list = None,
+        uploads: List[attachments.Buffer] = None,
     ):
-        """Distribute the message"""
+        """Distribute the message
+
+        ``files`` are attachments relayed as links, ``uploads`` downloaded attachments
+        uploaded to every wormhole.
+        """
+        files = files or []
+        uploads = uploads or []
         deleted_original = False
 
         # get variables
-        messages = [message]
-        db_w = repo_w.get(message.channel.id)
-        db_b = repo_b.get(db_w.beam)
+        route = await runtime.routes.get(message.channel.id)
+        if route is None:
+            return
+        db_w, db_b = route.source, route.beam
 
         # access control
         if db_b.active == 0:
             return
         if db_w.active == 0 or db_w.readonly == 1:
             return
-        if repo_u.get_attribute(message.author.id, "readonly") == 1:
+        if await repo_u.get_attribute(message.author.id, "readonly") == 1:
             return
 
         # remove the original, if possible
         manage_messages_perm = message.guild.me.permissions_in(message.channel).manage_messages
         if manage_messages_perm and db_b.replace == 1 and not files:
             try:
-                messages[0] = message.author
                 await self.delete(message)
                 deleted_original = True
             except discord.Forbidden:
@@ -108,30 +98,40 @@ class Wormcog(commands.Cog):
         # limit message length
         text = text[:1024]
 
-        # update wormhole list
-        if db_b.name not in self.wormholes.keys():
-            self.reconnect(db_b.name)
-        wormholes = self.wormholes[db_b.name]
-
-        users = self._get_users_from_tags(beam_name=db_b.name, text=text)
+        template = await self._get_template(beam_name=db_b.name, text=text)
+        identity = None
+        if db_b.delivery == "webhook":
+            identity = await self._get_identity(message, db_b)
+        window = 0.0
+        # messages with files are not combined
+        if db_b.coalesce > 0 and not uploads:
+            window = runtime.batches.window(db_b.name, db_b.coalesce / 1000)
+
+        # keep the message for editing and deletion; copies are added as they are sent
+        entry = sent.Entry(sent.Copy.of(message), message.author.id, deleted_original)
+        if db_b.timeout > 0:
+            runtime.sent.add(entry, db_b.timeout)
 
         # replicate messages
         tasks = []
-        for wormhole in wormholes:
+        for destination in route.destinations:
             task = asyncio.ensure_future(
                 self.replicate(
-                    wormhole,
+                    destination,
                     message,
-                    messages,
-                    users,
-                    text,
+                    entry,
+                    template,
                     files,
-                    db_b,
                     manage_messages_perm,
+                    identity,
+                    window,
+                    uploads,
                 )
             )
             tasks.append(task)
         await asyncio.gather(*tasks, return_exceptions=True)
+        if db_b.timeout > 0:
+            runtime.sent.save(entry, db_b.timeout)
 
         # add checkmark to original, if it hasn't been deleted
         if not deleted_original:
@@ -140,28 +140,24 @@ class Wormcog(commands.Cog):
             except discord.Forbidden:
                 await message.channel.send(f"_Successfully distributed_ ✅")
 
-        # save message objects in case of editing/deletion
-        if db_b.timeout > 0:
-            self.sent.append(messages)
-            await asyncio.sleep(db_b.timeout)
-            self.sent.remove(messages)
-
     async def replicate(
         self,
-        wormhole,
+        destination: routing.Destination,
         message,
-        messages,
-        users,
-        text,
+        entry: sent.Entry,
+        template: tokenizer.Template,
         files,
-        db_b,
         manage_messages_perm,
+        identity: Optional[Identity] = None,
+        window: float = 0,
+        uploads: List[attachments.Buffer] = (),
     ):
-        # skip not active wormholes
-        if repo_w.get_attribute(wormhole.id, "active") == 0:
+        # skip not active and unavailable wormholes
+        wormhole = destination.channel
+        if destination.wormhole.active == 0 or wormhole is None:
             return
 
-        # skip source if message has attachments
+        # skip source if message has attachments relayed as links
         if wormhole.id == message.channel.id and len(files) > 0:
             return
 
@@ -171,12 +167,18 @@ class Wormcog(commands.Cog):
 
         # send message
         try:
-            m = await wormhole.send(
-                self._process_tags(
-                    beam_name=db_b.name, wormhole_id=wormhole.id, users=users, text=text
+            text = template.render(wormhole.id)
+            if window > 0:
+                copy = await runtime.batches.send(
+                    wormhole.id,
+                    text,
+                    window=window,
+                    identity=identity,
+                    deliver=lambda content: self.deliver(wormhole, content, identity),
                 )
-            )
-            messages.append(m)
+            else:
+                copy = sent.Copy.of(await self.deliver(wormhole, text, identity, uploads))
+            entry.copies.append(copy)
         except discord.Forbidden:
             await self.event.user(
                 message,
@@ -195,20 +197,84 @@ class Wormcog(commands.Cog):
                 ),
             )
 
-    def _get_users_from_tags(self, beam_name: str, text: str) -> List[objects.User]:
-        tags = [repo_u.get_by_nickname(tag) for tag in re.findall(r"\(\(([^\(\)]*)\)\)", text)]
-        users = [user for user in tags if user is not None and beam_name in user.home_ids.keys()]
-        return users
-
-    def _process_tags(
-        self, beam_name: str, wormhole_id: int, users: List[objects.User], text: str
-    ) -> str:
-        for user in users:
-            if wormhole_id == user.home_ids[beam_name]:
-                text = text.replace(f"(({user.nickname}))", f"<@!{user.discord_id}>")
-            else:
-                text = text.replace(f"(({user.nickname}))", f"**__{user.nickname}__**")
-        return text
+    async def deliver(
+        self,
+        channel: discord.TextChannel,
+        text: str,
+        identity: Optional[Identity] = None,
+        uploads: List[attachments.Buffer] = (),
+    ) -> discord.Message:
+        """Queue the text for sending to the channel, as the bot or through webhook
+
+        Every send reads the uploaded files from the shared buffers.
+        """
+        upload = runtime.attachments.upload
+        if identity is None:
+            return await runtime.queues.send(
+                "bot",
+                channel.id,
+                lambda: upload(uploads, lambda files: channel.send(text, files=files)),
+            )
+
+        m = await runtime.queues.send(
+            "webhook",
+            channel.id,
+            lambda: upload(
+                uploads,
+                lambda files: runtime.webhooks.send(
+                    channel,
+                    text,
+                    username=identity.name,
+                    avatar_url=identity.avatar_url,
+                    allowed_mentions=self.bot.allowed_mentions,
+                    files=files,
+                ),
+            ),
+        )
+        if m is None:
+            # the channel has no webhook, send as the bot
+            text = f"**{self.sanitise(identity.name)}**: {text}"
+            m = await runtime.queues.send(
+                "bot",
+                channel.id,
+                lambda: upload(uploads, lambda files: channel.send(text, files=files)),
+            )
+        return m
+
+    async def _get_template(self, beam_name: str, text: str) -> tokenizer.Template:
+        """Compile text with ((nickname)) tags for distribution in the beam
+
+        Tags which are not nicknames stand for the only nickname matching them ignoring
+        case, or starting with them.
+        """
+        users, aliases = [], {}
+        for tag in set(tokenizer.tag_pattern.findall(text)):
+            user = await repo_u.get_by_nickname(tag)
+            if user is None:
+                nickname = await repo_u.resolve_nickname(tag)
+                user = await repo_u.get_by_nickname(nickname) if nickname is not None else None
+                if user is not None:
+                    aliases[tag] = user.nickname
+            if user is not None:
+                users.append(user)
+        return tokenizer.Template(text, beam_name, users, aliases)
+
+    async def _get_identity(self, message: discord.Message, db_b) -> Identity:
+        """Get name and avatar for webhook delivery in the beam"""
+        if db_b.anonymity == "full":
+            name, avatar_url = self.bot.user.name, self.bot.user.avatar_url
+        elif db_b.anonymity == "guild":
+            name, avatar_url = message.guild.name, message.guild.icon_url
+        else:
+            db_u = await repo_u.get(message.author.id)
+            nickname = db_u.nickname if db_u is not None else message.author.name
+            name, avatar_url = f"{nickname} | {message.guild.name}", message.author.avatar_url
+
+        # Discord refuses webhook names containing these words
+        name = re.sub(
+            r"(?i)(clyde|discord)", lambda m: m.group(0)[0] + "\u200b" + m.group(0)[1:], name
+        )
+        return Identity(name[:80], str(avatar_url) or None)
 
     async def announce(self, *, beam: str, message: str):
         """Send information to all channels"""
@@ -217,7 +283,7 @@ class Wormcog(commands.Cog):
         else:
             embed = self.get_embed(description=message)
 
-        for db_w in repo_w.list_objects(beam=beam):
+        for db_w in await repo_w.list_objects(beam=beam):
             await self.bot.get_channel(db_w.discord_id).send(embed=embed)
 
     async def feedback(self, ctx, *, private: bool = True, message: str):
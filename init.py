@@ -6,7 +6,8 @@ from datetime import datetime
 import discord
 from discord.ext import commands
 
-from core import wormcog, output, checks
+from core import wormcog, output, checks, database, metrics
+from core.runtime import runtime
 
 config = json.load(open("config.json"))
 git_repo = git.Repo(search_parent_directories=True)
@@ -17,8 +18,33 @@ intents.members = True
 # FIXME Do we need member cache? We only use it for whois and tag translation
 intents.emojis = True  # Needed to translate unavailable emojis
 intents.messages = True  # Core functionality
+intents.webhooks = True  # Needed to replace webhooks removed by guilds
 
-bot = commands.Bot(
+
+class Bot(commands.Bot):
+    async def start(self, *args, **kwargs):
+        await database.backend.open()
+        await super().start(*args, **kwargs)
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        # every event runs in its own task, database usage is counted per handler
+        metrics.handlers.start(coro.__qualname__)
+        await super()._run_event(coro, event_name, *args, **kwargs)
+
+    async def invoke(self, ctx: commands.Context):
+        if ctx.command is not None:
+            metrics.handlers.start(f"command {ctx.command.qualified_name}")
+        await super().invoke(ctx)
+
+    async def close(self):
+        await super().close()
+        # write out message counters
+        await runtime.counter.flush()
+        await runtime.attachments.close()
+        await database.backend.close()
+
+
+bot = Bot(
     command_prefix=config["prefix"],
     help_command=None,
     allowed_mentions=discord.AllowedMentions(roles=False, everyone=False, users=True),
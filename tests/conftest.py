@@ -0,0 +1,26 @@
+"""Test setup
+
+Bot modules read ``config.json`` from the working directory when they are imported. The
+tests run in a temporary directory with the default configuration and the in-memory
+database backend, so they need neither a config file nor a database server.
+"""
+
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+with open(os.path.join(root, "config.default.json")) as handle:
+    config = json.load(handle)
+config["backend"] = "memory"
+
+directory = tempfile.mkdtemp(prefix="wormhole-tests-")
+atexit.register(shutil.rmtree, directory, True)
+os.chdir(directory)
+with open("config.json", "w") as handle:
+    json.dump(config, handle)
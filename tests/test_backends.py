@@ -0,0 +1,299 @@
+"""Conformance tests of the storage backends
+
+Every test runs against the in-memory, SQLite and Redis backend; Redis is emulated by
+fakeredis. Backends may return values as strings, so records are compared as strings.
+"""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from core.backends.memory import MemoryBackend
+from core.backends.redis import RedisBackend
+from core.backends.sqlite import SQLiteBackend
+from core.errors import DatabaseException
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "wormhole.db"))
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisBackend(fakeredis.FakeAsyncRedis(decode_responses=True))
+
+
+def run(backend, test):
+    """Run the test coroutine with the backend, close the backend afterwards"""
+
+    async def main():
+        try:
+            await test(backend)
+        finally:
+            await backend.close()
+
+    asyncio.run(main())
+
+
+def strings(record):
+    return {k: str(v) for k, v in record.items()} if record is not None else None
+
+
+async def fill(backend):
+    """Add beams main and dev, wormholes 10 and 11 in main, 20 in dev and two users"""
+    for name in ("main", "dev"):
+        await backend.add("beam", name, {"active": 1, "admin_id": 0, "messages": 0})
+    for discord_id, beam in ((10, "main"), (11, "main"), (20, "dev")):
+        await backend.add("wormhole", discord_id, {"beam": beam, "active": 1, "messages": 0})
+    await backend.add_user(100, {"nickname": "alice", "mod": 1, "readonly": 0, "restricted": 0})
+    await backend.add_user(101, {"nickname": "bob", "mod": 0, "readonly": 0, "restricted": 0})
+    await backend.set("user", 100, "home_id:main", 10)
+    await backend.set("user", 101, "home_id:main", 11)
+    await backend.set("user", 101, "home_id:dev", 20)
+
+
+async def beam_messages(backend, name: str) -> int:
+    return int((await backend.get("beam", name))["messages"])
+
+
+def test_add_set_delete(backend):
+    async def test(backend):
+        await backend.add("beam", "main", {"active": 1, "anonymity": "none", "timeout": 60})
+        assert await backend.exists("beam", "main")
+        record = strings(await backend.get("beam", "main"))
+        assert record["anonymity"] == "none" and record["timeout"] == "60"
+
+        await backend.set("beam", "main", "anonymity", "full")
+        assert strings(await backend.get("beam", "main"))["anonymity"] == "full"
+
+        await backend.delete("beam", "main")
+        assert not await backend.exists("beam", "main")
+        assert await backend.get("beam", "main") is None
+
+    run(backend, test)
+
+
+def test_get_many_keeps_order(backend):
+    async def test(backend):
+        await fill(backend)
+        records = await backend.get_many("wormhole", [20, 99, 10])
+        assert [strings(r)["beam"] if r else None for r in records] == ["dev", None, "main"]
+        assert await backend.get_many("wormhole", []) == []
+
+    run(backend, test)
+
+
+def test_nickname_is_unique(backend):
+    async def test(backend):
+        await fill(backend)
+        with pytest.raises(DatabaseException):
+            await backend.set("user", 101, "nickname", "alice")
+        # own nickname is not a conflict
+        await backend.set("user", 100, "nickname", "alice")
+
+        record = {"nickname": "alice", "mod": 0, "readonly": 0, "restricted": 0}
+        assert await backend.add_user(102, record) == "alice0"
+        assert await backend.add_user(103, record) == "alice1"
+        assert await backend.add_user(100, record) is None
+
+    run(backend, test)
+
+
+def test_indexes(backend):
+    async def test(backend):
+        await fill(backend)
+        assert sorted(await backend.list_ids("beam")) == ["dev", "main"]
+        assert sorted(await backend.list_ids("wormhole")) == [10, 11, 20]
+        assert sorted(await backend.list_ids("user")) == [100, 101]
+        assert sorted(await backend.list_wormholes("main")) == [10, 11]
+        assert sorted(await backend.list_users_by_wormholes([10, 11])) == [100, 101]
+        assert await backend.list_users_by_wormholes([20]) == [101]
+        assert await backend.list_users_by_wormholes([]) == []
+        assert await backend.list_users_by_flag("mod") == [100]
+        assert await backend.find_user("bob") == 101
+        assert await backend.list_nicknames() == {"alice": 100, "bob": 101}
+
+        await backend.set("user", 101, "nickname", "bobby")
+        await backend.set("user", 100, "mod", 0)
+        assert await backend.find_user("bob") is None
+        assert await backend.find_user("bobby") == 101
+        assert await backend.list_users_by_flag("mod") == []
+
+        await backend.delete("user", 101)
+        assert await backend.find_user("bobby") is None
+        assert await backend.list_users_by_wormholes([20]) == []
+
+    run(backend, test)
+
+
+def test_add_messages_updates_beam_totals(backend):
+    async def test(backend):
+        await fill(backend)
+        # wormhole 99 does not exist and is skipped
+        await backend.add_messages(
+            {10: ("main", 3), 11: ("main", 2), 20: ("dev", 4), 99: ("main", 5)}
+        )
+        assert await beam_messages(backend, "main") == 5
+        assert await beam_messages(backend, "dev") == 4
+        assert strings(await backend.get("wormhole", 10))["messages"] == "3"
+
+        await backend.set("wormhole", 10, "messages", 7)
+        assert await beam_messages(backend, "main") == 9
+
+        await backend.set("wormhole", 10, "beam", "dev")
+        assert await beam_messages(backend, "main") == 2
+        assert await beam_messages(backend, "dev") == 11
+        assert sorted(await backend.list_wormholes("dev")) == [10, 20]
+
+    run(backend, test)
+
+
+def test_beam_change_resets_homes(backend):
+    async def test(backend):
+        await fill(backend)
+        # setting the same beam keeps the homes
+        await backend.set("wormhole", 10, "beam", "main")
+        assert await backend.list_users_by_wormholes([10]) == [100]
+
+        await backend.set("wormhole", 10, "beam", "dev")
+        assert await backend.list_users_by_wormholes([10]) == []
+        assert "home_id:main" not in await backend.get("user", 100)
+        # other homes are kept
+        assert strings(await backend.get("user", 101))["home_id:main"] == "11"
+
+    run(backend, test)
+
+
+def test_wormhole_deletion_cascades(backend):
+    async def test(backend):
+        await fill(backend)
+        await backend.add_messages({11: ("main", 6), 10: ("main", 1)})
+        await backend.delete("wormhole", 11)
+
+        assert await beam_messages(backend, "main") == 1
+        assert await backend.list_wormholes("main") == [10]
+        assert await backend.list_users_by_wormholes([11]) == []
+        user = strings(await backend.get("user", 101))
+        assert "home_id:main" not in user and user["home_id:dev"] == "20"
+
+    run(backend, test)
+
+
+def test_expiring_values(backend):
+    async def test(backend):
+        await backend.set_expiring([("a", "1", 60), ("b", "2", 1)])
+        assert await backend.get_expiring(["a", "x", "b"]) == ["1", None, "2"]
+        assert await backend.get_expiring([]) == []
+
+        await backend.set_expiring([("a", "3", 60)])
+        await backend.delete_expiring(["x"])
+        assert await backend.get_expiring(["a"]) == ["3"]
+        await backend.delete_expiring(["a"])
+        assert await backend.get_expiring(["a"]) == [None]
+
+        await asyncio.sleep(1.1)
+        assert await backend.get_expiring(["b"]) == [None]
+
+    run(backend, test)
+
+
+def test_reindex(backend):
+    async def test(backend):
+        await fill(backend)
+        # restored records replace existing ones without updating beam totals
+        await backend.add_many(
+            "wormhole",
+            [
+                (10, {"beam": "main", "active": 1, "messages": 5}),
+                (30, {"beam": "dev", "messages": 2}),
+            ],
+        )
+        await backend.add_many(
+            "user", [(104, {"nickname": "carol", "mod": 0, "readonly": 1, "restricted": 0})]
+        )
+
+        assert await backend.reindex("beam") == 2
+        assert await backend.reindex("wormhole") == 4
+        assert await backend.reindex("user") == 3
+        assert await beam_messages(backend, "main") == 5
+        assert await beam_messages(backend, "dev") == 2
+        assert sorted(await backend.list_wormholes("dev")) == [20, 30]
+        assert await backend.find_user("carol") == 104
+        assert await backend.list_users_by_flag("readonly") == [104]
+        assert await backend.list_users_by_wormholes([10]) == [100]
+
+    run(backend, test)
+
+
+def test_add_and_delete_check_existence(backend):
+    async def test(backend):
+        await fill(backend)
+        with pytest.raises(DatabaseException):
+            await backend.add("beam", "main", {"active": 1})
+        with pytest.raises(DatabaseException):
+            await backend.add("wormhole", 10, {"beam": "dev"})
+        with pytest.raises(DatabaseException):
+            await backend.add("wormhole", 30, {"beam": "nope"})
+        assert not await backend.exists("wormhole", 30)
+
+        with pytest.raises(DatabaseException):
+            await backend.delete("wormhole", 30)
+        with pytest.raises(DatabaseException):
+            await backend.delete("user", 999)
+        # beams with wormholes are kept
+        with pytest.raises(DatabaseException):
+            await backend.delete("beam", "dev")
+        assert await backend.exists("beam", "dev")
+
+        await backend.delete("wormhole", 20)
+        await backend.delete("beam", "dev")
+        with pytest.raises(DatabaseException):
+            await backend.delete("beam", "dev")
+
+    run(backend, test)
+
+
+def test_sqlite_nicknames_are_unique(tmp_path):
+    path = str(tmp_path / "wormhole.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        'CREATE TABLE users ("discord_id" INTEGER PRIMARY KEY, "nickname" TEXT NOT NULL);'
+        'CREATE INDEX users_nickname ON users ("nickname");'
+        "INSERT INTO users VALUES (1, 'alice'), (2, 'bob');"
+    )
+    conn.close()
+
+    # index of older database files is made unique
+    backend = SQLiteBackend(path)
+    with pytest.raises(sqlite3.IntegrityError):
+        backend.conn.execute("INSERT INTO users (discord_id, nickname) VALUES (3, 'alice')")
+
+    async def test(backend):
+        # restored user with nickname of another one does not replace it
+        with pytest.raises(DatabaseException):
+            await backend.add_many("user", [(3, {"nickname": "bob"})])
+        assert await backend.list_nicknames() == {"alice": 1, "bob": 2}
+        await backend.add_many("user", [(2, {"nickname": "bobby"})])
+        assert await backend.find_user("bobby") == 2
+
+    run(backend, test)
+
+
+def test_sqlite_duplicate_nicknames_are_reported(tmp_path):
+    path = str(tmp_path / "wormhole.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        'CREATE TABLE users ("discord_id" INTEGER PRIMARY KEY, "nickname" TEXT NOT NULL);'
+        'CREATE INDEX users_nickname ON users ("nickname");'
+        "INSERT INTO users VALUES (1, 'alice'), (2, 'alice');"
+    )
+    conn.close()
+    with pytest.raises(DatabaseException):
+        SQLiteBackend(path)
+    # the old index is kept
+    conn = sqlite3.connect(path)
+    indexes = {row[1]: row[2] for row in conn.execute("PRAGMA index_list(users)")}
+    assert indexes["users_nickname"] == 0
+    conn.close()
@@ -0,0 +1,191 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from core import coalescing, objects, routing, tokenizer, wormcog
+from core.runtime import runtime
+
+# seconds copies wait in the tests
+WINDOW = 0.05
+
+
+class Channel:
+    """Destination channel recording delivered and edited messages"""
+
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.delivered = []
+        self.edits = []
+        self.deleted = []
+
+    async def deliver(self, content: str):
+        self.delivered.append(content)
+        return SimpleNamespace(channel=self, id=len(self.delivered), webhook_id=None)
+
+    def get_partial_message(self, message_id: int):
+        channel = self
+
+        class Message:
+            async def edit(self, *, content):
+                channel.edits.append((message_id, content))
+
+            async def delete(self):
+                channel.deleted.append(message_id)
+
+        return Message()
+
+
+def send(coalescer, channel, text, identity=None):
+    return coalescer.send(
+        channel.id, text, window=WINDOW, identity=identity, deliver=channel.deliver
+    )
+
+
+def test_window(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(coalescing.time, "monotonic", lambda: clock.now)
+    coalescer = coalescing.Coalescer()
+
+    # first and rare messages are sent immediately
+    assert coalescer.window("main", 1.0) == 0.0
+    clock.now += 5
+    assert coalescer.window("main", 1.0) == 0.0
+
+    # busy beam waits for about four intervals, up to the maximum
+    windows = []
+    for _ in range(30):
+        clock.now += 0.1
+        windows.append(coalescer.window("main", 1.0))
+    assert windows[0] == 0.0 and windows[-1] == pytest.approx(0.4, abs=0.01)
+    assert max(windows) == 1.0
+
+    # beams have own traffic
+    assert coalescer.window("dev", 1.0) == 0.0
+
+    # quiet beam stops waiting again
+    for _ in range(10):
+        clock.now += 2
+        window = coalescer.window("main", 1.0)
+    assert window == 0.0
+
+
+def test_batch_merging():
+    async def test():
+        coalescer = coalescing.Coalescer()
+        channel, other = Channel(10), Channel(20)
+        parts = await asyncio.gather(
+            send(coalescer, channel, "one\n"),
+            send(coalescer, channel, "two"),
+            send(coalescer, other, "three"),
+            send(coalescer, channel, "four\n"),
+        )
+        assert channel.delivered == ["one\ntwo\nfour"]
+        assert other.delivered == ["three"]
+        assert [part.index for part in parts] == [0, 1, 0, 2]
+        assert parts[0].batch is parts[3].batch and parts[0].channel_id == 10
+        assert len(coalescer) == 0
+
+        # after the window a new batch is started
+        await send(coalescer, channel, "five")
+        assert channel.delivered == ["one\ntwo\nfour", "five"]
+
+        # parts are changed separately
+        bot = SimpleNamespace(get_channel=lambda i: channel)
+        await parts[1].edit(bot, "TWO")
+        await parts[0].delete(bot)
+        assert channel.edits == [(1, "one\nTWO\nfour"), (1, "TWO\nfour")]
+        await parts[1].delete(bot)
+        await parts[3].delete(bot)
+        assert channel.deleted == [1]
+
+    asyncio.run(test())
+
+
+def test_identities_are_not_merged():
+    async def test():
+        coalescer = coalescing.Coalescer()
+        channel = Channel(10)
+        await asyncio.gather(
+            send(coalescer, channel, "a1", "alice"),
+            send(coalescer, channel, "a2", "alice"),
+            send(coalescer, channel, "b1", "bob"),
+            send(coalescer, channel, "a3", "alice"),
+        )
+        assert channel.delivered == ["a1\na2", "b1", "a3"]
+
+    asyncio.run(test())
+
+
+def test_length_limit_splits_batches():
+    async def test():
+        coalescer = coalescing.Coalescer()
+        channel = Channel(10)
+        texts = ["a" * 900, "b" * 900, "c" * 300, "d" * 100]
+        await asyncio.gather(*[send(coalescer, channel, text) for text in texts])
+        assert channel.delivered == ["\n".join(texts[:2]), "\n".join(texts[2:])]
+        assert all(len(content) < coalescing.LIMIT for content in channel.delivered)
+
+    asyncio.run(test())
+
+
+def test_delivery_error_is_raised_to_all_parts():
+    async def test():
+        coalescer = coalescing.Coalescer()
+
+        async def deliver(content):
+            raise ValueError("rejected")
+
+        results = await asyncio.gather(
+            *[
+                coalescer.send(10, text, window=WINDOW, identity=None, deliver=deliver)
+                for text in ("one", "two")
+            ],
+            return_exceptions=True,
+        )
+        assert [type(result) for result in results] == [ValueError, ValueError]
+
+    asyncio.run(test())
+
+
+@pytest.mark.parametrize("uploads, combined", [([], True), (["file"], False)])
+def test_uploads_are_not_combined(monkeypatch, uploads, combined):
+    beam = objects.Beam("main", active=1, replace=0, timeout=0, coalesce=1000)
+    route = routing.Route(
+        beam, objects.Wormhole(1, "main"), [routing.Destination(None, objects.Wormhole(1))]
+    )
+    coalescer = coalescing.Coalescer()
+    # traffic of a busy beam, its copies would wait
+    coalescer._traffic["main"] = coalescing.Traffic(coalescing.time.monotonic(), 0.1)
+    monkeypatch.setattr(runtime, "batches", coalescer)
+
+    async def get_route(channel_id):
+        return route
+
+    async def get_template(beam_name, text):
+        return tokenizer.Template(text, beam_name, [])
+
+    windows = []
+
+    async def replicate(*args):
+        windows.append(args[7])
+
+    async def add_reaction(emoji):
+        pass
+
+    monkeypatch.setattr(runtime.routes, "get", get_route)
+    cog = object.__new__(wormcog.Wormcog)
+    cog._get_template = get_template
+    cog.replicate = replicate
+    me = SimpleNamespace(permissions_in=lambda c: SimpleNamespace(manage_messages=False))
+    message = SimpleNamespace(
+        id=5,
+        channel=SimpleNamespace(id=1),
+        author=SimpleNamespace(id=100),
+        guild=SimpleNamespace(me=me),
+        webhook_id=None,
+        add_reaction=add_reaction,
+    )
+
+    asyncio.run(cog.send(message=message, text="text", uploads=uploads))
+    assert len(windows) == 1 and (windows[0] > 0) == combined
@@ -0,0 +1,45 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+from core import database
+from core.backends.memory import MemoryBackend
+from core.runtime import runtime
+
+from cogs.wormhole import Wormhole
+
+
+def test_failed_flush_keeps_counts(monkeypatch):
+    backend = MemoryBackend()
+    monkeypatch.setattr(database, "backend", backend)
+    counter = database.MessageCounter()
+    monkeypatch.setattr(runtime, "counter", counter)
+    log = []
+
+    async def refuse(pending):
+        raise sqlite3.OperationalError("database is locked")
+
+    async def system(message):
+        log.append(message)
+
+    cog = object.__new__(Wormhole)
+    cog.event = SimpleNamespace(system=system)
+
+    async def test():
+        await backend.add("beam", "main", {"active": 1, "messages": 0})
+        await backend.add("wormhole", 10, {"beam": "main", "messages": 0})
+        counter.add(10, "main", 3)
+
+        # errors of any backend are reported, the loop keeps running
+        with monkeypatch.context() as patch:
+            patch.setattr(backend, "add_messages", refuse)
+            await cog.flush_counter.coro(cog)
+        assert len(log) == 1 and "OperationalError" in log[0]
+        assert counter.get(10) == 3
+
+        counter.add(10, "main", 2)
+        await cog.flush_counter.coro(cog)
+        assert counter.get(10) == 0
+        assert int((await backend.get("wormhole", 10))["messages"]) == 5
+
+    asyncio.run(test())
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from core import database
+from core.backends.memory import MemoryBackend
+from core.database import NicknameIndex
+
+
+@pytest.fixture
+def index():
+    index = NicknameIndex()
+    index.load({"Alice": 1, "alicia": 2, "ALICE": 3, "Bob": 4, "bobby": 5, "Carol": 6})
+    return index
+
+
+def test_exact(index):
+    assert index.get("Alice") == 1
+    assert index.get("alice") is None
+
+
+def test_casefold(index):
+    assert index.get_casefold("alice") == ["ALICE", "Alice"]
+    assert index.get_casefold("BOBBY") == ["bobby"]
+    assert index.get_casefold("bo") == []
+
+
+def test_prefix(index):
+    assert index.get_prefix("ali") == ["ALICE", "Alice", "alicia"]
+    assert index.get_prefix("BOB") == ["Bob", "bobby"]
+    assert index.get_prefix("ali", limit=2) == ["ALICE", "Alice"]
+    assert index.get_prefix("x") == []
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        # trigram similarity
+        ("alicja", ["ALICE", "Alice", "alicia"]),
+        ("caroll", ["Carol"]),
+        # one typo or swap of neighbouring letters
+        ("Alcie", ["ALICE", "Alice"]),
+        ("Crol", ["Carol"]),
+        ("Carlo", ["Carol"]),
+        # too short for typos, nothing similar
+        ("Bbo", []),
+        ("zzzz", []),
+    ],
+)
+def test_similar(index, query, expected):
+    assert index.get_similar(query) == expected
+
+
+def test_similar_threshold(index):
+    # alicia shares 4 of 9 distinct trigrams with alice, similarity 0.44
+    assert "alicia" in index.get_similar("alice", threshold=0.4)
+    assert "alicia" not in index.get_similar("alice", threshold=0.5)
+    # typo matches get the threshold score, so they are kept at any threshold
+    assert index.get_similar("Alcie", threshold=0.9) == ["ALICE", "Alice"]
+
+
+def test_search_order(index):
+    assert index.search("Alice") == ["Alice", "ALICE", "alicia"]
+    assert index.search("Alice", limit=2) == ["Alice", "ALICE"]
+    assert index.search("bob") == ["Bob", "bobby"]
+
+
+def test_add_and_remove(index):
+    index.add("Alison", 7)
+    assert index.get_prefix("alis") == ["Alison"]
+    index.remove("Alison")
+    index.remove("Alison")
+    assert index.get_prefix("alis") == []
+    assert "Alison" not in index.get_similar("Alison")
+    # other nicknames with the same case folded form stay
+    index.remove("ALICE")
+    assert index.get_casefold("alice") == ["Alice"]
+
+
+def test_repository_reloads_index(monkeypatch):
+    monkeypatch.setattr(database, "backend", MemoryBackend())
+    repo_u = database.repo_u
+    repo_u.cache.invalidate()
+    repo_u.nicknames.clear()
+
+    async def test():
+        await repo_u.add(discord_id=1, nickname="alice")
+        assert await repo_u.search_nicknames("alice") == ["alice"]
+
+        # renames through the repository update the loaded index
+        await repo_u.set(1, "nickname", "alicia")
+        assert await repo_u.search_nicknames("alic") == ["alicia"]
+
+        # users added by another process are found after the TTL
+        await database.backend.add_user(2, {"nickname": "alice2"})
+        assert await repo_u.search_nicknames("alice2") == ["alicia"]
+        repo_u.nicknames.expires = 0
+        assert await repo_u.search_nicknames("alice2") == ["alice2", "alicia"]
+
+        # snapshot import reindexes users, which drops the index
+        await database.backend.add_many("user", [(3, {"nickname": "carol"})])
+        await repo_u.reindex()
+        assert await repo_u.search_nicknames("carol") == ["carol"]
+
+    asyncio.run(test())
+    repo_u.nicknames.clear()
+
+
+def test_repository_resolves_tags(monkeypatch):
+    monkeypatch.setattr(database, "backend", MemoryBackend())
+    repo_u = database.repo_u
+    repo_u.cache.invalidate()
+    repo_u.nicknames.clear()
+
+    async def test():
+        for discord_id, nickname in enumerate(["alice", "alicia", "Bob", "bobby", "carol"]):
+            await repo_u.add(discord_id=discord_id + 1, nickname=nickname)
+        assert await repo_u.resolve_nickname("CAROL") == "carol"
+        assert await repo_u.resolve_nickname("car") == "carol"
+        assert await repo_u.resolve_nickname("alic") is None
+        assert await repo_u.resolve_nickname("aliC") is None
+        # case insensitive match goes before prefix
+        assert await repo_u.resolve_nickname("bob") == "Bob"
+        # too short for prefix
+        assert await repo_u.resolve_nickname("ca") is None
+        assert await repo_u.resolve_nickname("dave") is None
+
+    asyncio.run(test())
+    repo_u.nicknames.clear()
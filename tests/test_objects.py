@@ -0,0 +1,24 @@
+import pytest
+
+from core.objects import Beam, User, Wormhole
+
+
+def test_from_record_converts_types():
+    beam = Beam.from_record("main", {"active": "1", "timeout": "30", "anonymity": "guild"})
+    assert (beam.active, beam.timeout, beam.anonymity, beam.replace) == (1, 30, "guild", 1)
+
+    wormhole = Wormhole.from_record(10, {"beam": "main", "messages": "", "logo": "x"})
+    assert (wormhole.beam, wormhole.messages, wormhole.logo) == ("main", 0, "x")
+
+
+def test_user_homes_are_read_only():
+    user = User.from_record(1, {"nickname": "alice", "home_id:main": "10", "home_id:dev": ""})
+    assert dict(user.home_ids) == {"main": 10}
+    with pytest.raises(TypeError):
+        user.home_ids["dev"] = 20
+
+    # users without homes do not share a mutable default
+    assert dict(User(2).home_ids) == {}
+    with pytest.raises(TypeError):
+        User(2).home_ids["main"] = 10
+    assert dict(User(3).home_ids) == {}
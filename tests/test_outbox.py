@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+
+from core import outbox
+
+
+class Clock:
+    """Monotonic clock advanced by sleeps, so rate limits take no real time"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleep = asyncio.sleep
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def fake_sleep(self, delay: float):
+        if delay > 0:
+            self.now += delay
+        await self.sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(outbox.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(outbox.asyncio, "sleep", clock.fake_sleep)
+    return clock
+
+
+@pytest.mark.parametrize("kind", ["bot", "webhook"])
+def test_bucket_refill(clock, kind):
+    capacity, period = outbox.Outbox.limits[kind]
+    interval = period / capacity
+    bucket = outbox.TokenBucket(capacity, period)
+
+    # full bucket allows a burst, then one send per interval
+    assert [bucket.take() for _ in range(capacity)] == [0.0] * capacity
+    assert bucket.take() == pytest.approx(interval)
+    assert bucket.take() == pytest.approx(2 * interval)
+
+    # waiting refills the bucket
+    clock.now += 2 * interval
+    assert bucket.take() == pytest.approx(interval)
+
+    # never over capacity
+    clock.now += 10 * period
+    assert [bucket.take() for _ in range(capacity)] == [0.0] * capacity
+    assert bucket.take() == pytest.approx(interval)
+
+
+@pytest.mark.parametrize("kind", ["bot", "webhook"])
+def test_queue_keeps_order_and_limit(clock, kind):
+    capacity, period = outbox.Outbox.limits[kind]
+    interval = period / capacity
+    start = clock.now
+    sent = []
+
+    def function(i):
+        async def send():
+            sent.append((i, clock.now - start))
+            return i
+
+        return send
+
+    async def test():
+        queues = outbox.Outbox()
+        results = await asyncio.gather(*[queues.send(kind, 10, function(i)) for i in range(8)])
+        assert results == list(range(8))
+
+    asyncio.run(test())
+    assert [i for i, _ in sent] == list(range(8))
+    times = [t for _, t in sent]
+    assert times[:capacity] == [0.0] * capacity
+    assert times[capacity:] == pytest.approx([interval * (i + 1) for i in range(8 - capacity)])
+
+
+def test_errors_are_raised_to_sender(clock):
+    async def fail():
+        raise ValueError("rejected")
+
+    async def ok():
+        return "ok"
+
+    async def test():
+        queues = outbox.Outbox()
+        with pytest.raises(ValueError):
+            await queues.send("bot", 10, fail)
+        # the consumer keeps running
+        assert await queues.send("bot", 10, ok) == "ok"
+        assert queues.totals()[0] == 2
+
+    asyncio.run(test())
+
+
+def test_slow_channel_does_not_block_others(clock):
+    async def test():
+        queues = outbox.Outbox()
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "slow"
+
+        async def fast():
+            return "fast"
+
+        blocked = asyncio.ensure_future(queues.send("bot", 10, slow))
+        waiting = asyncio.ensure_future(queues.send("bot", 10, fast))
+        # other channel, and webhook messages to the same channel, have own queues
+        assert await queues.send("bot", 20, fast) == "fast"
+        assert await queues.send("webhook", 10, fast) == "fast"
+        assert not blocked.done() and not waiting.done()
+        assert len(queues) == 3
+
+        # longest queue first
+        assert queues.get()[0][0] == ("bot", 10)
+
+        release.set()
+        assert await asyncio.gather(blocked, waiting) == ["slow", "fast"]
+
+    asyncio.run(test())
+
+
+def test_cancelled_send_does_not_hang(clock):
+    async def cancelled():
+        raise asyncio.CancelledError()
+
+    async def ok():
+        return "ok"
+
+    async def test():
+        queues = outbox.Outbox()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(queues.send("bot", 10, cancelled), 1)
+        # the consumer keeps running
+        assert await queues.send("bot", 10, ok) == "ok"
+
+        started = asyncio.Event()
+
+        async def blocked():
+            started.set()
+            await asyncio.Event().wait()
+
+        # cancelled consumer cancels the running and the waiting sends
+        sends = [asyncio.ensure_future(queues.send("bot", 20, blocked)) for _ in range(2)]
+        await asyncio.wait_for(started.wait(), 1)
+        dict(queues.get())[("bot", 20)].task.cancel()
+        for send in sends:
+            with pytest.raises(asyncio.CancelledError):
+                await asyncio.wait_for(send, 1)
+
+    asyncio.run(test())
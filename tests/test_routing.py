@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from core import database, routing
+from core.backends.memory import MemoryBackend
+
+
+@pytest.fixture
+def table(monkeypatch):
+    monkeypatch.setattr(database, "backend", MemoryBackend())
+    for repository in (database.repo_b, database.repo_w, database.repo_u):
+        repository.cache.invalidate()
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(routing.time, "monotonic", lambda: clock.now)
+
+    table = routing.RoutingTable()
+    table.channels = {}
+    table.clock = clock
+    table.bot = SimpleNamespace(get_channel=table.channels.get)
+    return table
+
+
+def channel_ids(route):
+    return [d.channel.id if d.channel is not None else None for d in route.destinations]
+
+
+def test_unresolved_channels_are_looked_up_again(table):
+    async def test():
+        await database.repo_b.add(name="main", admin_id=0)
+        for discord_id in (10, 11):
+            await database.repo_w.add(beam="main", discord_id=discord_id)
+        table.channels[10] = SimpleNamespace(id=10)
+
+        route = await table.get(10)
+        assert channel_ids(route) == [10, None]
+
+        # guild of the channel became available
+        table.channels[11] = SimpleNamespace(id=11)
+        assert channel_ids(await table.get(10)) == [10, 11]
+        # routes of the beam share the destinations
+        assert channel_ids(await table.get(11)) == [10, 11]
+        assert table._unresolved == set()
+
+    asyncio.run(test())
+
+
+def test_beams_are_loaded_again_after_ttl(table, monkeypatch):
+    async def test():
+        await database.repo_b.add(name="main", admin_id=0)
+        await database.repo_b.add(name="dev", admin_id=0)
+        await database.repo_w.add(beam="main", discord_id=10)
+        table.channels[10] = SimpleNamespace(id=10)
+        assert (await table.get(10)).beam.name == "main"
+        assert await table.get(20) is None
+
+        # changes by another process are not reported to the table
+        monkeypatch.setattr(database, "listeners", [])
+        await database.repo_w.set(discord_id=10, key="beam", value="dev")
+        await database.repo_w.add(beam="dev", discord_id=20)
+        assert (await table.get(10)).beam.name == "main"
+        assert await table.get(20) is None
+
+        table.clock.now += table.ttl
+        assert (await table.get(10)).beam.name == "dev"
+        assert (await table.get(20)).beam.name == "dev"
+
+    asyncio.run(test())
@@ -0,0 +1,279 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from core import database, sent
+from core.backends.memory import MemoryBackend
+from core.runtime import runtime
+from core.sent import Copy, Entry
+
+from cogs.wormhole import Wormhole
+
+
+def entry(message_id: int, author_id: int = 100, channel_id: int = 1, replaced=False):
+    return Entry(Copy(channel_id, message_id), author_id, replaced)
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = MemoryBackend()
+    monkeypatch.setattr(database, "backend", backend)
+    return backend
+
+
+def wheel_test(test, size: int = 4):
+    """Run the test with a small wheel, which is turned by the test only"""
+    expired = []
+
+    async def main():
+        wheel = sent.TimingWheel(expired.append, size=size)
+        await test(wheel, expired)
+        wheel.task.cancel()
+
+    asyncio.run(main())
+
+
+def tick(wheel: sent.TimingWheel, ticks: int):
+    for _ in range(ticks):
+        wheel.tick()
+
+
+@pytest.mark.parametrize("seconds", [1, 3, 4, 5, 8, 9, 13])
+def test_wheel_expires_after_timeout(seconds):
+    async def test(wheel, expired):
+        item = entry(1)
+        wheel.add(item, seconds)
+        # not a tick early, including timeouts of one or more revolutions
+        tick(wheel, seconds - 1)
+        assert expired == [] and wheel.count == 1
+        tick(wheel, 1)
+        assert expired == [item] and wheel.count == 0
+        # the entry is expired only once
+        tick(wheel, 3 * 4)
+        assert expired == [item]
+
+    wheel_test(test)
+
+
+def test_wheel_wraps_around():
+    async def test(wheel, expired):
+        # cursor in the middle of the wheel
+        tick(wheel, 3)
+        items = [entry(seconds) for seconds in (0, 2, 4, 6, 10)]
+        for item in items:
+            wheel.add(item, item.original.message_id)
+
+        # zero timeout expires on the next tick
+        tick(wheel, 1)
+        assert expired == items[:1]
+        tick(wheel, 1)
+        assert expired == items[:2]
+        tick(wheel, 2)
+        assert expired == items[:3]
+        tick(wheel, 2)
+        assert expired == items[:4]
+        tick(wheel, 3)
+        assert expired == items[:4]
+        tick(wheel, 1)
+        assert expired == items and wheel.count == 0
+
+    wheel_test(test)
+
+
+def test_store_remove_and_expiry(backend):
+    async def test():
+        store = sent.SentStore()
+        first, second = entry(1), entry(2)
+        store.add(first, 60)
+        store.add(second, 60)
+        assert store.last(100, 1) is second and len(store) == 2
+        assert store.last(100, 2) is None and store.last(101, 1) is None
+
+        # the previous message is the last one after removal
+        store.remove(second)
+        assert store.last(100, 1) is first
+        assert await store.find(2) is None
+
+        # removing an expired entry does nothing
+        tick(store._wheel, 60)
+        assert first.removed and store.last(100, 1) is None and len(store) == 0
+        store.remove(first)
+        store.remove(second)
+        assert len(store) == 0
+        store._wheel.task.cancel()
+
+    asyncio.run(test())
+
+
+def test_store_finds_entries(backend):
+    async def test():
+        store = sent.SentStore()
+        entries = [entry(1), entry(2, author_id=101), entry(3, replaced=True)]
+        for item in entries:
+            store.add(item, 60)
+        entries[0].copies.append(Copy(10, 11))
+
+        assert await store.find(1) is entries[0]
+        # replaced originals are found only as the last message of the author
+        assert await store.find_many([3, 2, 9]) == [None, entries[1], None]
+        assert store.last(100, 1) is entries[2]
+        assert await store.find_last(101, 1) is entries[1]
+        store._wheel.task.cancel()
+
+    asyncio.run(test())
+
+
+def test_store_reads_database(backend):
+    async def test():
+        store = sent.SentStore()
+        item = entry(1)
+        item.copies += [Copy(10, 11), Copy(20, 21, webhook=True)]
+        store.add(item, 60)
+        store.save(item, 60)
+        await store._writer
+        store._wheel.task.cancel()
+
+        # another process
+        other = sent.SentStore()
+        found = await other.find(1)
+        assert found is not item
+        assert (found.author_id, found.original, found.copies) == (100, item.original, item.copies)
+        last = await other.find_last(100, 1)
+        assert last.original.message_id == 1
+        assert await other.find_last(100, 2) is None
+
+        # removed entries are not written
+        removed = entry(2)
+        removed.removed = True
+        other.save(removed, 60)
+        await other._writer
+        assert await other.find(2) is None
+
+    asyncio.run(test())
+
+
+def test_entry_encoding():
+    item = entry(5, replaced=True)
+    item.copies += [Copy(10, 11), Copy(20, 21, webhook=True), object()]
+    assert item.encode() == "100 1 1 10:11 20:21:w"
+    decoded = Entry.decode(5, item.encode())
+    assert decoded.original == item.original and decoded.replaced
+    assert decoded.copies == item.copies[:2]
+
+
+def test_store_forget(backend):
+    async def test():
+        store = sent.SentStore()
+        for item in (entry(1), entry(2), entry(3, channel_id=2)):
+            store.add(item, 60)
+            store.save(item, 60)
+        await store._writer
+
+        # older message keeps the newer one as the last
+        await store.forget(await store.find(1))
+        assert await backend.get_expiring(["sent:1", "sent:last:100:1"]) == [None, "2"]
+
+        # the last message is forgotten everywhere, also in other processes
+        await store.forget(await store.find(2))
+        assert await backend.get_expiring(["sent:2", "sent:last:100:1"]) == [None, None]
+        assert await sent.SentStore().find_last(100, 1) is None
+        assert (await sent.SentStore().find_last(100, 2)).original.message_id == 3
+        store._wheel.task.cancel()
+
+    asyncio.run(test())
+
+
+def test_store_keeps_entries_after_write_error(backend, monkeypatch):
+    log = []
+
+    class Channel:
+        async def send(self, message):
+            log.append(message)
+
+    async def refuse(values):
+        raise ConnectionError("database is down")
+
+    async def test():
+        store = sent.SentStore()
+        store.bot = SimpleNamespace(get_channel=lambda i: Channel())
+        with monkeypatch.context() as patch:
+            patch.setattr(backend, "set_expiring", refuse)
+            store.save(entry(1), 60)
+            await store._writer
+        assert store._writer.exception() is None
+        assert len(log) == 1 and "ConnectionError" in log[0]
+        assert await store.find(1) is None
+
+        # written with the next entry
+        store.save(entry(2), 60)
+        await store._writer
+        assert [e.original.message_id for e in await store.find_many([1, 2])] == [1, 2]
+
+    asyncio.run(test())
+
+
+def test_store_knows_own_messages(backend):
+    async def test():
+        store = sent.SentStore()
+        item, replaced = entry(1), entry(2, replaced=True)
+        store.add(item, 60)
+        store.add(replaced, 60)
+        assert store.is_own(2) and not store.is_own(1)
+        # copies are known once the entry is saved
+        item.copies += [Copy(10, 11), Copy(20, 21)]
+        replaced.copies += [Copy(10, 21)]
+        store.save(item, 60)
+        store.save(replaced, 60)
+        assert all(store.is_own(i) for i in (2, 11, 21))
+
+        # message shared by both entries is own until both are removed
+        store.remove(item)
+        assert store.is_own(21) and not store.is_own(11)
+        await store.forget(replaced)
+        assert store._own == {}
+        await store._writer
+        store._wheel.task.cancel()
+
+    asyncio.run(test())
+
+
+def test_deleted_copies_are_not_looked_up(backend, monkeypatch):
+    lookups = []
+
+    async def get_route(channel_id):
+        lookups.append(channel_id)
+
+    store = sent.SentStore()
+    monkeypatch.setattr(runtime, "sent", store)
+    monkeypatch.setattr(runtime.routes, "get", get_route)
+    cog = object.__new__(Wormhole)
+
+    async def test():
+        item = entry(1, replaced=True)
+        item.copies.append(Copy(10, 11))
+        store.add(item, 60)
+        store.save(item, 60)
+
+        def deleted(message_id):
+            return SimpleNamespace(message_id=message_id, channel_id=10, cached_message=None)
+
+        for message_id in (1, 11):
+            await cog.on_raw_message_delete(deleted(message_id))
+        await cog.on_raw_bulk_message_delete(
+            SimpleNamespace(message_ids={1, 11}, channel_id=10, cached_messages=[])
+        )
+        assert lookups == []
+        await cog.on_raw_message_delete(deleted(12))
+        assert lookups == [10]
+
+        edited = SimpleNamespace(
+            message_id=13, channel_id=10, cached_message=None, data={"content": "x"}
+        )
+        edited.data["webhook_id"] = "5"
+        await cog.on_raw_message_edit(edited)
+        assert lookups == [10]
+        await store._writer
+        store._wheel.task.cancel()
+
+    asyncio.run(test())
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from core import database, tokenizer
+from core.backends.memory import MemoryBackend
+from core.objects import User
+
+from benchmarks import process
+
+
+@pytest.mark.parametrize(
+    "content, markup",
+    [
+        ("plain text", []),
+        ("<@100> <@!101>", [(tokenizer.USER, "100"), (tokenizer.USER, "101")]),
+        ("<@&7>", [(tokenizer.ROLE, "7")]),
+        ("in <#8>.", [(tokenizer.CHANNEL, "8")]),
+        ("<:wave:3><:gone:4>", [(tokenizer.EMOJI, "wave:3"), (tokenizer.EMOJI, "gone:4")]),
+        ("x ```py y", [(tokenizer.FENCE, "```py")]),
+        # not markup
+        ("<@name> <:no:> <a:anim:5> <#x>", []),
+    ],
+)
+def test_tokenize(content, markup):
+    tokens = tokenizer.tokenize(content)
+    assert "".join(tokens) == content
+    assert [tokenizer.parse(token) for token in tokens[1::2]] == markup
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        ("", "F:\n"),
+        ("one", "F:one\n"),
+        ("one\ntwo", "F:one\nP:two\n"),
+        # trailing newline and empty lines get the prefix, too
+        ("one\n", "F:one\nP:\n"),
+        ("one\n\nthree", "F:one\nP:\nP:three\n"),
+        # first prefix goes on its own line before a code block
+        ("```py\ncode\n```\nafter", "F:\n```py\ncode\n```\nP:after\n"),
+        ("text\n```py\ncode\n  more\n```", "F:text\n```py\ncode\n  more\n```\n"),
+        # one line code block ends on the same line
+        ("```py x```\nnext", "F:\n```py x```\nP:next\n"),
+    ],
+)
+def test_format_lines(content, expected):
+    assert tokenizer.format_lines(content, "F:", "P:") == expected
+
+
+def test_format_lines_keeps_long_text():
+    content = "word " * 400 + "\n" + "x" * 1100
+    result = tokenizer.format_lines(content, "F:", "P:")
+    assert result == "F:" + "word " * 400 + "\nP:" + "x" * 1100 + "\n"
+
+
+# the benchmark's users are user0…user49 with IDs 100…149; emojis with odd IDs exist
+MESSAGES = [
+    "hello",
+    "hi <@100> and <@!101>, again <@100>",
+    "<@&7> in <#8> and <#9>",
+    "<:wave:3> <:gone:4> <:gone:4>",
+    "look ```py\nprint(1)\n``` done",
+    "```\ncode <@102>\n```",
+    "```py\ncode\n```\nafter",
+    "line one\nline two\n",
+    "\n\nempty lines",
+    "@everyone ((user1)) (( user2 ))",
+    "a" * 1500,
+    "<@103> " * 300,
+]
+
+
+@pytest.fixture
+def cog(monkeypatch):
+    monkeypatch.setattr(database, "backend", MemoryBackend())
+    for repository in (database.repo_b, database.repo_w, database.repo_u):
+        repository.cache.invalidate()
+    asyncio.run(process.fill())
+    return process.create_cog()
+
+
+def test_process_matches_previous_implementation(cog):
+    async def test():
+        for content in MESSAGES:
+            message = process.create_message(0)
+            message.content = content
+            previous = await process.legacy_process(cog, message)
+            current = await process.Wormhole._process(cog, message)
+            assert current == previous, content
+
+    asyncio.run(test())
+
+
+def test_process_resolves_markup(cog):
+    async def test():
+        message = process.create_message(0)
+        message.content = "<@!101> <@&7> <#8> <:wave:3> <:gone:4> @here"
+        content = await process.Wormhole._process(cog, message)
+        assert content.endswith(
+            "((user1)) role7 __**Guild/channel8**__ <:wave:3> :gone: @\u200bhere\n"
+        )
+
+    asyncio.run(test())
+
+
+def test_template_renders_tags_per_destination():
+    alice = User(1, nickname="alice", home_ids={"main": 10})
+    carol = User(3, nickname="carol", home_ids={"main": 11})
+    # home in another beam only
+    bob = User(2, nickname="bob", home_ids={"dev": 10})
+    text = "hi ((alice)), ((carol)) and ((bob)); ((nobody)) ((alice))!"
+    template = tokenizer.Template(text, "main", [alice, carol, bob])
+
+    outside = ["hi ", ", ", " and ((bob)); ((nobody)) ", "!"]
+    expected = {
+        10: ["<@!1>", "**__carol__**", "<@!1>"],
+        11: ["**__alice__**", "<@!3>", "**__alice__**"],
+        12: ["**__alice__**", "**__carol__**", "**__alice__**"],
+    }
+    # text outside of the tag slots is the same for every destination
+    for wormhole_id, slots in expected.items():
+        rendered = "".join(x + y for x, y in zip(outside, slots + [""]))
+        assert template.render(wormhole_id) == rendered
+    # destinations without tagged users share one string
+    assert template.render(12) is template.render(13)
+
+
+def test_template_without_tags_is_the_text():
+    text = "no tags ((unknown))"
+    template = tokenizer.Template(text, "main", [User(1, nickname="alice")])
+    assert template.render(10) is text
+    assert template.homes == {}
+
+
+def test_template_resolves_aliases():
+    alice = User(1, nickname="alice", home_ids={"main": 10})
+    text = "hi ((Alice)) and ((ali))"
+    template = tokenizer.Template(text, "main", [alice], {"Alice": "alice", "ali": "alice"})
+    assert template.render(10) == "hi <@!1> and <@!1>"
+    assert template.render(11) == "hi **__alice__** and **__alice__**"
@@ -0,0 +1,123 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from core import webhooks
+
+BOT_ID = 1
+
+
+def response(status: int):
+    return SimpleNamespace(status=status, reason="")
+
+
+class Hook:
+    def __init__(self, channel: "Channel"):
+        self.channel = channel
+        self.token = "token"
+        self.user = SimpleNamespace(id=BOT_ID)
+
+    async def send(self, content, *, username, **kwargs):
+        if self not in self.channel.hooks:
+            raise discord.NotFound(response(404), "Unknown Webhook")
+        self.channel.sent.append((content, username))
+        return SimpleNamespace(id=len(self.channel.sent))
+
+
+class Channel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.guild = SimpleNamespace(me=SimpleNamespace(id=BOT_ID))
+        self.hooks = []
+        self.sent = []
+        self.allowed = True
+        self.lookups = 0
+
+    async def webhooks(self):
+        self.lookups += 1
+        if not self.allowed:
+            raise discord.Forbidden(response(403), "Missing Permissions")
+        await asyncio.sleep(0)
+        return list(self.hooks)
+
+    async def create_webhook(self, *, name, reason):
+        hook = Hook(self)
+        self.hooks.append(hook)
+        return hook
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(webhooks.time, "monotonic", lambda: clock.now)
+    return clock
+
+
+def send(pool, channel, content="text"):
+    return pool.send(channel, content, username="alice", avatar_url=None)
+
+
+def test_concurrent_sends_create_one_webhook(clock):
+    async def test():
+        pool, channel = webhooks.WebhookPool(), Channel(10)
+        await asyncio.gather(*[send(pool, channel, str(i)) for i in range(10)])
+        assert len(channel.hooks) == 1 and len(channel.sent) == 10
+        assert channel.lookups == 1
+
+    asyncio.run(test())
+
+
+def test_removed_webhook_is_replaced_before_send(clock):
+    async def test():
+        pool, channel = webhooks.WebhookPool(), Channel(10)
+        await send(pool, channel)
+        channel.hooks.clear()
+
+        # kept webhook is used until it is validated
+        clock.now += webhooks.VALIDATE - 1
+        assert await pool.get(channel) is not None and channel.lookups == 1
+        clock.now += 1
+        webhook = await pool.get(channel)
+        assert channel.lookups == 2 and channel.hooks == [webhook]
+
+        # webhooks update event drops the webhook at once
+        channel.hooks.clear()
+        pool.invalidate(channel.id)
+        assert await send(pool, channel) is not None
+        assert channel.lookups == 3 and len(channel.hooks) == 1
+
+    asyncio.run(test())
+
+
+def test_send_retries_with_new_webhook(clock):
+    async def test():
+        pool, channel = webhooks.WebhookPool(), Channel(10)
+        await send(pool, channel, "first")
+        channel.hooks.clear()
+        assert await send(pool, channel, "second") is not None
+        assert channel.sent == [("first", "alice"), ("second", "alice")]
+        assert len(channel.hooks) == 1
+
+    asyncio.run(test())
+
+
+def test_forbidden_channel_falls_back_to_bot(clock):
+    async def test():
+        pool, channel = webhooks.WebhookPool(), Channel(10)
+        await send(pool, channel)
+
+        # permission taken away: the validation fails and the bot sends
+        channel.allowed = False
+        clock.now += webhooks.VALIDATE
+        assert await send(pool, channel) is None
+        assert len(pool) == 0
+
+        # the channel is not asked again until the retry time
+        channel.allowed = True
+        assert await send(pool, channel) is None and channel.lookups == 2
+        clock.now += webhooks.RETRY
+        assert await send(pool, channel) is not None and channel.lookups == 3
+
+    asyncio.run(test())